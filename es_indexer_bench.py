@@ -0,0 +1,476 @@
+# The contents of this file are subject to the Mozilla Public License
+# Version 2.0 (the "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+# https://www.mozilla.org/en-US/MPL/2.0/
+
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either expressed or implied. See the License for
+# the specific language governing rights and limitations under the License.
+
+# The Initial Developers of the Original Code are:
+# Copyright (c) 2019-2020, CR-Solutions (https://www.cr-solutions.net), Ricardo Cescon
+# Contributor(s): Steffen Blaszkowski, PantherMedia (https://www.panthermedia.net)
+# All Rights Reserved.
+
+"""
+offline benchmark of es_indexer, runs an es_indexer_session against a synthetic MySQL table (pymysql compatible
+stub) and a local fake Elasticsearch _bulk endpoint, reports the throughput per stage
+
+$ python3 es_indexer_bench.py --rows 20000 --columns 12 --string-size 64 --json-ratio 0.25
+$ python3 es_indexer_bench.py --mode full --pipeline 4 --compression --es-delay 0.02 --repeat 3
+$ python3 es_indexer_bench.py --import-time --repeat 10
+"""
+
+import argparse, datetime, gzip, json, os, random, re, shutil, statistics, string, subprocess, sys, tempfile, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pymysql
+import es_indexer_lib
+from pymysql.constants import FIELD_TYPE
+
+
+STAGES = ('sql_select', 'mapping', 'es_bulk', 'compress', 'sql_update')
+
+# cold start in a new interpreter, import of es_indexer_lib, config of a session and its first HTTP session
+COLD_START = '''
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+tick = time.perf_counter()
+import es_indexer_lib
+loaded = time.perf_counter()
+session = es_indexer_lib.es_indexer_session('file://', sys.argv[2], 'bench', 1000, 'bench.json')
+configured = time.perf_counter()
+session._httpSession()
+connected = time.perf_counter()
+modules = [name for name in ('boto3', 'botocore', 'pymysql', 'requests', 'urllib3', 'orjson', 'html', 'gzip',
+                             'concurrent.futures') if name in sys.modules]
+print(json.dumps({'import': loaded - tick, 'config': configured - loaded, 'http': connected - configured,
+                  'modules': modules}))
+'''
+
+###########################################################
+###########################################################
+###########################################################
+
+
+
+class bench_table:
+   """
+   synthetic table mydb.bench, id, num, string columns c<n>, JSON columns json_<n> and date_changed,
+   rows with a last-modified timestamp != 1970 are pending until they are reset
+   """
+
+   def __init__(self, rows: int, columns: int, string_size: int, json_ratio: float, dirty_ratio: float,
+                seed: int = 1):
+      rnd = random.Random(seed)
+
+      json_columns = int(round(columns * json_ratio))
+      self.columns = ['c' + str(i) for i in range(0, columns - json_columns)] + \
+                     ['json_' + str(i) for i in range(0, json_columns)]
+
+      letters = string.ascii_letters + string.digits + '     '
+      dirty = ['ü', '&amp;', '"', '\\', '\n', '&#x41;']
+      changed = datetime.datetime(2020, 1, 1, 12, 0, 0)
+
+      self.rows = []
+      for pk in range(1, rows + 1):
+         row = [pk, rnd.randint(0, 1000000)]
+         for column in self.columns:
+            if column.startswith('json_'):
+               row.append(json.dumps({'id': pk, 'tags': [rnd.choice(letters) * 3 for x in range(0, 3)],
+                                      'text': ''.join(rnd.choice(letters) for x in range(0, string_size // 2))}))
+            else:
+               text = ''.join(rnd.choice(letters) for x in range(0, string_size))
+               if rnd.random() < dirty_ratio:
+                  text = rnd.choice(dirty) + text + rnd.choice(dirty)
+               row.append(text)
+         row.append(changed)
+         self.rows.append(tuple(row))
+
+      self.pending = dict.fromkeys(range(1, rows + 1))
+      self.lock = threading.Lock()
+
+   ###########################################################
+
+   def description(self, last_key: bool):
+      description = [('id_user', FIELD_TYPE.LONG, None, 11, 11, 0, False),
+                     ('num', FIELD_TYPE.LONG, None, 11, 11, 0, True)]
+      for column in self.columns:
+         if column.startswith('json_'):
+            description.append((column, FIELD_TYPE.JSON, None, 4294967295, 4294967295, 0, True))
+         else:
+            description.append((column, FIELD_TYPE.VAR_STRING, None, 1020, 1020, 0, True))
+      description.append(('date_changed', FIELD_TYPE.DATETIME, None, 19, 19, 0, False))
+      if last_key:
+         description.append(('es_indexer_last_key', FIELD_TYPE.LONG, None, 11, 11, 0, False))
+
+      return description
+
+   ###########################################################
+
+   def select(self, query: str):
+      limit = re.search(r' LIMIT (\d+)(?:, (\d+))?$', query)
+      offset = 0
+      count = None
+      if limit is not None:
+         if limit.group(2) is None:
+            count = int(limit.group(1))
+         else:
+            offset = int(limit.group(1))
+            count = int(limit.group(2))
+
+      last_key = query.find(' AS es_indexer_last_key') != -1
+
+      if query.find('!= "1970-01-01 00:00:00"') != -1:  # incremental
+         with self.lock:
+            keys = list(self.pending.keys())
+      else:
+         low = re.search(r'\.id >(=?) (\d+)', query)
+         high = re.search(r'\.id <= (\d+)', query)
+         first = 1
+         if low is not None:
+            first = int(low.group(2)) + (0 if low.group(1) == '=' else 1)
+         last = len(self.rows)
+         if high is not None:
+            last = min(last, int(high.group(1)))
+         keys = range(max(1, first), last + 1)
+
+      if count is not None:
+         keys = keys[offset:offset + count]
+
+      rows = [self.rows[pk - 1] for pk in keys]
+      if last_key:
+         rows = [row + (row[0],) for row in rows]
+
+      return self.description(last_key), rows
+
+   ###########################################################
+
+   def reset(self, keys):
+      with self.lock:
+         for key in keys:
+            self.pending.pop(key, None)
+
+###########################################################
+###########################################################
+###########################################################
+
+
+
+class bench_cursor:
+   """
+   pymysql compatible cursor of the bench_table, for Cursor and SSCursor
+   """
+
+   def __init__(self, connection):
+      self.connection = connection
+      self.description = None
+      self.rowcount = 0
+      self._rows = []
+      self._pos = 0
+      self._defer_warnings = False
+
+   def execute(self, query, args=None):
+      if self.connection.delay > 0:
+         time.sleep(self.connection.delay)
+
+      query = query.strip()
+      if query.upper().startswith('SELECT'):
+         self.description, self._rows = self.connection.table.select(query)
+      elif query.upper().startswith('UPDATE'):
+         if args is not None:
+            self.connection.table.reset(args if isinstance(args, (list, tuple)) else [args])
+         self._rows = []
+      else:
+         raise pymysql.err.ProgrammingError(1064, 'bench stub does not support: ' + query[0:60])
+
+      self._pos = 0
+      self.rowcount = len(self._rows)
+      return self.rowcount
+
+   def executemany(self, query, args):
+      for item in args:
+         self.execute(query, item)
+
+   def fetchone(self):
+      if self._pos >= len(self._rows):
+         return None
+      self._pos += 1
+      return self._rows[self._pos - 1]
+
+   def fetchmany(self, size=1):
+      rows = self._rows[self._pos:self._pos + size]
+      self._pos += len(rows)
+      return rows
+
+   def fetchall(self):
+      return self.fetchmany(len(self._rows) - self._pos)
+
+   def close(self):
+      pass
+
+###########################################################
+###########################################################
+###########################################################
+
+
+
+class bench_connection:
+   def __init__(self, table: bench_table, delay: float):
+      self.table = table
+      self.delay = delay
+      self.open = True
+
+   def cursor(self, cursor=None):
+      return bench_cursor(self)
+
+   def begin(self):
+      pass
+
+   def commit(self):
+      pass
+
+   def rollback(self):
+      pass
+
+   def ping(self, reconnect=True):
+      return True
+
+   def close(self):
+      self.open = False
+
+###########################################################
+###########################################################
+###########################################################
+
+
+
+class bench_es_handler(BaseHTTPRequestHandler):
+   """
+   fake Elasticsearch, every document of a bulk is acknowledged after delay seconds
+   """
+
+   protocol_version = 'HTTP/1.1'
+
+   delay = 0.0
+
+   def log_message(self, format, *args):
+      pass
+
+   def _send(self, status, body=b'{}'):
+      self.send_response(status)
+      self.send_header('Content-Type', 'application/json')
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      if self.command != 'HEAD':
+         self.wfile.write(body)
+
+   def do_HEAD(self):
+      self._send(200)
+
+   def do_GET(self):
+      self._send(200)
+
+   def do_POST(self):
+      self.do_PUT()
+
+   def do_PUT(self):
+      body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+      if not self.path.endswith('/_bulk'):
+         return self._send(200)
+
+      if self.headers.get('Content-Encoding') == 'gzip':
+         body = gzip.decompress(body)
+
+      if self.delay > 0:
+         time.sleep(self.delay)
+
+      item = b'{"index":{"_index":"bench","_id":"0","_version":1,"result":"created","status":201}}'
+      items = body.count(b'\n') // 2
+      self._send(200, b'{"took":1,"errors":false,"items":[' + b','.join([item] * items) + b']}')
+
+###########################################################
+###########################################################
+###########################################################
+
+
+
+def bench_config(endpoint: str, table: bench_table, args) -> dict:
+   mapping = {'_id': '$id_user', '_type': '_doc', 'id_user': '$id_user', 'num': '$num', 'changed': '$date_changed'}
+   for column in table.columns:
+      mapping[column] = '$' + column
+
+   es = {'endpoint': endpoint, 'timeout': 30, 'pipeline': args.pipeline, 'compression': args.compression,
+         'adaptive': args.adaptive, 'json_backend': args.json_backend}
+
+   return {
+      'rds': {'endpoint': 'localhost:3306', 'user': 'bench', 'password': 'bench',
+              'reset_strategy': args.reset_strategy},
+      'es': es,
+      'sql': {'last-modified-timestamp-field': 'mydb.bench.date_changed',
+              'last-modified-timestamp-upd-key': 'id=$id_user',
+              'sort': '',
+              'additional-primary-key-for-full-indexing': 'mydb.bench.id',
+              'full-indexing-keyset': True,
+              'data': [{'schema': 'mydb', 'table': 'bench',
+                        'fields': ['id AS id_user', 'num'] + table.columns + ['date_changed']}]},
+      'mapping': mapping
+   }
+
+###########################################################
+
+def bench_run(args, endpoint: str, folder: str):
+   table = bench_table(args.rows, args.columns, args.string_size, args.json_ratio, args.dirty_ratio)
+
+   with open(os.path.join(folder, 'bench.json'), 'w') as hFile:
+      json.dump(bench_config(endpoint, table, args), hFile)
+
+   connect = pymysql.connect
+   pymysql.connect = lambda **kwargs: bench_connection(table, args.db_delay)
+
+   # the config folder is relative to the parent folder of es_indexer_lib
+   parent = os.path.realpath(os.path.dirname(os.path.abspath(es_indexer_lib.__file__)) + '/..')
+
+   try:
+      tick = time.time()
+
+      with es_indexer_lib.es_indexer_session('file://', os.path.relpath(folder, parent), 'bench', args.bulklimit,
+                                             'bench.json', stream=args.stream) as session:
+         if args.mode == 'full':
+            measure = session.drain(0)
+         else:
+            measure = session.drain()
+
+      measure['wall'] = time.time() - tick
+   finally:
+      pymysql.connect = connect
+
+   return measure
+
+###########################################################
+
+def bench_report(results: list, args):
+   rows = statistics.median([measure['indexed'] for measure in results])
+   wall = statistics.median([measure['wall'] for measure in results])
+   size = statistics.median([measure['bytes'] for measure in results])
+   sent = statistics.median([measure['bytes_sent'] for measure in results])
+
+   print('rows %d, columns %d (JSON %d%%), string size %d, bulklimit %d, mode %s, pipeline %d, runs %d' % (
+      args.rows, args.columns, int(args.json_ratio * 100), args.string_size, args.bulklimit, args.mode,
+      args.pipeline, len(results)))
+   print('')
+   print('%-12s %10s %14s %10s' % ('stage', 'sec', 'rows/sec', 'MB/sec'))
+
+   for stage in STAGES:
+      seconds = [measure['timings'][stage] for measure in results if stage in measure['timings']]
+      if len(seconds) == 0:
+         continue
+
+      elapsed = statistics.median(seconds)
+      mb = ''
+      if stage in ('es_bulk', 'compress') and elapsed > 0:
+         mb = '%.1f' % (size / 1024.0 / 1024.0 / elapsed)
+
+      print('%-12s %10.3f %14.0f %10s' % (stage, elapsed, rows / elapsed if elapsed > 0 else 0, mb))
+
+   print('%-12s %10.3f %14.0f %10.1f' % ('wall', wall, rows / wall if wall > 0 else 0, size / 1024.0 / 1024.0 / wall))
+   print('')
+   print('bulks %d, bytes %d, bytes sent %d, failed %d' % (results[0]['bulks'], size, sent, results[0]['failed']))
+
+###########################################################
+
+def bench_import_time(args, endpoint: str, folder: str):
+   """
+   cold start phases in new interpreters and the slowest imports via python -X importtime
+   """
+
+   table = bench_table(1, args.columns, args.string_size, args.json_ratio, args.dirty_ratio)
+   with open(os.path.join(folder, 'bench.json'), 'w') as hFile:
+      json.dump(bench_config(endpoint, table, args), hFile)
+
+   libdir = os.path.dirname(os.path.abspath(es_indexer_lib.__file__))
+   relfolder = os.path.relpath(folder, os.path.realpath(libdir + '/..'))
+
+   results = []
+   for x in range(0, max(1, args.repeat)):
+      proc = subprocess.run([sys.executable, '-c', COLD_START, libdir, relfolder], stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+      if proc.returncode != 0:
+         raise UserWarning('cold start failed - ' + proc.stderr)
+      results.append(json.loads(proc.stdout.strip().split("\n")[-1]))
+
+   proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import sys; sys.path.insert(0, sys.argv[1]); '
+                          'import es_indexer_lib', libdir], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                         universal_newlines=True)
+
+   imports = []
+   for line in proc.stderr.split("\n"):
+      match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)', line)
+      if match is not None:
+         imports.append((int(match.group(2)), int(match.group(1)), len(match.group(3)) // 2, match.group(4)))
+
+   print('cold start, %d runs (median sec.)' % len(results))
+   print('')
+   for phase in ('import', 'config', 'http'):
+      print('%-12s %10.4f' % (phase, statistics.median([result[phase] for result in results])))
+   print('%-12s %10.4f' % ('total', statistics.median([result['import'] + result['config'] + result['http']
+                                                      for result in results])))
+   print('')
+   print('loaded after the first HTTP session: ' + ', '.join(results[0]['modules']))
+   print('')
+   print('slowest imports of es_indexer_lib (python -X importtime)')
+   print('%12s %12s  %s' % ('cumulative', 'self', 'module'))
+   for cumulative, own, level, name in sorted(imports, reverse=True)[0:15]:
+      print('%10.1fms %10.1fms  %s' % (cumulative / 1000.0, own / 1000.0, '  ' * level + name))
+
+###########################################################
+
+def main():
+   parser = argparse.ArgumentParser(description='offline benchmark of es_indexer')
+   parser.add_argument('--rows', type=int, default=20000)
+   parser.add_argument('--columns', type=int, default=10, help='string and JSON columns')
+   parser.add_argument('--string-size', type=int, default=64)
+   parser.add_argument('--json-ratio', type=float, default=0.2, help='part of the columns with JSON')
+   parser.add_argument('--dirty-ratio', type=float, default=0.1, help='part of the strings with HTML/non ASCII')
+   parser.add_argument('--bulklimit', type=int, default=1000)
+   parser.add_argument('--mode', choices=['incremental', 'full'], default='incremental')
+   parser.add_argument('--stream', action='store_true')
+   parser.add_argument('--pipeline', type=int, default=0)
+   parser.add_argument('--compression', action='store_true')
+   parser.add_argument('--adaptive', action='store_true')
+   parser.add_argument('--json-backend', choices=['auto', 'orjson', 'json'], default='auto')
+   parser.add_argument('--reset-strategy', choices=['single', 'in'], default='in')
+   parser.add_argument('--es-delay', type=float, default=0.0, help='latency of the fake _bulk endpoint in sec.')
+   parser.add_argument('--db-delay', type=float, default=0.0, help='latency per SQL statement in sec.')
+   parser.add_argument('--repeat', type=int, default=1)
+   parser.add_argument('--json', action='store_true', help='print the measure of every run as JSON')
+   parser.add_argument('--import-time', action='store_true', help='cold start and import time of es_indexer_lib')
+   args = parser.parse_args()
+
+   bench_es_handler.delay = args.es_delay
+   server = ThreadingHTTPServer(('127.0.0.1', 0), bench_es_handler)
+   threading.Thread(target=server.serve_forever, daemon=True).start()
+   endpoint = 'http://127.0.0.1:' + str(server.server_address[1])
+
+   folder = tempfile.mkdtemp(prefix='es_indexer_bench_')
+
+   try:
+      if args.import_time:
+         return bench_import_time(args, endpoint, folder)
+
+      results = [bench_run(args, endpoint, folder) for x in range(0, max(1, args.repeat))]
+   finally:
+      server.shutdown()
+      shutil.rmtree(folder, ignore_errors=True)
+
+   if args.json:
+      print(json.dumps(results, indent=3, default=str))
+   else:
+      bench_report(results, args)
+
+
+if __name__ == '__main__':
+   main()
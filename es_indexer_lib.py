@@ -13,11 +13,28 @@
 # All Rights Reserved.
 
 
-import pymysql
-from pymysql._compat import text_type
+# pymysql, requests, boto3 etc. are imported where they are used, an AWS Lambda cold start or a file:// config
+# does not pay for the import of boto3, see es_indexer_bench.py --import-time
+import json, inspect, os, re, datetime, time, collections, warnings, threading, contextlib, random, decimal, functools, bisect
 
-import boto3, json, traceback, urllib3, requests, inspect, os, sys, re, datetime, time, collections, warnings, html
-from requests.auth import HTTPBasicAuth
+
+# measure of the last run, see es_indexer.measure()
+ES_INDEXER_MEASURE = {}
+
+# parsed configs per source, reused by warm AWS Lambda containers, see es_config
+ES_INDEXER_CONFIG_CACHE = {}
+
+# S3 client for the configs, created once per process
+ES_INDEXER_S3 = None
+
+# indices known to exist, cached per process and reused by warm AWS Lambda containers
+ES_INDEXER_INDEX_EXISTS = set()
+
+# document hash caches per file and process, see es_hash_cache
+ES_INDEXER_HASH_CACHES = {}
+
+# metrics per labels (index) and process, cumulative over all runs, see es_metrics.open
+ES_INDEXER_METRICS = {}
 
 
 ###########################################################
@@ -26,820 +43,4203 @@ from requests.auth import HTTPBasicAuth
 
 
 
-class es_indexer:
-   s3bucket = ''
-   s3prefix = ''
+class es_json:
+   """
+   JSON backend, orjson if it is installed or the stdlib json module, loads accepts bytes so bulk responses
+   and config files are parsed without decoding them first, dumps returns bytes like orjson so documents and
+   request bodies are built without decoding and encoding them again
+   """
 
-   filetype = ''
-   folder = ''
+   backends = ('auto', 'orjson', 'json')
 
-   indexname = ''
+   name = 'json'
 
-   config_file = ''
-   config = ''
+   _orjson = None
 
-   db = None
+   ###########################################################
 
-   bulklimit = 0
+   def __init__(self, backend: str = 'auto'):
+      if backend not in self.backends:
+         raise UserWarning('JSON backend "' + str(backend) + '" unknown, use one of ' + ', '.join(self.backends))
 
-   upd_keys = []
+      self._orjson = None
+      self.name = 'json'
 
-   debug = False
+      if backend != 'json':
+         try:
+            import orjson
+            self._orjson = orjson
+            self.name = 'orjson'
+         except ImportError as err:
+            if backend == 'orjson':
+               raise UserWarning('JSON backend orjson is not installed - ' + str(err))
 
-   measure = {}
+   ###########################################################
 
-   offset = None
+   def loads(self, data):
+      if self._orjson is not None:
+         return self._orjson.loads(data)
+      return json.loads(data)
 
-   last_modified_timestamp_upd = True
+   ###########################################################
+
+   def dumps(self, obj) -> bytes:
+      if self._orjson is not None:
+         return self._orjson.dumps(obj)
+      return json.dumps(obj).encode('utf-8')
+
+
+# default backend, used for the config files before es.json_backend is known
+ES_INDEXER_JSON = es_json()
+
+###########################################################
+###########################################################
+###########################################################
+
+
+
+class es_mapping_template:
+   """
+   the mapping section compiled once into pre-serialized JSON parts and slots for the "$field" placeholders,
+   a document is rendered by filling the slots instead of a str.replace per field
+   """
+
+   parts = []
+
+   slots = []
+
+   fields = []
+
+   serializer = None
 
    ###########################################################
 
-   def __init__(self, s3bucket_filetype: str, s3prefix_folder: str, indexname: str, bulklimit: int,
-                configfile: str = '', offset: int = None, last_modified_timestamp_upd: bool = True):
-      """
-      Parameters
-      ----------
-      s3bucket_filetype : str
-         s3://my-bucket or file://
-      s3prefix_folder : str
-         S3 prefix or local folder name where the config file is located
-      indexname : str, optional
-         name of index in Elasticsearch
-      bulklimit : int
-         number of records per run or in case of init per loop
-      configfile : str, optional
-         name of config file
-      offset : int, optional
-         used for initial indexing
-      last_modified_timestamp_upd : bool, optional
-         useful if you initial indexing an test env from same source as productive
+   def __init__(self, mapping: dict, serializer: es_json = None):
+      self.serializer = serializer if serializer is not None else ES_INDEXER_JSON
+      self.parts = []
+      self.slots = []  # (position in parts, field name, JSON bytes if the field is not selected)
+
+      tokens = []
+      self._compile(mapping, tokens)
+
+      const = b''
+      for token in tokens:
+         if isinstance(token, tuple):
+            if len(const) > 0:
+               self.parts.append(const)
+               const = b''
+            self.slots.append((len(self.parts), token[0], self.serializer.dumps('$' + token[0])))
+            self.parts.append(None)
+         else:
+            const += token
 
-      Samples
-      ----------
-      # sample 1
-      es_indexer('s3://my-bucket', 'config', 'test', 5) # without filename, the class search for a config file like test.json
-      # sample 2
-      es_indexer('file://', 'config', 'index1', 10, 'index1.json')
-      # sample 3
-      es_indexer('file://', 'config', 'index1', limit, 'index1.json', offset, False)
+      if len(const) > 0:
+         self.parts.append(const)
+
+      self.fields = list(collections.OrderedDict.fromkeys([slot[1] for slot in self.slots]))
+
+   ###########################################################
+
+   def _compile(self, node, tokens):
+      if isinstance(node, dict):
+         tokens.append(b'{')
+         i = 0
+         for key in node:
+            if i > 0:
+               tokens.append(b', ')
+            tokens.append(self.serializer.dumps(key) + b': ')
+            self._compile(node[key], tokens)
+            i += 1
+         tokens.append(b'}')
+      elif isinstance(node, list):
+         tokens.append(b'[')
+         i = 0
+         for item in node:
+            if i > 0:
+               tokens.append(b', ')
+            self._compile(item, tokens)
+            i += 1
+         tokens.append(b']')
+      elif isinstance(node, str) and len(node) > 1 and node[0] == '$':
+         tokens.append((node[1:],))
+      else:
+         tokens.append(self.serializer.dumps(node))
+
+   ###########################################################
+
+   def render(self, values: dict):
+      """
+      values: JSON bytes per field name, placeholders without a value are kept as string
       """
 
-      global ES_INDEXER_DEBUG
+      parts = list(self.parts)
+      for pos, field, literal in self.slots:
+         parts[pos] = values.get(field, literal)
 
-      warnings.simplefilter("error", category=pymysql.Warning)
+      return b''.join(parts)
 
-      if os.environ.get('ES_INDEXER_DEBUG') is not None:
-         ES_INDEXER_DEBUG = bool(os.environ.get('ES_INDEXER_DEBUG'))
+###########################################################
+###########################################################
+###########################################################
 
-      try:
-         if ES_INDEXER_DEBUG:
-            self.debug = True
-      except NameError:
-         pass
 
-      self.measure = {}
 
-      if s3bucket_filetype.find('s3://') != -1:
-         self.s3bucket = s3bucket_filetype[5:]
-         self.s3prefix = s3prefix_folder
-      elif s3bucket_filetype.find('file://') != -1:
-         self.filetype = s3bucket_filetype[7:]
-         self.folder = s3prefix_folder
-      else:
-         raise UserWarning('Error, parameter "s3bucket_filetype" must contain s3:// or file://')
+class es_bulk_builder:
+   """
+   collects encoded bulk lines (action and document) until max. bytes or max. documents are reached
+   """
 
-      self.indexname = indexname
-      self.bulklimit = bulklimit
-      self.config_file = configfile
+   max_bytes = 0
 
-      if self.bulklimit > 5000:  # max ES bulk limit
-         self.bulklimit = 5000
-      if self.bulklimit < 1:
-         self.bulklimit = 1
+   max_docs = 0
 
-      self.offset = offset
-      self.last_modified_timestamp_upd = last_modified_timestamp_upd
+   chunks = []
 
-      # print('debug', __class__, inspect.currentframe().f_back.f_lineno)
-      # return None
+   upd_keys = []
 
-      tick = time.time()
+   meta = []
 
-      if s3bucket_filetype.find('s3://') != -1:
-         self._s3getConfig()
-      else:
-         self._fs_getConfig()
+   size = 0
 
-      elapsed_time = time.time() - tick
-      self.measure['timings'] = {'config': elapsed_time}
+   docs = 0
+
+   skipped = 0
+
+   ###########################################################
 
+   def __init__(self, max_bytes: int, max_docs: int):
+      self.max_bytes = max_bytes
+      self.max_docs = max_docs
+      self.chunks = []
       self.upd_keys = []
+      self.meta = []
+      self.size = 0
+      self.docs = 0
+      self.skipped = 0
 
-      if self.debug:
-         print("\r\nDebug " + inspect.currentframe().f_code.co_name + ";\r\n", "Config File: " + self.config_file,
-               "\r\n", "Payload: " + json.dumps(self.config, sort_keys=True, indent=3), "\r\n\r\n", "#" * 50, "\r\n")
+   ###########################################################
 
-      self._do()
+   def fits(self, size: int, docs: int = 1):
+      # a single row larger than max. bytes is sent in its own bulk, the documents of a row are never split
+      if self.docs == 0:
+         return True
 
-      timeings = self.measure['timings']
-      total = 0
-      for key in timeings:
-         total += timeings[key]
+      return self.docs + docs <= self.max_docs and self.size + size <= self.max_bytes
 
-      self.measure['timings'].update({'total': total})
+   ###########################################################
 
-      global ES_INDEXER_MEASURE
-      ES_INDEXER_MEASURE = self.measure
+   def add(self, doc: bytes, upd_key, meta=None):
+      """
+      meta: (index, _id, hash or None) of the document
+      """
+
+      self.chunks.append(doc)
+      self.upd_keys.append(upd_key)
+      self.meta.append(meta)
+      self.size += len(doc)
+      self.docs += 1
 
    ###########################################################
 
-   def _fs_getConfig(self):
-      buf = ''
-      config_file = ''
+   def skip(self, upd_key, meta):
+      # unchanged document, not part of the body but acknowledged with the bulk
+      self.chunks.append(None)
+      self.upd_keys.append(upd_key)
+      self.meta.append(meta)
+      self.skipped += 1
 
-      if self.config_file == '':
-         config_file = self.indexname + '.json'
+   ###########################################################
+
+   def flush(self):
+      """
+      returns the bulk body, its update keys, documents (None if skipped) and their meta, the builder is empty afterwards
+      """
+
+      if self.skipped > 0:
+         body = b''.join([chunk for chunk in self.chunks if chunk is not None])
       else:
-         config_file = self.config_file
+         body = b''.join(self.chunks)
 
-      try:
-         if not self.folder:
-            config_file = config_file
-         else:
-            config_file = self.folder + '/' + config_file
+      bulk = (body, self.upd_keys, self.chunks, self.meta)
 
-         config_file = os.path.realpath(os.path.dirname(os.path.abspath(__file__)) + '/../' + config_file)
+      self.chunks = []
+      self.upd_keys = []
+      self.meta = []
+      self.size = 0
+      self.docs = 0
+      self.skipped = 0
 
-         self.config_file = config_file
+      return bulk
 
-         hFile = open(config_file, 'r')
-         buf = hFile.read()
-         hFile.close()
+###########################################################
+###########################################################
+###########################################################
 
-      except BaseException as err:
-         raise UserWarning('Error read config from local fs, File: "' + config_file + '" - ' + str(err))
 
-      try:
-         self.config = json.loads(buf)
-      except BaseException as err:
-         raise UserWarning('JSON file ' + self.config_file + ' format error - ' + str(err))
 
-   ###########################################################
+class es_bulk_controller:
+   """
+   adapts the documents per bulk and the delay between bulk requests to the observed latency, payload size and
+   rejections of the ES cluster, converges on target bytes per bulk and (optional) a target latency, halves the
+   bulk size and backs off on rejections (AIMD)
+   """
 
-   def _s3getConfig(self):
-      str = ''
-      config_file = ''
+   docs = 0
 
-      if self.config_file == '':
-         config_file = self.indexname + '.json'
-      else:
-         config_file = self.config_file
+   delay = 0.0
 
-      try:
-         if not self.s3prefix:
-            config_file = config_file
-         else:
-            config_file = self.s3prefix + '/' + config_file
+   min_docs = 1
 
-         self.config_file = config_file
+   max_docs = 0
 
-         s3 = boto3.resource('s3')
-         obj = s3.Object(self.s3bucket, config_file)
-         str = obj.get()['Body'].read().decode('utf-8')
-      except BaseException as err:
-         raise UserWarning(
-            'Error read config from s3 bucket "' + self.s3bucket + '", File: "' + config_file + '" - ' + str(err))
+   target_bytes = 0
 
-      try:
-         self.config = json.loads(str)
-      except BaseException as err:
-         raise UserWarning('JSON file ' + self.config_file + ' format error - ' + str(err))
+   target_latency = None
+
+   max_delay = 0.0
+
+   doc_bytes = None
+
+   lock = None
 
    ###########################################################
 
-   def _rdsConnect(self):
-      if self.db != None:
-         return self.db
+   def __init__(self, start_docs: int, max_docs: int, target_bytes: int, target_latency: float = None,
+                max_delay: float = 10.0):
+      self.max_docs = max(1, max_docs)
+      self.docs = min(max(1, start_docs), self.max_docs)
+      self.delay = 0.0
+      self.target_bytes = target_bytes
+      self.target_latency = target_latency
+      self.max_delay = max_delay
+      self.doc_bytes = None
+      self.lock = threading.Lock()
 
-      endpoint = ''
-      user = ''
-      pw = ''
-      try:
-         endpoint = self.config['rds']['endpoint']
-         user = self.config['rds']['user']
-         pw = self.config['rds']['password']
-      except KeyError as err:
-         raise UserWarning('JSON file ' + self.config_file + ' format error, missing key: ' + str(err))
+   ###########################################################
 
-      timeout = None
-      try:
-         timeout = int(self.config['rds']['timeout'])
-      except KeyError as err:
-         timeout = 3
-         pass
+   def observe(self, docs: int, size: int, latency: float, rejected: int):
+      """
+      feedback of one bulk request
+      """
 
-      host = endpoint
-      port = 3306
-      if endpoint.find(':') != -1:
-         endpoint = endpoint.split(':')
-         port = int(endpoint[1])
-         endpoint = endpoint[0]
+      if docs < 1:
+         return
 
-      try:
-         self.db = pymysql.connect(host=endpoint, port=port, user=user, passwd=pw, charset='utf8',
-                                   connect_timeout=timeout)
-      except pymysql.err.OperationalError as err:
-         raise UserWarning('Error , current timeout ' + str(
-            timeout) + ', you can increase it via key timeout in the *.json file - ' + str(err))
+      with self.lock:
+         # moving average of the document size
+         if self.doc_bytes is None:
+            self.doc_bytes = size / docs
+         else:
+            self.doc_bytes = 0.7 * self.doc_bytes + 0.3 * (size / docs)
 
-      return self.db
+         if rejected > 0:  # backpressure of the cluster
+            self.docs = max(self.min_docs, int(self.docs * max(0.5, 1.0 - float(rejected) / docs)))
+            self.delay = min(self.max_delay, max(0.1, self.delay * 2))
+            return
 
-   ###########################################################
+         self.delay = self.delay / 2
+         if self.delay < 0.01:
+            self.delay = 0.0
 
-   def _sqlSelect(self):
-      last_mod_field = ''
-      data = ''
-      group_by = ''
-      sort = ''
-      additional_where = ''
-      additional_primary_key_for_full_indexing = ''
+         target = self.target_bytes / max(1.0, self.doc_bytes)
 
-      try:
-         last_mod_field = self.config['sql']['last-modified-timestamp-field']
-         data = self.config['sql']['data']
-         if 'group-by' in self.config['sql']:
-            group_by = self.config['sql']['group-by']
-         if 'sort' in self.config['sql']:
-            sort = self.config['sql']['sort']
-         if 'additional-where' in self.config['sql']:
-            additional_where = self.config['sql']['additional-where']
-         if 'additional-primary-key-for-full-indexing' in self.config['sql']:
-            additional_primary_key_for_full_indexing = self.config['sql']['additional-primary-key-for-full-indexing']
-      except KeyError as err:
-         raise UserWarning('JSON file ' + self.config_file + ' format error, missing key: ' + str(err))
+         if self.target_latency is not None and latency > self.target_latency:
+            target = min(target, self.docs * max(0.5, self.target_latency / latency))
 
+         # approach the target by half of the difference, max. doubling per bulk
+         docs = self.docs + (target - self.docs) / 2
+         docs = min(docs, self.docs * 2)
 
+         self.docs = int(min(self.max_docs, max(self.min_docs, docs)))
 
-      fields = ''
-      tfrom = ''
-      i = 0
-      joins = []
-      try:
-         for item in data:
-            schema_table = item["schema"] + '.' + item["table"] + '.'
-            if i == 0:
-               tfrom = item["schema"] + '.' + item["table"]
-            else:
-               joins.append({"join": item["join"], "schema": item["schema"], "table": item["table"]})
+###########################################################
+###########################################################
+###########################################################
 
-            for fname in item["fields"]:
-               if fname.find('.') > 0:  # to support functions
-                  schema_table = ''
 
-               fields += schema_table + fname + ', '
 
-            i += 1
+class es_sanitizer:
+   """
+   cleans database strings for the JSON documents with precompiled tables, clean values (printable ASCII without
+   HTML entities and JSON special chars) take a fast path, policies per column via the config section "sanitize":
+      ascii: remove non ASCII chars (default true), false keeps UTF-8
+      html: replace &#x and unescape HTML entities (default true)
+   """
 
-         query = 'SELECT ' + fields[0:-2] + ' FROM ' + tfrom
+   # any char which requires more than a strip
+   unclean = re.compile(r'[^\x20-\x7e]|[&"\\]')
 
-         for item in joins:
-            query += ' LEFT JOIN ' + item["schema"] + '.' + item["table"]
-            if item["join"].upper().find(' ON ') == -1:
-               query += ' ON ' + item["join"]
-            else:
-               query += ' ' + item["join"]
+   # non printable chars, linefeeds etc.
+   control_table = dict.fromkeys(list(range(0x00, 0x20)) + list(range(0x7f, 0xa0)), ' ')
 
-         if self.offset is None:
-            query += ' WHERE ' + last_mod_field + ' != "1970-01-01 00:00:00"'
+   escape_table = {ord('"'): '\\"', ord('\\'): '\\\\'}
+
+   default = (True, True)
+
+   policies = {}
+
+   ###########################################################
+
+   def __init__(self, config: dict):
+      self.policies = {}
+      self.default = (True, True)
+
+      for field in config:
+         if field.startswith('_comment'):
+            continue
+
+         options = config[field]
+         policy = (bool(options.get('ascii', True)), bool(options.get('html', True)))
+
+         if field == '_default':
+            self.default = policy
          else:
-            if len(additional_primary_key_for_full_indexing) > 0:
-               query += ' WHERE ' + additional_primary_key_for_full_indexing + ' >= ' + str(
-                  self.offset) + ' AND ' + additional_primary_key_for_full_indexing + ' <= ' + str(
-                  self.offset + self.bulklimit)
+            self.policies[field] = policy
 
-         if len(additional_where) > 0:
-            if self.offset is None or query.find(' WHERE ') != -1:
-               query += ' AND ' + additional_where
-            else:
-               query += ' WHERE ' + additional_where
+   ###########################################################
 
-         if len(group_by) > 0:
-            query += ' GROUP BY ' + group_by
+   def policy(self, field: str):
+      return self.policies.get(field, self.default)
 
-         offset = ''
-         if self.offset is not None and len(
-                 additional_primary_key_for_full_indexing) == 0:  # use OFFSET/LIMIT only if not possible via PK
-            offset = str(self.offset) + ', '
+   ###########################################################
 
-         if len(sort) > 0:
-            query += ' ORDER BY ' + last_mod_field + ' ' + sort
+   def clean(self, val: str):
+      # remove non printable chars, linefeeds etc.
+      return val.translate(self.control_table).strip()
 
-         query += ' LIMIT ' + offset + str(self.bulklimit)
+   ###########################################################
+
+   def string(self, val: str, policy: tuple):
+      """
+      returns the quoted and escaped JSON string
+      """
 
+      if self.unclean.search(val) is None:
+         return '"' + val.strip() + '"'
+
+      (ascii_only, unescape) = policy
+
+      val = self.clean(val)
+
+      if unescape and val.find('&') != -1:
+         # remove all &#x, because "html.unescape" not do it for some correctly
+         val = val.replace('&#x', ' ')
+         # remove HTML special chars, can create linefeeds again
+         import html
+         val = html.unescape(val).translate(self.control_table)
+
+      if ascii_only and not val.isascii():
+         val = val.encode("ascii", "ignore").decode()
+
+      return '"' + val.translate(self.escape_table) + '"'
+
+   ###########################################################
+
+   def json(self, val: str, policy: tuple):
+      """
+      returns the JSON text of a JSON string from the database
+      """
+
+      (ascii_only, unescape) = policy
+
+      if unescape and val.find('&') != -1:
+         # remove all &#x, because "html.unescape" not do it for some correctly
+         val = val.replace('&#x', ' ')
+         # remove HTML special chars
+         import html
+         val = html.unescape(val)
+
+      if ascii_only and not val.isascii():
+         val = val.encode("ascii", "ignore").decode()
+
+      if val.find("\r") != -1 or val.find("\n") != -1:
+         # remove linefeeds
+         val = val.replace("\r", " ").replace("\n", " ")
+
+      return val
+
+###########################################################
+###########################################################
+###########################################################
+
+
+
+class es_metrics:
+   """
+   counters, gauges and per-stage latency histograms, cumulative over all runs of an index in the process (e.g. all
+   invocations of a warm AWS Lambda container, see open), exported after every run to the exporters of the metrics
+   config section, optional cProfile and tracemalloc per stage
+   """
+
+   buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+   config = {}
+
+   labels = {}
+
+   counters = {}
+
+   gauges = {}
+
+   histograms = {}
+
+   memory = {}
+
+   exporters = []
+
+   profile_stages = set()
+
+   profiles = {}
+
+   exported = None
+
+   lock = None
+
+   ###########################################################
+
+   def __init__(self, config: dict = None, labels: dict = None):
+      """
+      config: metrics section of the config file, labels: added to every metric, e.g. {"index": "index1"}
+      """
+
+      self.labels = dict(labels) if labels is not None else {}
+      self.counters = {}
+      self.gauges = {}
+      self.histograms = {}
+      self.memory = {}
+      self.profiles = {}
+      self.exported = {'counters': {}, 'histograms': {}}
+      self.lock = threading.Lock()
+      self._local = threading.local()
+
+      self.configure(config)
+
+   ###########################################################
+
+   @staticmethod
+   def open(config: dict = None, labels: dict = None):
+      """
+      returns the metrics of the labels shared by all indexers of the process, the counters are not reset by a
+      new invocation, the config of the last call is used
+      """
+
+      key = (tuple(sorted((labels or {}).items())), os.getpid())  # forked processes count on their own
+
+      metrics = ES_INDEXER_METRICS.get(key)
+      if metrics is None:
+         metrics = es_metrics(config, labels)
+         ES_INDEXER_METRICS[key] = metrics
+      else:
+         metrics.configure(config)
+
+      return metrics
+
+   ###########################################################
+
+   def configure(self, config: dict = None):
+      if config is None:
+         config = {}
+
+      self.config = config
+
+      self.exporters = []
+      for name in config.get('exporters', []):
+         if name == 'prometheus':
+            self.exporters.append(self.export_prometheus)
+         elif name == 'statsd':
+            self.exporters.append(self.export_statsd)
+         elif name == 'emf':
+            self.exporters.append(self.export_emf)
+         else:
+            raise UserWarning('metrics exporter unknown: ' + str(name) + ', use prometheus, statsd or emf')
+
+      self.profile_stages = set(config.get('profile', []))
+
+      if config.get('tracemalloc', False):
+         import tracemalloc
+         if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+   ###########################################################
+
+   def add_exporter(self, exporter):
+      """
+      exporter: callable(metrics, delta), delta contains the counters and histograms since the last export
+      """
+
+      self.exporters.append(exporter)
+
+   ###########################################################
+
+   def count(self, name: str, value=1):
+      with self.lock:
+         self.counters[name] = self.counters.get(name, 0) + value
+
+   ###########################################################
+
+   def gauge(self, name: str, value):
+      with self.lock:
+         self.gauges[name] = value
+
+   ###########################################################
+
+   def observe(self, stage: str, seconds: float):
+      with self.lock:
+         histogram = self.histograms.get(stage)
+         if histogram is None:
+            histogram = {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            self.histograms[stage] = histogram
+
+         histogram['buckets'][bisect.bisect_left(self.buckets, seconds)] += 1
+         histogram['sum'] += seconds
+         histogram['count'] += 1
+
+   ###########################################################
+
+   def profiler(self, stage: str):
+      """
+      returns the cProfile.Profile of the stage for the current thread or None if the stage is not profiled
+      """
+
+      if stage not in self.profile_stages:
+         return None
+
+      import cProfile
+
+      key = (stage, threading.get_ident())
+      with self.lock:
+         if key not in self.profiles:
+            self.profiles[key] = cProfile.Profile()
+         return self.profiles[key]
+
+   ###########################################################
+
+   @contextlib.contextmanager
+   def profile(self, stage: str):
+      """
+      profiles the stage with cProfile and its peak memory with tracemalloc (metrics.tracemalloc), nested
+      stages of the same thread are part of the outer profile
+      """
+
+      profiler = None
+      if getattr(self._local, 'active', None) is None:
+         profiler = self.profiler(stage)
+
+      if profiler is None:
+         yield
+         return
+
+      import tracemalloc
+
+      tracing = tracemalloc.is_tracing()
+      if tracing:
+         current = tracemalloc.get_traced_memory()[0]
+         if hasattr(tracemalloc, 'reset_peak'):  # Python >= 3.9, else the peak since tracemalloc.start()
+            tracemalloc.reset_peak()
+
+      self._local.active = stage
+      profiler.enable()
+      try:
+         yield
+      finally:
+         profiler.disable()
+         self._local.active = None
+
+         if tracing:
+            peak = tracemalloc.get_traced_memory()[1] - current
+            with self.lock:
+               self.memory[stage] = max(self.memory.get(stage, 0), peak)
+
+   ###########################################################
+
+   def snapshot(self):
+      """
+      picklable copy of all metrics, e.g. to merge the metrics of worker processes
+      """
+
+      with self.lock:
+         return {'counters': dict(self.counters), 'gauges': dict(self.gauges), 'memory': dict(self.memory),
+                 'histograms': {stage: {'buckets': list(histogram['buckets']), 'sum': histogram['sum'],
+                                        'count': histogram['count']}
+                                for stage, histogram in self.histograms.items()}}
+
+   ###########################################################
+
+   def merge(self, snapshot: dict):
+      with self.lock:
+         for name, value in snapshot['counters'].items():
+            self.counters[name] = self.counters.get(name, 0) + value
+         for stage, peak in snapshot['memory'].items():
+            self.memory[stage] = max(self.memory.get(stage, 0), peak)
+         for stage, other in snapshot['histograms'].items():
+            histogram = self.histograms.setdefault(stage, {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0.0,
+                                                           'count': 0})
+            histogram['buckets'] = [a + b for a, b in zip(histogram['buckets'], other['buckets'])]
+            histogram['sum'] += other['sum']
+            histogram['count'] += other['count']
+
+   ###########################################################
+
+   def export(self):
+      """
+      runs all exporters with the metrics since the last export and writes the cProfile stats of the profiled
+      stages to metrics.profile_dir
+      """
+
+      snapshot = self.snapshot()
+
+      delta = {'counters': {}, 'histograms': {}}
+      for name, value in snapshot['counters'].items():
+         delta['counters'][name] = value - self.exported['counters'].get(name, 0)
+      for stage, histogram in snapshot['histograms'].items():
+         last = self.exported['histograms'].get(stage, {'sum': 0.0, 'count': 0})
+         delta['histograms'][stage] = {'sum': histogram['sum'] - last['sum'],
+                                       'count': histogram['count'] - last['count']}
+
+      self.exported = snapshot
+
+      for exporter in self.exporters:
+         exporter(snapshot, delta)
+
+      if len(self.profiles) > 0:
+         self._dumpProfiles()
+
+   ###########################################################
+
+   def _prefix(self):
+      return self.config.get('prefix', 'es_indexer')
+
+   ###########################################################
+
+   def _labels(self, extra: dict = None):
+      labels = dict(self.labels)
+      if extra is not None:
+         labels.update(extra)
+
+      return ','.join(key + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+                      for key, value in sorted(labels.items()))
+
+   ###########################################################
+
+   def export_prometheus(self, snapshot: dict, delta: dict):
+      """
+      text file for the textfile collector of the Prometheus node exporter (metrics.prometheus_file), written
+      atomically, counters are cumulative
+      """
+
+      prefix = self._prefix()
+
+      default = '/tmp/' + prefix + '.prom'
+      if 'index' in self.labels:  # one file per index, the textfile collector reads all *.prom files
+         default = '/tmp/' + prefix + '_' + str(self.labels['index']) + '.prom'
+      path = self.config.get('prometheus_file', default)
+
+      lines = []
+      for name in sorted(snapshot['counters']):
+         lines.append('# TYPE ' + prefix + '_' + name + '_total counter')
+         lines.append(prefix + '_' + name + '_total{' + self._labels() + '} ' + str(snapshot['counters'][name]))
+
+      for name in sorted(snapshot['gauges']):
+         lines.append('# TYPE ' + prefix + '_' + name + ' gauge')
+         lines.append(prefix + '_' + name + '{' + self._labels() + '} ' + str(snapshot['gauges'][name]))
+
+      if len(snapshot['memory']) > 0:
+         lines.append('# TYPE ' + prefix + '_stage_memory_peak_bytes gauge')
+
+      for stage in sorted(snapshot['memory']):
+         lines.append(prefix + '_stage_memory_peak_bytes{' + self._labels({'stage': stage}) + '} ' +
+                      str(snapshot['memory'][stage]))
+
+      if len(snapshot['histograms']) > 0:
+         lines.append('# TYPE ' + prefix + '_stage_seconds histogram')
+
+      for stage in sorted(snapshot['histograms']):
+         histogram = snapshot['histograms'][stage]
+         total = 0
+         for bound, count in zip(self.buckets + ('+Inf',), histogram['buckets']):
+            total += count
+            lines.append(prefix + '_stage_seconds_bucket{' + self._labels({'stage': stage, 'le': bound}) + '} ' +
+                         str(total))
+         lines.append(prefix + '_stage_seconds_sum{' + self._labels({'stage': stage}) + '} ' + str(histogram['sum']))
+         lines.append(prefix + '_stage_seconds_count{' + self._labels({'stage': stage}) + '} ' +
+                      str(histogram['count']))
+
+      try:
+         tmp = path + '.' + str(os.getpid()) + '.tmp'
+         with open(tmp, 'w') as hFile:
+            hFile.write("\n".join(lines) + "\n")
+         os.replace(tmp, path)
+      except OSError as err:
+         raise UserWarning('Error write metrics to ' + path + ' - ' + str(err))
+
+   ###########################################################
+
+   def export_statsd(self, snapshot: dict, delta: dict):
+      """
+      StatsD line protocol via UDP (metrics.statsd_host, metrics.statsd_port), counters since the last export,
+      the stage latency as mean of the observations since the last export
+      """
+
+      import socket
+
+      prefix = self._prefix() + '.'
+      if 'index' in self.labels:
+         prefix += str(self.labels['index']) + '.'
+
+      lines = []
+      for name, value in sorted(delta['counters'].items()):
+         lines.append(prefix + name + ':' + str(value) + '|c')
+      for name, value in sorted(snapshot['gauges'].items()):
+         lines.append(prefix + name + ':' + str(value) + '|g')
+      for stage, histogram in sorted(delta['histograms'].items()):
+         if histogram['count'] > 0:
+            lines.append(prefix + 'stage.' + stage + ':' + str(round(histogram['sum'] / histogram['count'] * 1000, 3))
+                         + '|ms')
+
+      address = (self.config.get('statsd_host', '127.0.0.1'), int(self.config.get('statsd_port', 8125)))
+      sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+      try:
+         packet = ''
+         for line in lines:  # max. ~1400 bytes per datagram
+            if len(packet) + len(line) + 1 > 1400 and len(packet) > 0:
+               sock.sendto(packet.encode('utf-8'), address)
+               packet = ''
+            packet += line + "\n"
+         if len(packet) > 0:
+            sock.sendto(packet.encode('utf-8'), address)
+      except OSError as err:
+         raise UserWarning('Error send metrics to StatsD ' + str(address) + ' - ' + str(err))
+      finally:
+         sock.close()
+
+   ###########################################################
+
+   def export_emf(self, snapshot: dict, delta: dict):
+      """
+      CloudWatch embedded metric format, one JSON log line on stdout (AWS Lambda sends it to CloudWatch Logs),
+      counters and stage seconds since the last export
+      """
+
+      dimensions = sorted(self.labels.keys())
+
+      line = {name: value for name, value in self.labels.items()}
+      metrics = []
+
+      for name, value in sorted(delta['counters'].items()):
+         unit = 'Bytes' if name.startswith('bytes') else 'Count'
+         metrics.append({'Name': name, 'Unit': unit})
+         line[name] = value
+
+      for name, value in sorted(snapshot['gauges'].items()):
+         metrics.append({'Name': name, 'Unit': 'Count/Second' if name.endswith('_per_sec') else 'None'})
+         line[name] = value
+
+      for stage, histogram in sorted(delta['histograms'].items()):
+         metrics.append({'Name': stage + '_seconds', 'Unit': 'Seconds'})
+         line[stage + '_seconds'] = histogram['sum']
+
+      line['_aws'] = {'Timestamp': int(time.time() * 1000),
+                      'CloudWatchMetrics': [{'Namespace': self.config.get('emf_namespace', self._prefix()),
+                                             'Dimensions': [dimensions], 'Metrics': metrics}]}
+
+      print(json.dumps(line))
+
+   ###########################################################
+
+   def _dumpProfiles(self):
+      import pstats
+
+      profile_dir = self.config.get('profile_dir', '/tmp')
+
+      with self.lock:
+         stages = {}
+         for (stage, ident), profiler in self.profiles.items():
+            stages.setdefault(stage, []).append(profiler)
+
+      for stage, profilers in stages.items():
+         stats = None
+         for profiler in profilers:
+            try:
+               if stats is None:
+                  stats = pstats.Stats(profiler)
+               else:
+                  stats.add(profiler)
+            except TypeError:  # nothing was profiled in this thread
+               pass
+
+         if stats is None:
+            continue
+
+         name = self._prefix() + '_' + stage
+         if 'index' in self.labels:
+            name += '_' + str(self.labels['index'])
+         stats.dump_stats(profile_dir + '/' + name + '_' + str(os.getpid()) + '.prof')
+
+###########################################################
+###########################################################
+###########################################################
+
+
+
+class es_connection_pool:
+   """
+   DB connections and HTTP sessions per endpoint and credentials, kept at module level (ES_INDEXER_POOL) so warm
+   AWS Lambda invocations skip the TCP/TLS and MySQL handshakes, DB connections are checked out exclusively and
+   pinged before reuse once they were idle for a while, a forked process starts with an empty pool
+   """
+
+   pid = 0
+
+   ###########################################################
+
+   def __init__(self):
+      self.pid = os.getpid()
+      self.db = {}  # key -> [(connection, last used), ...]
+      self.http = {}  # key -> [session, last used]
+      self.handshakes = {'db': 0, 'http': 0}
+      self.lock = threading.Lock()
+
+   ###########################################################
+
+   def _forked(self):
+      # sockets of the parent process must not be shared, they are dropped without closing
+      if self.pid != os.getpid():
+         self.pid = os.getpid()
+         self.db = {}
+         self.http = {}
+
+   ###########################################################
+
+   def acquire_db(self, key, connect, ping_after_sec: float, max_idle_sec: float):
+      """
+      returns an idle connection of the key or a new one from connect(), idle connections are pinged after
+      ping_after_sec and dropped after max_idle_sec, stale ones are replaced transparently
+      """
+
+      while True:
+         with self.lock:
+            self._forked()
+            idle = self.db.get(key)
+            if not idle:
+               break
+            (db, last_used) = idle.pop()
+
+         idle_sec = time.time() - last_used
+         if idle_sec > max_idle_sec:
+            self.discard_db(db)
+            continue
+
+         if idle_sec > ping_after_sec:
+            try:
+               db.ping(reconnect=False)
+            except BaseException:
+               self.discard_db(db)
+               continue
+
+         return db
+
+      return connect()
+
+   ###########################################################
+
+   def release_db(self, key, db, pool_size: int):
+      """
+      returns the connection to the pool, the open transaction is rolled back so the next invocation does not
+      read from the snapshot of this one, connections in an unknown state are closed
+      """
+
+      try:
+         db.rollback()
+      except BaseException:
+         self.discard_db(db)
+         return
+
+      with self.lock:
+         self._forked()
+         idle = self.db.setdefault(key, [])
+         if len(idle) < pool_size:
+            idle.append((db, time.time()))
+            return
+
+      self.discard_db(db)
+
+   ###########################################################
+
+   @staticmethod
+   def discard_db(db):
+      try:
+         db.close()
+      except BaseException:
+         pass
+
+   ###########################################################
+
+   def http_session(self, key, create, max_idle_sec: float):
+      """
+      returns the session of the key, shared by all instances, or a new one from create(), a session idle for more
+      than max_idle_sec is replaced, urllib3 reconnects dropped keep-alive connections of a session by itself
+      """
+
+      now = time.time()
+      stale = None
+
+      with self.lock:
+         self._forked()
+         entry = self.http.get(key)
+         if entry is not None and now - entry[1] > max_idle_sec:
+            stale = entry[0]
+            self.handshakes['http'] += self._httpConnections(stale)
+            entry = None
+            del self.http[key]
+
+         if entry is None:
+            entry = [create(), now]
+            self.http[key] = entry
+
+         entry[1] = now
+
+      if stale is not None:
+         stale.close()
+
+      return entry[0]
+
+   ###########################################################
+
+   def handshake(self, kind: str, count: int = 1):
+      with self.lock:
+         self.handshakes[kind] += count
+
+   ###########################################################
+
+   def count(self) -> dict:
+      """
+      returns the handshakes of this process, for http the new connections of the urllib3 pools
+      """
+
+      with self.lock:
+         self._forked()
+         http = 0
+         for (session, last_used) in self.http.values():
+            http += self._httpConnections(session)
+
+         return {'db': self.handshakes['db'], 'http': self.handshakes['http'] + http}
+
+   ###########################################################
+
+   @staticmethod
+   def _httpConnections(session) -> int:
+      count = 0
+      for adapter in set(session.adapters.values()):
+         pools = getattr(getattr(adapter, 'poolmanager', None), 'pools', None)
+         if pools is None:
+            continue
+         try:
+            for key in pools.keys():
+               count += getattr(pools[key], 'num_connections', 0)
+         except (KeyError, TypeError):
+            pass
+
+      return count
+
+   ###########################################################
+
+   def clear(self):
+      """
+      closes all idle connections and sessions, e.g. before a shutdown
+      """
+
+      with self.lock:
+         self._forked()
+         (db, http) = (self.db, self.http)
+         self.db = {}
+         self.http = {}
+
+      for idle in db.values():
+         for (conn, last_used) in idle:
+            self.discard_db(conn)
+
+      for (session, last_used) in http.values():
+         self.handshake('http', self._httpConnections(session))
+         session.close()
+
+
+# DB connections and HTTP sessions reused by warm AWS Lambda containers, see es_connection_pool
+ES_INDEXER_POOL = es_connection_pool()
+
+###########################################################
+###########################################################
+###########################################################
+
+
+
+class es_checkpoint:
+   """
+   small JSON state of an index (high-water mark, binlog position), stored in a local file (replaced atomically),
+   an S3 object (s3://bucket/key) or a row of a DB table (db://schema.table with the columns name and value)
+   """
+
+   ###########################################################
+
+   def __init__(self, location: str, name: str, base_dir: str = '', connect=None):
+      """
+      location: file path (relative to base_dir), s3://bucket/key or db://schema.table, name: row of the DB table,
+      connect: callable returning the pymysql connection for db://
+      """
+
+      self.location = location
+      self.name = name
+      self.connect = connect
+
+      if location.find('://') == -1 and not os.path.isabs(location):
+         self.location = os.path.realpath(os.path.join(base_dir, location))
+
+   ###########################################################
+
+   def load(self):
+      """
+      returns the saved value or None
+      """
+
+      try:
+         if self.location.startswith('s3://'):
+            (bucket, key) = self.location[5:].split('/', 1)
+            try:
+               buf = self._s3().get_object(Bucket=bucket, Key=key)['Body'].read()
+            except BaseException as err:
+               if getattr(err, 'response', {}).get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                  return None
+               raise
+
+         elif self.location.startswith('db://'):
+            cursor = self.connect().cursor()
+            cursor.execute('SELECT value FROM ' + self.location[5:] + ' WHERE name = %s', (self.name,))
+            row = cursor.fetchone()
+            cursor.close()
+            if row is None:
+               return None
+            buf = row[0]
+
+         else:
+            if not os.path.exists(self.location):
+               return None
+            hFile = open(self.location, 'rb')
+            buf = hFile.read()
+            hFile.close()
+
+         return json.loads(buf)
+
+      except BaseException as err:
+         raise UserWarning('Error read checkpoint "' + self.location + '" - ' + str(err))
+
+   ###########################################################
+
+   def save(self, value):
+      try:
+         buf = json.dumps(value, default=str)
+
+         if self.location.startswith('s3://'):
+            (bucket, key) = self.location[5:].split('/', 1)
+            self._s3().put_object(Bucket=bucket, Key=key, Body=buf.encode('utf-8'))
+
+         elif self.location.startswith('db://'):
+            db = self.connect()
+            cursor = db.cursor()
+            cursor.execute('REPLACE INTO ' + self.location[5:] + ' (name, value) VALUES (%s, %s)', (self.name, buf))
+            cursor.close()
+            db.commit()
+
+         else:
+            tmp_file = self.location + '.tmp'  # a crash keeps the old value
+            hFile = open(tmp_file, 'wb')
+            hFile.write(buf.encode('utf-8'))
+            hFile.close()
+            os.replace(tmp_file, self.location)
+
+      except BaseException as err:
+         raise UserWarning('Error write checkpoint "' + self.location + '" - ' + str(err))
+
+   ###########################################################
+
+   @staticmethod
+   def _s3():
+      global ES_INDEXER_S3
+
+      if ES_INDEXER_S3 is None:
+         import boto3
+         ES_INDEXER_S3 = boto3.client('s3')
+
+      return ES_INDEXER_S3
+
+
+###########################################################
+###########################################################
+###########################################################
+
+
+
+class es_binlog:
+   """
+   changed keys of the configured tables from MySQL row based binlog events (binlog_format ROW), read live from a
+   replica stream (optional package mysql-replication) or offline from binlog files decoded via
+   mysqlbinlog --base64-output=DECODE-ROWS -v, the position after the last read transaction is kept in an es_checkpoint
+   """
+
+   sources = ('replica', 'file')
+
+   ###########################################################
+
+   def __init__(self, conf, base_dir: str, store, connection: dict = None):
+      """
+      conf: es_config with the binlog section, base_dir: folder for relative paths, store: es_checkpoint of the
+      position, connection: pymysql connection settings of the replica stream
+      """
+
+      self.source = conf.binlog_source
+      self.server_id = conf.binlog_server_id
+      self.connection = connection
+      self.columns = dict(conf.binlog_columns)
+
+      # schema.table -> key column, keys of other tables than the one of the last-modified field select the
+      # documents through the joins of sql.data
+      self.tables = dict(conf.binlog_tables)
+      if len(self.tables) == 0:
+         last_mod_field = conf.sql_last_mod_field.split('.')
+         self.tables[last_mod_field[0] + '.' + last_mod_field[1]] = conf.sql_upd_key.split('=')[0].split('.')[-1]
+
+      self.files = conf.binlog_files
+      if self.files is not None and not os.path.isabs(self.files):
+         self.files = os.path.join(base_dir, self.files)
+
+      self.store = store
+
+   ###########################################################
+
+   def read(self, max_keys: int = None) -> dict:
+      """
+      reads the events after the persisted position, returns the changed keys per table, the position after the
+      last complete transaction, the number of row events and if there are more events, reading stops at the first
+      transaction end after max_keys changed keys, the position is saved by the caller via store
+      """
+
+      start = self.store.load()
+      if start is None and self.source == 'replica':
+         # first run, the current end of the binlog is returned as position even without events, so the changes
+         # until the next run are read from there
+         start = self._masterStatus()
+
+      keys = {}
+      count = 0
+      events = 0
+      position = start
+      more = False
+
+      if self.source == 'replica':
+         reader = self._readReplica(start)
+      else:
+         reader = self._readFiles(start)
+
+      try:
+         for (kind, table, images, end) in reader:
+            if kind == 'commit':
+               position = end
+               if max_keys is not None and count >= max_keys:
+                  more = True
+                  break
+               continue
+
+            column = self.tables.get(table)
+            if column is None:
+               continue
+
+            events += 1
+            table_keys = keys.setdefault(table, {})
+            for values in images:  # before and after image of an UPDATE, a changed key selects both
+               if column not in values:
+                  raise UserWarning('binlog, key column ' + table + '.' + column + ' not found, known: ' +
+                                    ', '.join([str(name) for name in values]))
+               key = values[column]
+               if key is not None and key not in table_keys:
+                  table_keys[key] = True
+                  count += 1
+      finally:
+         reader.close()
+
+      return {'keys': {table: list(table_keys) for (table, table_keys) in keys.items()}, 'position': position,
+              'events': events, 'more': more}
+
+   ###########################################################
+
+   def _masterStatus(self):
+      import pymysql
+
+      try:
+         db = pymysql.connect(**self.connection)
+      except pymysql.err.OperationalError as err:
+         raise UserWarning('binlog, connect error - ' + str(err))
+
+      try:
+         cursor = db.cursor()
+         try:
+            cursor.execute('SHOW MASTER STATUS')
+         except pymysql.err.ProgrammingError:  # MySQL >= 8.4
+            cursor.execute('SHOW BINARY LOG STATUS')
+         row = cursor.fetchone()
+      finally:
+         db.close()
+
+      if row is None:
+         raise UserWarning('binlog, no binlog position, the server must run with log_bin and binlog_format ROW')
+
+      return {'file': row[0], 'pos': int(row[1])}
+
+   ###########################################################
+
+   def _readReplica(self, start):
+      try:
+         from pymysqlreplication import BinLogStreamReader
+         from pymysqlreplication.event import XidEvent, QueryEvent
+         from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+      except ImportError as err:
+         raise UserWarning('binlog source replica requires the package mysql-replication - ' + str(err))
+
+      position = {}
+      if start is not None:
+         position = {'log_file': start['file'], 'log_pos': start['pos']}
+
+      # the first run starts at the position of SHOW MASTER STATUS, see read
+      stream = BinLogStreamReader(connection_settings=self.connection, server_id=self.server_id,
+                                  resume_stream=True, blocking=False,
+                                  only_events=[WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent, XidEvent, QueryEvent],
+                                  only_schemas=sorted(set([table.split('.')[0] for table in self.tables])),
+                                  only_tables=sorted(set([table.split('.')[1] for table in self.tables])),
+                                  **position)
+
+      try:
+         for event in stream:
+            if isinstance(event, XidEvent) or (
+                    isinstance(event, QueryEvent) and str(event.query).strip().upper() == 'COMMIT'):
+               yield 'commit', None, None, {'file': stream.log_file, 'pos': stream.log_pos}
+            elif not isinstance(event, QueryEvent):
+               images = []
+               for row in event.rows:
+                  for image in ('values', 'before_values', 'after_values'):
+                     if image in row:
+                        images.append(row[image])
+               yield 'rows', event.schema + '.' + event.table, images, None
+      finally:
+         stream.close()
+
+   ###########################################################
+
+   def _readFiles(self, start):
+      import glob
+
+      files = sorted(glob.glob(self.files))
+
+      for file in files:
+         name = os.path.basename(file)
+         if start is not None and name < start['file']:
+            continue
+
+         skip_to = 0
+         if start is not None and name == start['file']:
+            skip_to = start['pos']
+
+         hFile = open(file, 'r', encoding='utf-8', errors='replace')
+         try:
+            for (kind, table, images, end) in self.parse(hFile, self.columns):
+               if end <= skip_to:
+                  continue
+               if kind == 'commit':
+                  yield kind, table, images, {'file': name, 'pos': end}
+               else:
+                  yield kind, table, images, None
+         finally:
+            hFile.close()
+
+   ###########################################################
+
+   re_header = re.compile(r'^#\d{6}\s+\d{1,2}:\d\d:\d\d\s+server id \d+\s+end_log_pos (\d+)')
+   re_row = re.compile(r'^### (INSERT INTO|UPDATE|DELETE FROM) `([^`]+)`\.`([^`]+)`')
+   re_value = re.compile(r'^###\s+@(\d+)=(.*)$')
+
+   @staticmethod
+   def parse(lines, columns: dict = None):
+      """
+      yields ('rows', schema.table, images, end_log_pos) and ('commit', None, None, end_log_pos) of mysqlbinlog -v
+      output, values are named by the column metadata of the Table_map event (binlog_row_metadata FULL and
+      mysqlbinlog --print-table-metadata) or columns {schema.table: [names]}, else by position as @1, @2, ...
+      """
+
+      columns = dict(columns or {})
+      end = 0
+      table = None
+      images = []
+      image = None
+      metadata = None
+      committed = False  # the Xid event is followed by its COMMIT statement
+
+      for line in lines:
+         line = line.rstrip('\r\n')
+
+         if metadata is not None:  # # Columns(`id` INT NOT NULL,\n#         `name` VARCHAR(20) ...)
+            name = re.match(r'^#\s*(?:Columns\()?`((?:[^`]|``)*)`', line)
+            if name is not None:
+               metadata[1].append(name.group(1).replace('``', '`'))
+               if not line.endswith(')'):
+                  continue
+               columns[metadata[0]] = metadata[1]
+            metadata = None
+
+         if line.startswith('#') and not line.startswith('###'):
+            header = es_binlog.re_header.match(line)
+            if header is not None:
+               if table is not None:
+                  yield 'rows', table, images, end
+                  table = None
+                  images = []
+
+               end = int(header.group(1))
+               committed = False
+               if '\tXid = ' in line or ' Xid = ' in line:
+                  committed = True
+                  yield 'commit', None, None, end
+               else:
+                  mapped = re.search(r'Table_map: `([^`]+)`\.`([^`]+)`', line)
+                  if mapped is not None:
+                     metadata = (mapped.group(1) + '.' + mapped.group(2), [])
+            continue
+
+         if line.startswith('COMMIT'):  # non transactional tables, COMMIT of a Query event
+            if table is not None:
+               yield 'rows', table, images, end
+               table = None
+               images = []
+            if not committed:
+               committed = True
+               yield 'commit', None, None, end
+            continue
+
+         if not line.startswith('###'):
+            continue
+
+         row = es_binlog.re_row.match(line)
+         if row is not None:
+            name = row.group(2) + '.' + row.group(3)
+            if table != name:  # rows of one event belong to one table
+               if table is not None:
+                  yield 'rows', table, images, end
+               images = []
+            table = name
+            image = None
+            continue
+
+         if line.startswith('### SET') or line.startswith('### WHERE'):
+            image = {}
+            images.append(image)
+            continue
+
+         value = es_binlog.re_value.match(line)
+         if value is not None and image is not None:
+            pos = int(value.group(1))
+            names = columns.get(table)
+            if names is not None and pos <= len(names):
+               image[names[pos - 1]] = es_binlog.value(value.group(2))
+            else:
+               image['@' + str(pos)] = es_binlog.value(value.group(2))
+
+      if table is not None:
+         yield 'rows', table, images, end
+
+   ###########################################################
+
+   @staticmethod
+   def value(text: str):
+      """
+      value of a @n= line, strings are unescaped, integers and decimals converted, -vv type comments ignored
+      """
+
+      text = re.sub(r'\s*/\*.*\*/\s*$', '', text)
+
+      if text.startswith("'"):
+         text = text[1:text.rfind("'")]
+         return re.sub(r"\\(x[0-9a-fA-F]{2}|.)",
+                       lambda m: chr(int(m.group(1)[1:], 16)) if m.group(1)[0] == 'x' and len(m.group(1)) == 3
+                       else {'n': "\n", 'r': "\r", 't': "\t", '0': "\0"}.get(m.group(1), m.group(1)), text)
+
+      if text == 'NULL':
+         return None
+
+      text = text.split(' ')[0]  # unsigned values are printed as -1 (4294967295)
+      if re.match(r'^-?\d+$', text):
+         return int(text)
+      if re.match(r'^-?\d+\.\d+$', text):
+         return decimal.Decimal(text)
+
+      return text
+
+
+###########################################################
+###########################################################
+###########################################################
+
+
+
+class es_hash_cache:
+   """
+   hashes of the acknowledged documents per index and _id in a SQLite file on local disk (e.g. /tmp, kept by warm
+   AWS Lambda containers), a document with the hash of its last indexed version is not sent again, the file is
+   bounded to max_entries, entries not seen for the longest time are evicted, preload reads all hashes of an index
+   into memory once per run
+   """
+
+   ###########################################################
+
+   def __init__(self, path: str, max_entries: int, preload: bool = False):
+      import sqlite3, hashlib
+
+      self.path = path
+      self.max_entries = max_entries
+      self.preload = preload
+      self.memory = {}
+      self.count = None  # upper bound of the entries, counted exactly only at open and to evict
+      self.lock = threading.Lock()
+      self._blake2b = hashlib.blake2b
+
+      try:
+         self.db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+         self.db.execute('PRAGMA journal_mode=WAL')  # readers of other processes are not blocked
+         self.db.execute('PRAGMA synchronous=NORMAL')
+         self.db.execute('CREATE TABLE IF NOT EXISTS hashes (idx TEXT NOT NULL, id TEXT NOT NULL, hash BLOB NOT NULL, '
+                         'seen REAL NOT NULL, PRIMARY KEY (idx, id))')
+         self.db.execute('CREATE INDEX IF NOT EXISTS hashes_seen ON hashes (seen)')
+      except sqlite3.Error as err:
+         raise UserWarning('Error open hash cache "' + path + '" - ' + str(err))
+
+   ###########################################################
+
+   def digest(self, doc: bytes) -> bytes:
+      return self._blake2b(doc, digest_size=16).digest()
+
+   ###########################################################
+
+   def begin(self):
+      """
+      called once per run, with preload the hashes of an index are read again at its first lookup, other processes
+      may have indexed newer versions meanwhile
+      """
+
+      with self.lock:
+         self.memory = {}
+
+   ###########################################################
+
+   def get(self, index: str, es_id: str):
+      if self.preload:
+         if index not in self.memory:
+            with self.lock:
+               self.memory[index] = dict(self.db.execute('SELECT id, hash FROM hashes WHERE idx = ?', (index,)))
+         return self.memory[index].get(es_id)
+
+      with self.lock:
+         row = self.db.execute('SELECT hash FROM hashes WHERE idx = ? AND id = ?', (index, es_id)).fetchone()
+
+      if row is None:
+         return None
+
+      return row[0]
+
+   ###########################################################
+
+   def put(self, entries: list):
+      """
+      stores the (index, _id, hash) of acknowledged documents, unchanged ones are marked as seen
+      """
+
+      if len(entries) == 0:
+         return
+
+      seen = time.time()
+      with self.lock:
+         self.db.execute('BEGIN')
+         try:
+            self.db.executemany('REPLACE INTO hashes (idx, id, hash, seen) VALUES (?, ?, ?, ?)',
+                                [(index, es_id, digest, seen) for (index, es_id, digest) in entries])
+            self.db.execute('COMMIT')
+         except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+
+         if self.count is not None:  # a replaced entry is counted again
+            self.count += len(entries)
+
+         for (index, es_id, digest) in entries:
+            if index in self.memory:
+               self.memory[index][es_id] = digest
+
+   ###########################################################
+
+   def evict(self) -> int:
+      """
+      deletes the entries not seen for the longest time above max_entries, returns the number of deleted entries,
+      the entries are only counted if the upper bound of put exceeds max_entries
+      """
+
+      with self.lock:
+         if self.count is not None and self.count <= self.max_entries:
+            return 0
+
+         count = self.db.execute('SELECT COUNT(*) FROM hashes').fetchone()[0]
+         self.count = count
+         if count <= self.max_entries:
+            return 0
+
+         # 10% below the limit, the next runs do not evict again at once
+         excess = count - int(self.max_entries * 0.9)
+         self.db.execute('DELETE FROM hashes WHERE rowid IN (SELECT rowid FROM hashes ORDER BY seen LIMIT ?)',
+                         (excess,))
+         self.count = count - excess
+
+      return excess
+
+   ###########################################################
+
+   def clear(self, index: str = None):
+      """
+      removes the hashes of the index or all, required if an index is deleted and created with the same name
+      """
+
+      with self.lock:
+         if index is None:
+            self.db.execute('DELETE FROM hashes')
+         else:
+            self.db.execute('DELETE FROM hashes WHERE idx = ?', (index,))
+         self.memory = {}
+         self.count = None
+
+   ###########################################################
+
+   @staticmethod
+   def open(path: str, max_entries: int, preload: bool = False):
+      """
+      returns the cache of the path, opened once per process
+      """
+
+      key = (path, os.getpid())  # a SQLite connection is not shared with a forked process
+      cache = ES_INDEXER_HASH_CACHES.get(key)
+      if cache is None:
+         cache = es_hash_cache(path, max_entries, preload)
+         ES_INDEXER_HASH_CACHES[key] = cache
+
+      cache.max_entries = max_entries
+      cache.preload = preload
+
+      return cache
+
+
+###########################################################
+###########################################################
+###########################################################
+
+
+
+class es_config:
+   """
+   config file parsed and validated once into typed values, cached per source (file path or s3://bucket/key) for
+   ES_INDEXER_CONFIG_TTL sec. (default 60) and then revalidated via mtime (file) or ETag (S3), invalid configs
+   raise before anything is indexed
+   """
+
+   ttl = float(os.environ.get('ES_INDEXER_CONFIG_TTL', 60))
+
+   reset_strategies = ('single', 'in', 'temp-table')
+
+   fanouts = ('shared', 'per-target')
+
+   raw = {}
+
+   ###########################################################
+
+   def __init__(self, raw: dict, name: str = ''):
+      """
+      raw: parsed JSON of the config file, name: file name for the error message
+      """
+
+      if not isinstance(raw, dict):
+         raise UserWarning('JSON file ' + name + ' format error - the config must be a JSON object')
+
+      self.raw = raw
+      self._errors = []
+
+      rds = self._section('rds')
+      self.rds_endpoint = self._value(rds, 'rds', 'endpoint', str)
+      self.rds_user = self._value(rds, 'rds', 'user', str)
+      self.rds_password = self._value(rds, 'rds', 'password', str)
+      self.rds_timeout = self._value(rds, 'rds', 'timeout', int, 3)
+      self.rds_retry = max(1, self._value(rds, 'rds', 'retry', int, 1))
+      self.rds_retry_wait_sec = self._value(rds, 'rds', 'retry_wait_sec', int, 1)
+      self.rds_reset_strategy = self._value(rds, 'rds', 'reset_strategy', str, 'single')
+      self.rds_reset_chunk_size = max(1, self._value(rds, 'rds', 'reset_chunk_size', int, 500))
+      self.rds_pool = self._value(rds, 'rds', 'pool', bool, True)
+      self.rds_pool_size = max(1, self._value(rds, 'rds', 'pool_size', int, 2))
+      self.rds_pool_ping_after_sec = self._value(rds, 'rds', 'pool_ping_after_sec', float, 10)
+      self.rds_pool_max_idle_sec = self._value(rds, 'rds', 'pool_max_idle_sec', float, 3600)
+
+      if self.rds_reset_strategy == 'executemany':  # removed, PyMySQL sends an UPDATE per key like single
+         self.rds_reset_strategy = 'in'
+
+      if self.rds_reset_strategy not in self.reset_strategies:
+         self._errors.append('rds.reset_strategy unknown: ' + str(self.rds_reset_strategy) + ', use ' +
+                             ', '.join(self.reset_strategies))
+
+      es = self._section('es')
+      self.es_endpoint = self._value(es, 'es', 'endpoint', str)
+      self.es_user = self._value(es, 'es', 'user', str, None)
+      self.es_password = self._value(es, 'es', 'password', str, None)
+      self.es_timeout = self._value(es, 'es', 'timeout', int, 3)
+      self.es_retry = max(1, self._value(es, 'es', 'retry', int, 1))
+      self.es_retry_wait_sec = self._value(es, 'es', 'retry_wait_sec', int, 1)
+      self.es_compression = self._value(es, 'es', 'compression', bool, False)
+      self.es_compression_level = self._value(es, 'es', 'compression_level', int, 6)
+      self.es_item_retry = max(0, self._value(es, 'es', 'item_retry', int, 3))
+      self.es_item_retry_wait_sec = self._value(es, 'es', 'item_retry_wait_sec', float, 0.5)
+      self.es_item_retry_max_wait_sec = self._value(es, 'es', 'item_retry_max_wait_sec', float, 30)
+      self.es_item_hold_invalid = self._value(es, 'es', 'item_hold_invalid', bool, False)
+      self.es_pipeline = max(0, self._value(es, 'es', 'pipeline', int, 0))
+      self.es_bulk_max_bytes = self._value(es, 'es', 'bulk_max_bytes', int, 1024 * 1024 * 5)  # max. MB size for bulk
+      self.es_bulk_max_docs = self._value(es, 'es', 'bulk_max_docs', int, None)
+      self.es_json_backend = self._value(es, 'es', 'json_backend', str, 'auto')
+      self.es_adaptive = self._value(es, 'es', 'adaptive', bool, False)
+      self.es_adaptive_target_bytes = self._value(es, 'es', 'adaptive_target_bytes', int, None)
+      self.es_adaptive_target_latency_sec = self._value(es, 'es', 'adaptive_target_latency_sec', float, None)
+      self.es_adaptive_max_delay_sec = self._value(es, 'es', 'adaptive_max_delay_sec', float, 10)
+      self.es_pool = self._value(es, 'es', 'pool', bool, True)
+      self.es_pool_max_idle_sec = self._value(es, 'es', 'pool_max_idle_sec', float, 300)
+      self.es_fanout = self._value(es, 'es', 'fanout', str, 'shared')
+
+      if self.es_compression_level is None or self.es_compression_level < 1 or self.es_compression_level > 9:
+         self.es_compression_level = 6
+
+      if self.es_fanout not in self.fanouts:
+         self._errors.append('es.fanout unknown: ' + str(self.es_fanout) + ', use ' + ', '.join(self.fanouts))
+
+      # the adaptive target must be reachable below the hard limit, default half of it
+      if self.es_adaptive_target_bytes is None:
+         self.es_adaptive_target_bytes = self.es_bulk_max_bytes // 2
+      self.es_adaptive_target_bytes = min(self.es_adaptive_target_bytes, self.es_bulk_max_bytes)
+
+      if self.es_json_backend not in es_json.backends:
+         self._errors.append('es.json_backend unknown: ' + str(self.es_json_backend) + ', use ' +
+                             ', '.join(es_json.backends))
+
+      sql = self._section('sql')
+      self.sql_last_mod_field = self._value(sql, 'sql', 'last-modified-timestamp-field', str)
+      self.sql_upd_key = self._value(sql, 'sql', 'last-modified-timestamp-upd-key', str)
+      self.sql_data = self._value(sql, 'sql', 'data', list)
+      self.sql_group_by = self._value(sql, 'sql', 'group-by', str, '')
+      self.sql_sort = self._value(sql, 'sql', 'sort', str, '')
+      self.sql_additional_where = self._value(sql, 'sql', 'additional-where', str, '')
+      self.sql_pk = self._value(sql, 'sql', 'additional-primary-key-for-full-indexing', str, '')
+      self.sql_keyset = self._value(sql, 'sql', 'full-indexing-keyset', bool, False)
+      self.sql_query_pre = self._value(sql, 'sql', 'query-pre', str, '')
+      self.sql_json_fields = set(self._value(sql, 'sql', 'json-fields', list, []) or [])
+      self.sql_json_prefix = self._value(sql, 'sql', 'json-prefix', str, 'json_')
+      self.sql_json_validate = self._value(sql, 'sql', 'json-validate', bool, True)
+      self.sql_json_detect = self._value(sql, 'sql', 'json-detect', bool, False)
+      self.sql_tinyint_bool = self._value(sql, 'sql', 'tinyint1-bool', bool, False)
+
+      if self.sql_last_mod_field is not None and len(self.sql_last_mod_field.split('.')) != 3:
+         self._errors.append('sql.last-modified-timestamp-field format error, <schema>.<table>.<field>')
+
+      if self.sql_upd_key is not None and self.sql_upd_key.find('=') == -1:
+         self._errors.append('sql.last-modified-timestamp-upd-key, missing variable allocation like: id=$id_doc')
+
+      if self.sql_keyset and len(self.sql_pk) == 0:
+         self._errors.append('sql.full-indexing-keyset requires additional-primary-key-for-full-indexing')
+
+      for item in self.sql_data or []:
+         if not isinstance(item, dict) or 'schema' not in item or 'table' not in item or 'fields' not in item:
+            self._errors.append('sql.data, every item requires schema, table and fields')
+            break
+
+      for item in (self.sql_data or [])[1:]:
+         if isinstance(item, dict) and 'join' not in item:
+            self._errors.append('sql.data, missing key join of table ' + str(item.get('table')))
+
+      binlog = self.raw.get('binlog', {})
+      self.binlog_enabled = self._value(binlog, 'binlog', 'enabled', bool, False)
+      self.binlog_source = self._value(binlog, 'binlog', 'source', str, 'replica')
+      self.binlog_server_id = self._value(binlog, 'binlog', 'server_id', int, None)
+      self.binlog_files = self._value(binlog, 'binlog', 'files', str, None)
+      self.binlog_tables = self._value(binlog, 'binlog', 'tables', dict, {})
+      self.binlog_columns = self._value(binlog, 'binlog', 'columns', dict, {})
+      self.binlog_position_file = self._value(binlog, 'binlog', 'position_file', str, None)
+
+      if self.binlog_enabled:
+         if self.binlog_source not in es_binlog.sources:
+            self._errors.append('binlog.source unknown: ' + str(self.binlog_source) + ', use ' +
+                                ', '.join(es_binlog.sources))
+         if self.binlog_source == 'replica' and self.binlog_server_id is None:
+            self._errors.append('binlog.server_id is required for the source replica, unique among all replicas')
+         if self.binlog_source == 'file' and self.binlog_files is None:
+            self._errors.append('binlog.files is required for the source file')
+
+      checkpoint = self.raw.get('checkpoint', {})
+      self.checkpoint_enabled = self._value(checkpoint, 'checkpoint', 'enabled', bool, False)
+      self.checkpoint_location = self._value(checkpoint, 'checkpoint', 'location', str, None)
+      self.checkpoint_key = self._value(checkpoint, 'checkpoint', 'key', str, self.sql_pk)
+      self.checkpoint_lag_sec = self._value(checkpoint, 'checkpoint', 'lag_sec', int, 0)
+
+      if self.checkpoint_enabled:
+         if self.binlog_enabled:
+            self._errors.append('checkpoint and binlog can not be enabled together')
+         if self.checkpoint_key is None or len(self.checkpoint_key) == 0:
+            self._errors.append('checkpoint.key or additional-primary-key-for-full-indexing is required for the '
+                                'checkpoint')
+
+      hash_cache = self.raw.get('hash_cache', {})
+      self.hash_cache_enabled = self._value(hash_cache, 'hash_cache', 'enabled', bool, False)
+      self.hash_cache_path = self._value(hash_cache, 'hash_cache', 'path', str, '/tmp/es_indexer_hashes.sqlite')
+      self.hash_cache_max_entries = max(1, self._value(hash_cache, 'hash_cache', 'max_entries', int, 1000000))
+      self.hash_cache_preload = self._value(hash_cache, 'hash_cache', 'preload', bool, False)
+
+      settings = self.raw.get('settings', {})
+      self.settings_replicas = settings.get('replicas')
+      self.settings_shards = settings.get('shards')
+      self.settings_refresh_interval = settings.get('refresh_interval')
+
+      self.sanitize = self.raw.get('sanitize', {})
+      self.metrics = self.raw.get('metrics', {})
+
+      self.mapping = self.raw.get('mapping')
+      self.targets = self._targets(self._value(self.raw, 'targets', 'targets', list, []) or [])
+
+      if len(self.targets) == 0:
+         self._mappingCheck(self.mapping, 'mapping')
+
+      if len(self._errors) > 0:
+         raise UserWarning('JSON file ' + name + ' format error - ' + '; '.join(self._errors))
+
+   ###########################################################
+
+   def _targets(self, targets):
+      """
+      indices fed from the same SQL read, mapping and settings of a target default to the top-level ones
+      """
+
+      parsed = []
+      names = set()
+      for pos, target in enumerate(targets):
+         section = 'targets[' + str(pos) + ']'
+         if not isinstance(target, dict):
+            self._errors.append(section + ' must be dict')
+            continue
+
+         index = self._value(target, section, 'index', str)
+         if index is None:
+            continue
+         if len(index) == 0:
+            self._errors.append('missing key: ' + section + '.index')
+            continue
+         if index in names:
+            self._errors.append(section + '.index duplicate: ' + index)
+         names.add(index)
+
+         mapping = target.get('mapping', self.mapping)
+         self._mappingCheck(mapping, section + '.mapping')
+
+         settings = target.get('settings', {})
+         parsed.append({'index': index, 'mapping': mapping,
+                        'replicas': settings.get('replicas', self.settings_replicas),
+                        'shards': settings.get('shards', self.settings_shards),
+                        'refresh_interval': settings.get('refresh_interval', self.settings_refresh_interval)})
+
+      return parsed
+
+   ###########################################################
+
+   def _mappingCheck(self, mapping, section):
+      if not isinstance(mapping, dict):
+         self._errors.append('missing key: ' + section)
+         return
+
+      if '_id' not in mapping:
+         self._errors.append('internal ES _id mapping is missing (' + section + ')')
+      if '_type' not in mapping:
+         self._errors.append('internal ES _type mapping is missing (' + section + ')')
+
+   ###########################################################
+
+   def _section(self, section):
+      if not isinstance(self.raw.get(section), dict):
+         self._errors.append('missing key: ' + section)
+         return {}
+
+      return self.raw[section]
+
+   ###########################################################
+
+   _required = object()
+
+   def _value(self, node, section, key, ftype, default=_required):
+      if key not in node or node[key] is None:
+         if default is es_config._required:
+            if len(node) > 0:
+               self._errors.append('missing key: ' + section + '.' + key)
+            return None
+         return default
+
+      value = node[key]
+      try:
+         if ftype == bool and not isinstance(value, bool):  # only JSON true/false, bool("false") would be True
+            raise ValueError(type(value).__name__ + ' ' + json.dumps(value))
+         if ftype in (int, float):
+            return ftype(value)
+         if not isinstance(value, ftype):
+            raise ValueError(type(value).__name__)
+      except (TypeError, ValueError) as err:
+         self._errors.append(section + '.' + key + ' must be ' + ftype.__name__ + ' - ' + str(err))
+         return None if default is es_config._required else default
+
+      return value
+
+   ###########################################################
+
+   @staticmethod
+   def cached(source: str, name: str, fetch):
+      """
+      returns (es_config, state) of the source, state: hit, revalidated or loaded
+
+      fetch: callable(cached version or None), returns (content, version) or None if the cached version is
+             still current (e.g. S3 GetObject with IfNoneMatch), called only after the TTL
+      """
+
+      entry = ES_INDEXER_CONFIG_CACHE.get(source)
+      now = time.time()
+
+      if entry is not None and now - entry['checked'] < es_config.ttl:
+         return entry['config'], 'hit'
+
+      result = fetch(entry['version'] if entry is not None else None)
+
+      if result is None:
+         entry['checked'] = now
+         return entry['config'], 'revalidated'
+
+      (content, version) = result
+
+      try:
+         raw = ES_INDEXER_JSON.loads(content)
+      except BaseException as err:
+         raise UserWarning('JSON file ' + name + ' format error - ' + str(err))
+
+      config = es_config(raw, name)
+      ES_INDEXER_CONFIG_CACHE[source] = {'config': config, 'version': version, 'checked': now}
+
+      return config, 'loaded'
+
+###########################################################
+###########################################################
+###########################################################
+
+
+
+class es_indexer:
+   s3bucket = ''
+   s3prefix = ''
+
+   filetype = ''
+   folder = ''
+
+   indexname = ''
+
+   config_file = ''
+   config = ''
+
+   db = None
+
+   db_upd = None
+
+   http = None
+
+   bulklimit = 0
+
+   upd_keys = []
+
+   debug = False
+
+   offset = None
+
+   last_modified_timestamp_upd = True
+
+   stream = False
+
+   keyset = False
+
+   keyset_field = 'es_indexer_last_key'
+
+   key_to = None
+
+   pipeline = 0
+
+   bulk_max_bytes = 1024 * 1024 * 5
+
+   bulk_max_docs = 0
+
+   controller = None
+
+   sanitizer = None
+
+   serializer = ES_INDEXER_JSON
+
+   metrics = None
+
+   conf = None
+
+   json_fields = set()
+
+   json_prefix = 'json_'
+
+   json_validate = True
+
+   json_detect = False
+
+   tinyint_bool = False
+
+   description = None
+
+   lock = None
+
+   upd_lock = None
+
+   select_query = None
+
+   binlog = None
+
+   binlog_keys = None
+
+   checkpoint = None
+
+   checkpoint_value = None
+
+   checkpoint_bulks = []
+
+   checkpoint_fields = ('es_indexer_checkpoint_ts', 'es_indexer_checkpoint_key')
+
+   hash_cache = None
+
+   mapping_template = None
+
+   targets = []
+
+   es_id_var_name = ''
+
+   es_type = ''
+
+   upd_key_name = ''
+
+   upd_key_var = ''
+
+   ###########################################################
+
+   def __init__(self, s3bucket_filetype: str, s3prefix_folder: str, indexname: str, bulklimit: int,
+                configfile: str = '', offset: int = None, last_modified_timestamp_upd: bool = True,
+                stream: bool = False):
+      """
+      Parameters
+      ----------
+      s3bucket_filetype : str
+         s3://my-bucket or file://
+      s3prefix_folder : str
+         S3 prefix or local folder name where the config file is located
+      indexname : str, optional
+         name of index in Elasticsearch
+      bulklimit : int
+         number of records per run or in case of init per loop
+      configfile : str, optional
+         name of config file
+      offset : int, optional
+         used for initial indexing, with sql.full-indexing-keyset the last indexed key (exclusive),
+         the next one is returned as measure['last_key']
+      last_modified_timestamp_upd : bool, optional
+         useful if you initial indexing an test env from same source as productive
+      stream : bool, optional
+         read all records via unbuffered cursor with flat memory, bulklimit is then the number of records per bulk request
+
+      Samples
+      ----------
+      # sample 1
+      es_indexer('s3://my-bucket', 'config', 'test', 5) # without filename, the class search for a config file like test.json
+      # sample 2
+      es_indexer('file://', 'config', 'index1', 10, 'index1.json')
+      # sample 3
+      es_indexer('file://', 'config', 'index1', limit, 'index1.json', offset, False)
+      # sample 4, all changed records in one run
+      es_indexer('file://', 'config', 'index1', 1000, 'index1.json', stream=True)
+      """
+
+      self._init(s3bucket_filetype, s3prefix_folder, indexname, bulklimit, configfile, offset,
+                 last_modified_timestamp_upd, stream)
+      try:
+         self._run()
+      finally:
+         self.close()
+
+   ###########################################################
+
+   def _init(self, s3bucket_filetype: str, s3prefix_folder: str, indexname: str, bulklimit: int,
+             configfile: str = '', offset: int = None, last_modified_timestamp_upd: bool = True,
+             stream: bool = False):
+      global ES_INDEXER_DEBUG
+
+      import pymysql
+
+      warnings.simplefilter("error", category=pymysql.Warning)
+
+      if os.environ.get('ES_INDEXER_DEBUG') is not None:
+         ES_INDEXER_DEBUG = bool(os.environ.get('ES_INDEXER_DEBUG'))
+
+      try:
+         if ES_INDEXER_DEBUG:
+            self.debug = True
+      except NameError:
+         pass
+
+      self.measure = {}
+
+      if s3bucket_filetype.find('s3://') != -1:
+         self.s3bucket = s3bucket_filetype[5:]
+         self.s3prefix = s3prefix_folder
+      elif s3bucket_filetype.find('file://') != -1:
+         self.filetype = s3bucket_filetype[7:]
+         self.folder = s3prefix_folder
+      else:
+         raise UserWarning('Error, parameter "s3bucket_filetype" must contain s3:// or file://')
+
+      self.indexname = indexname
+      self.bulklimit = bulklimit
+      self.config_file = configfile
+
+      if self.bulklimit > 5000:  # max ES bulk limit
+         self.bulklimit = 5000
+      if self.bulklimit < 1:
+         self.bulklimit = 1
+
+      self.offset = offset
+      self.last_modified_timestamp_upd = last_modified_timestamp_upd
+      self.stream = stream
+
+      # print('debug', __class__, inspect.currentframe().f_back.f_lineno)
+      # return None
+
+      tick = time.time()
+
+      if s3bucket_filetype.find('s3://') != -1:
+         (conf, state) = self._s3getConfig()
+      else:
+         (conf, state) = self._fs_getConfig()
+
+      self.conf = conf
+      self.config = conf.raw
+
+      elapsed_time = time.time() - tick
+      self.measure['timings'] = {'config': elapsed_time}
+      self.measure['config'] = state
+
+      self.keyset = conf.sql_keyset
+      self.pipeline = conf.es_pipeline
+      self.bulk_max_bytes = conf.es_bulk_max_bytes
+
+      self.bulk_max_docs = self.bulklimit
+      if conf.es_bulk_max_docs is not None:
+         self.bulk_max_docs = min(conf.es_bulk_max_docs, self.bulklimit)
+
+      if self.bulk_max_docs < 1:
+         self.bulk_max_docs = 1
+
+      self.sanitizer = es_sanitizer(conf.sanitize)
+      self.serializer = es_json(conf.es_json_backend)
+      self.metrics = es_metrics.open(conf.metrics, {'index': self.indexname})
+
+      self.json_fields = conf.sql_json_fields
+      self.json_prefix = conf.sql_json_prefix
+      self.json_validate = conf.sql_json_validate
+      self.json_detect = conf.sql_json_detect
+      self.tinyint_bool = conf.sql_tinyint_bool
+
+      self.controller = None
+      if conf.es_adaptive:
+         # starts at a quarter of bulk_max_docs to grow or shrink towards the target, bulk_max_bytes is still the
+         # hard limit
+         self.controller = es_bulk_controller(self.bulk_max_docs // 4, self.bulk_max_docs,
+                                              conf.es_adaptive_target_bytes, conf.es_adaptive_target_latency_sec,
+                                              conf.es_adaptive_max_delay_sec)
+
+      self.hash_cache = None
+      if conf.hash_cache_enabled:
+         self.hash_cache = es_hash_cache.open(conf.hash_cache_path, conf.hash_cache_max_entries,
+                                              conf.hash_cache_preload)
+
+      self.binlog = None
+      self.binlog_keys = None
+      if conf.binlog_enabled:
+         (host, port) = self._rdsHostPort()
+         connection = {'host': host, 'port': port, 'user': conf.rds_user, 'passwd': conf.rds_password,
+                       'connect_timeout': conf.rds_timeout}
+         self.binlog = es_binlog(conf, self._baseDir(), self._checkpointStore(conf.binlog_position_file, 'binlog'),
+                                 connection)
+
+      self.checkpoint = None
+      self.checkpoint_value = None
+      self.checkpoint_bulks = []
+      if conf.checkpoint_enabled:
+         self.checkpoint = self._checkpointStore(conf.checkpoint_location, 'checkpoint')
+
+      self.lock = threading.Lock()
+      self.upd_lock = threading.Lock()
+
+      self.upd_keys = []
+
+      if self.debug:
+         print("\r\nDebug " + inspect.currentframe().f_code.co_name + ";\r\n", "Config File: " + self.config_file,
+               "\r\n", "Payload: " + json.dumps(self.config, sort_keys=True, indent=3), "\r\n\r\n", "#" * 50, "\r\n")
+
+   ###########################################################
+
+   def _run(self):
+      self.upd_keys = []
+
+      handshakes = self._handshakes()
+
+      self._do()
+
+      if self.hash_cache is not None:
+         self.measure['evicted'] = self.hash_cache.evict()
+
+      for (kind, count) in self._handshakes().items():
+         self.measure.setdefault('handshakes', {})[kind] = count - handshakes[kind]
+         self.metrics.count(kind + '_handshakes', count - handshakes[kind])
+
+      timeings = self.measure['timings']
+      total = 0
+      for key in timeings:
+         total += timeings[key]
+
+      self.measure['timings'].update({'total': total})
+
+      indexed = self.measure.get('indexed', 0)
+      if total > 0:
+         self.measure['rows_per_sec'] = round(indexed / total, 1)
+
+      self.metrics.count('runs')
+      self.metrics.count('rows_selected', indexed)
+      self.metrics.count('bulk_requests', self.measure['bulks'])
+      self.metrics.count('bytes_raw', self.measure['bytes'])
+      self.metrics.count('bytes_sent', self.measure['bytes_sent'])
+      self.metrics.count('bulk_items_retried', self.measure['retried'])
+      self.metrics.count('bulk_items_failed', self.measure['failed'])
+      self.metrics.gauge('rows_per_sec', self.measure.get('rows_per_sec', 0))
+      self.metrics.observe('run', total)
+      self.metrics.export()
+
+      global ES_INDEXER_MEASURE
+      ES_INDEXER_MEASURE = self.measure
+
+   ###########################################################
+
+   def _fs_getConfig(self):
+      config_file = ''
+
+      if self.config_file == '':
+         config_file = self.indexname + '.json'
+      else:
+         config_file = self.config_file
+
+      if not self.folder:
+         config_file = config_file
+      else:
+         config_file = self.folder + '/' + config_file
+
+      config_file = os.path.realpath(os.path.dirname(os.path.abspath(__file__)) + '/../' + config_file)
+
+      self.config_file = config_file
+
+      def fetch(version):
+         try:
+            stat = os.stat(config_file)
+            if (stat.st_mtime_ns, stat.st_size) == version:
+               return None
+
+            hFile = open(config_file, 'rb')
+            buf = hFile.read()
+            hFile.close()
+
+         except BaseException as err:
+            raise UserWarning('Error read config from local fs, File: "' + config_file + '" - ' + str(err))
+
+         return buf, (stat.st_mtime_ns, stat.st_size)
+
+      return es_config.cached(config_file, self.config_file, fetch)
+
+   ###########################################################
+
+   def _s3getConfig(self):
+      config_file = ''
+
+      if self.config_file == '':
+         config_file = self.indexname + '.json'
+      else:
+         config_file = self.config_file
+
+      if not self.s3prefix:
+         config_file = config_file
+      else:
+         config_file = self.s3prefix + '/' + config_file
+
+      self.config_file = config_file
+
+      def fetch(etag):
+         global ES_INDEXER_S3
+
+         try:
+            if ES_INDEXER_S3 is None:
+               import boto3  # only for configs on S3
+               ES_INDEXER_S3 = boto3.client('s3')
+
+            if etag is None:
+               obj = ES_INDEXER_S3.get_object(Bucket=self.s3bucket, Key=config_file)
+            else:
+               obj = ES_INDEXER_S3.get_object(Bucket=self.s3bucket, Key=config_file, IfNoneMatch=etag)
+
+            return obj['Body'].read(), obj.get('ETag')
+
+         except BaseException as err:
+            response = getattr(err, 'response', None)
+            if etag is not None and isinstance(response, dict) and (
+                    response.get('Error', {}).get('Code') in ('304', 'NotModified') or
+                    response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 304):
+               return None  # unchanged since the cached ETag
+
+            raise UserWarning(
+               'Error read config from s3 bucket "' + self.s3bucket + '", File: "' + config_file + '" - ' + str(err))
+
+      return es_config.cached('s3://' + self.s3bucket + '/' + config_file, self.config_file, fetch)
+
+   ###########################################################
+
+   def _rdsConnect(self):
+      if self.db != None:
+         return self.db
+
+      self.db = self._rdsOpen()
+
+      return self.db
+
+   ###########################################################
+
+   def _rdsUpdConnect(self):
+      if not self.stream and self.pipeline == 0:
+         return self._rdsConnect()
+
+      # the unbuffered or pipelined SELECT blocks its connection until the last row is read
+      if self.db_upd != None:
+         return self.db_upd
+
+      self.db_upd = self._rdsOpen()
+
+      return self.db_upd
+
+   ###########################################################
+
+   def _rdsOpen(self):
+      if not self.conf.rds_pool:
+         return self._rdsNew()
+
+      return ES_INDEXER_POOL.acquire_db(self._rdsPoolKey(), self._rdsNew, self.conf.rds_pool_ping_after_sec,
+                                        self.conf.rds_pool_max_idle_sec)
+
+   ###########################################################
+
+   def _rdsPoolKey(self):
+      # connections of the pool run the query-pre of their key, see _queryPre
+      return (self.conf.rds_endpoint, self.conf.rds_user, self.conf.rds_password, self.conf.sql_query_pre)
+
+   ###########################################################
+
+   @staticmethod
+   def _baseDir():
+      # relative paths of the config start in the parent folder of libs, like the config folder
+      return os.path.realpath(os.path.dirname(os.path.abspath(__file__)) + '/..')
+
+   ###########################################################
+
+   def _checkpointStore(self, location, kind):
+      if location is None:  # next to a local config file, <config>.<kind>.json
+         if self.s3bucket != '':
+            raise UserWarning(kind + ' location is required for configs on S3, a local file, s3://bucket/key or '
+                                     'db://schema.table')
+         location = re.sub(r'\.json$', '', self.config_file) + '.' + kind + '.json'
+
+      return es_checkpoint(location, self.indexname + '.' + kind, self._baseDir(), self._rdsUpdConnect)
+
+   ###########################################################
+
+   def _rdsHostPort(self):
+      endpoint = self.conf.rds_endpoint
+
+      port = 3306
+      if endpoint.find(':') != -1:
+         endpoint = endpoint.split(':')
+         port = int(endpoint[1])
+         endpoint = endpoint[0]
+
+      return endpoint, port
+
+   ###########################################################
+
+   def _rdsNew(self):
+      import pymysql
+
+      user = self.conf.rds_user
+      pw = self.conf.rds_password
+      timeout = self.conf.rds_timeout
+
+      (endpoint, port) = self._rdsHostPort()
+
+      db = None
+      try:
+         db = pymysql.connect(host=endpoint, port=port, user=user, passwd=pw, charset='utf8',
+                              connect_timeout=timeout)
+      except pymysql.err.OperationalError as err:
+         raise UserWarning('Error , current timeout ' + str(
+            timeout) + ', you can increase it via key timeout in the *.json file - ' + str(err))
+
+      ES_INDEXER_POOL.handshake('db')
+
+      self._queryPre(db)
+
+      return db
+
+   ###########################################################
+
+   def _rdsRelease(self, db):
+      if self.conf is not None and self.conf.rds_pool:
+         ES_INDEXER_POOL.release_db(self._rdsPoolKey(), db, self.conf.rds_pool_size)
+      else:
+         es_connection_pool.discard_db(db)
+
+   ###########################################################
+
+   def _queryPre(self, db):
+      import pymysql
+
+      # session settings, executed once per connection
+      if len(self.conf.sql_query_pre) > 0:
+         try:
+            query_pre = self.conf.sql_query_pre
+
+            if len(query_pre) > 0:
+               cursor = db.cursor()
+               cursor.execute(query_pre)
+               db.commit()
+
+               if self.debug:
+                  print("\r\nDebug " + inspect.currentframe().f_code.co_name + ";\r\n", "Query-Pre: " + query_pre,
+                        "\r\n\r\n", "#" * 50, "\r\n")
+
+         except pymysql.Warning as err:
+            raise UserWarning('SQL warning', err, query_pre)
+         except pymysql.err.ProgrammingError as err:
+            raise UserWarning('SQL error', err, query_pre)
+
+   ###########################################################
+
+   def _httpSession(self):
+      if self.http != None:
+         return self.http
+
+      if self.conf.es_pool:
+         key = (self.conf.es_endpoint, self.conf.es_user, self.conf.es_password, max(10, self.pipeline))
+         self.http = ES_INDEXER_POOL.http_session(key, self._httpNew, self.conf.es_pool_max_idle_sec)
+      else:
+         self.http = self._httpNew()
+
+      return self.http
+
+   ###########################################################
+
+   def _httpNew(self):
+      import requests, requests.adapters, urllib3
+      from requests.auth import HTTPBasicAuth
+
+      user = self.conf.es_user
+      pw = self.conf.es_password
+
+      urllib3.disable_warnings(
+         urllib3.exceptions.InsecureRequestWarning)  # to support local ES endpoints via SSH tunnel, sample: https://127.0.0.1:9200
+
+      # keep-alive connection pool, reused by all requests of this instance or with es.pool of the process
+      http = requests.Session()
+      if self.pipeline > 0:
+         adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(10, self.pipeline))
+         http.mount('http://', adapter)
+         http.mount('https://', adapter)
+      http.verify = False
+      http.headers.update({"Content-Type": "application/json; charset=utf-8"})
+
+      if user is not None and pw is not None:
+         http.auth = HTTPBasicAuth(user, pw)
+
+      return http
+
+   ###########################################################
+
+   def _handshakes(self) -> dict:
+      # process wide with es.pool / rds.pool, sessions of the instance count only while they are open
+      count = ES_INDEXER_POOL.count()
+      if self.http is not None and not self.conf.es_pool:
+         count['http'] += es_connection_pool._httpConnections(self.http)
+
+      return count
+
+   ###########################################################
+
+   def close(self):
+      """
+      returns the DB connections and the HTTP session to the pool (rds.pool, es.pool) or closes them
+      """
+
+      for db in [self.db, self.db_upd]:
+         if db != None:
+            self._rdsRelease(db)
+
+      self.db = None
+      self.db_upd = None
+
+      if self.http != None:
+         if self.conf is None or not self.conf.es_pool:
+            self.http.close()
+         self.http = None
+
+   ###########################################################
+
+   def _sqlSelect(self):
+      checkpoint = self.checkpoint is not None and self.offset is None
+
+      # the incremental query never changes, only the ones of binlog keys and of the checkpoint
+      if self.offset is None and self.select_query is not None and self.binlog_keys is None and not checkpoint:
+         return self.select_query
+
+      import pymysql
+
+      last_mod_field = ''
+      data = ''
+      group_by = ''
+      sort = ''
+      additional_where = ''
+      additional_primary_key_for_full_indexing = ''
+
+      last_mod_field = self.conf.sql_last_mod_field
+      data = self.conf.sql_data
+      group_by = self.conf.sql_group_by
+      sort = self.conf.sql_sort
+      additional_where = self.conf.sql_additional_where
+      additional_primary_key_for_full_indexing = self.conf.sql_pk
+
+      keyset = self.keyset and self.offset is not None
+      if keyset and len(additional_primary_key_for_full_indexing) == 0:
+         raise UserWarning('full-indexing-keyset requires additional-primary-key-for-full-indexing')
+
+      fields = ''
+      tfrom = ''
+      i = 0
+      joins = []
+      try:
+         for item in data:
+            schema_table = item["schema"] + '.' + item["table"] + '.'
+            if i == 0:
+               tfrom = item["schema"] + '.' + item["table"]
+            else:
+               joins.append({"join": item["join"], "schema": item["schema"], "table": item["table"]})
+
+            for fname in item["fields"]:
+               if fname.find('.') > 0:  # to support functions
+                  schema_table = ''
+
+               fields += schema_table + fname + ', '
+
+            i += 1
+
+         if keyset:  # to return the last indexed key
+            fields += additional_primary_key_for_full_indexing + ' AS ' + self.keyset_field + ', '
+
+         if checkpoint:  # high-water mark of the last row
+            fields += last_mod_field + ' AS ' + self.checkpoint_fields[0] + ', ' + self.conf.checkpoint_key + ' AS ' + \
+                      self.checkpoint_fields[1] + ', '
+
+         query = 'SELECT ' + fields[0:-2] + ' FROM ' + tfrom
+
+         for item in joins:
+            query += ' LEFT JOIN ' + item["schema"] + '.' + item["table"]
+            if item["join"].upper().find(' ON ') == -1:
+               query += ' ON ' + item["join"]
+            else:
+               query += ' ' + item["join"]
+
+         if self.binlog_keys is not None:  # change capture, all rows of the changed keys
+            changed = []
+            for (table, column) in self.binlog.tables.items():
+               keys = self.binlog_keys.get(table, [])
+               if len(keys) > 0:
+                  changed.append(table + '.' + column + ' IN (' + ', '.join(
+                     [pymysql.converters.escape_item(key, 'utf8') for key in keys]) + ')')
+            query += ' WHERE (' + ' OR '.join(changed) + ')'
+         elif checkpoint:
+            # (ts, key) > checkpoint, written out for an index range scan on MySQL < 8 and MariaDB
+            if self.checkpoint_value is None:
+               query += ' WHERE ' + last_mod_field + ' IS NOT NULL'
+            else:
+               ts = pymysql.converters.escape_item(self.checkpoint_value['ts'], 'utf8')
+               key = pymysql.converters.escape_item(self.checkpoint_value['key'], 'utf8')
+               query += ' WHERE (' + last_mod_field + ' > ' + ts + ' OR (' + last_mod_field + ' = ' + ts + ' AND ' + \
+                        self.conf.checkpoint_key + ' > ' + key + '))'
+            if self.conf.checkpoint_lag_sec > 0:  # rows of transactions still open may get an older timestamp
+               query += ' AND ' + last_mod_field + ' < NOW() - INTERVAL ' + str(self.conf.checkpoint_lag_sec) + ' SECOND'
+         elif self.offset is None:
+            query += ' WHERE ' + last_mod_field + ' != "1970-01-01 00:00:00"'
+         elif keyset:  # seek to the last indexed key, every page is a full index range scan
+            query += ' WHERE ' + additional_primary_key_for_full_indexing + ' > ' + pymysql.converters.escape_item(
+               self.offset, 'utf8')
+            if self.key_to is not None:  # upper bound of a partition
+               query += ' AND ' + additional_primary_key_for_full_indexing + ' <= ' + pymysql.converters.escape_item(
+                  self.key_to, 'utf8')
+         else:
+            if len(additional_primary_key_for_full_indexing) > 0:
+               query += ' WHERE ' + additional_primary_key_for_full_indexing + ' >= ' + str(self.offset)
+               if not self.stream:
+                  query += ' AND ' + additional_primary_key_for_full_indexing + ' <= ' + str(
+                     self.offset + self.bulklimit)
+
+         if len(additional_where) > 0:
+            if self.offset is None or query.find(' WHERE ') != -1:
+               query += ' AND ' + additional_where
+            else:
+               query += ' WHERE ' + additional_where
+
+         if len(group_by) > 0:
+            query += ' GROUP BY ' + group_by
+
+         offset = ''
+         if self.offset is not None and len(
+                 additional_primary_key_for_full_indexing) == 0:  # use OFFSET/LIMIT only if not possible via PK
+            offset = str(self.offset) + ', '
+
+         if keyset:
+            query += ' ORDER BY ' + additional_primary_key_for_full_indexing + ' ASC'
+         elif checkpoint:
+            query += ' ORDER BY ' + last_mod_field + ' ASC, ' + self.conf.checkpoint_key + ' ASC'
+         elif len(sort) > 0:
+            query += ' ORDER BY ' + last_mod_field + ' ' + sort
+
+         if not self.stream and self.binlog_keys is None:
+            query += ' LIMIT ' + offset + str(self.bulklimit)
+         elif len(offset) > 0:
+            query += ' LIMIT ' + offset + '18446744073709551615'  # MySQL requires a LIMIT for an offset
+
+
+      except KeyError as err:
+         raise UserWarning('JSON file ' + self.config_file + ' format error, missing key: ' + str(err))
+
+      if self.offset is None and self.binlog_keys is None and not checkpoint:
+         self.select_query = query
+
+      return query
+
+   ###########################################################
+
+   def _execSelect(self):
+      import pymysql
+
+      db = self._rdsConnect()
+
+      # ends the read transaction of the previous SELECT, under REPEATABLE READ its snapshot would hide the resets
+      # committed since then (second connection with stream or pipeline, changes of other clients in a session)
+      db.rollback()
+
+      # rows are tuples, converted by position with the converters derived from cursor.description
+      if self.stream:
+         cursor = db.cursor(pymysql.cursors.SSCursor)  # unbuffered, rows are read while indexing
+      else:
+         cursor = db.cursor(pymysql.cursors.Cursor)
+      cursor._defer_warnings = True
+      query = self._sqlSelect()
+
+      if self.debug:
+         print("\r\nDebug " + inspect.currentframe().f_code.co_name + ";\r\n", "Query: " + query, "\r\n\r\n", "#" * 50,
+               "\r\n")
+
+      tick = time.time()
+
+      try:
+         with self.metrics.profile('sql_select'):
+            cursor.execute(query)
+
+      except pymysql.Warning as err:
+         raise UserWarning('SQL warning', err, query)
+      except pymysql.err.ProgrammingError as err:
+         raise UserWarning('SQL error', err, query)
+
+      self.description = cursor.description
+
+      if self.stream:
+         self._addTiming('sql_select', time.time() - tick)
+         self.measure['indexed'] = 0
+         return self._streamRows(cursor)
+
+      with self.metrics.profile('sql_select'):
+         rows = cursor.fetchall();
+
+      elapsed_time = time.time() - tick
+      self._addTiming('sql_select', elapsed_time)
+
+      self.measure['indexed'] = len(rows)
+
+      return rows
+
+   ###########################################################
+
+   def _streamRows(self, cursor):
+      try:
+         while True:
+            tick = time.time()
+            rows = cursor.fetchmany(self.bulklimit)
+            self._addTiming('sql_select', time.time() - tick)
+
+            if len(rows) == 0:
+               break
+
+            self.measure['indexed'] += len(rows)
+
+            for row in rows:
+               yield row
+      finally:
+         cursor.close()
+
+   ###########################################################
+
+   def _addMeasure(self, key, value):
+      with self.lock:
+         self.measure[key] = self.measure.get(key, 0) + value
+
+   ###########################################################
+
+   def _addTiming(self, key, elapsed_time):
+      with self.lock:  # bulk requests of the pipeline are timed from several threads
+         timings = self.measure['timings']
+         timings[key] = timings.get(key, 0) + elapsed_time
+
+      self.metrics.observe(key, elapsed_time)
+
+   ###########################################################
+
+   def _compileMapping(self):
+      if self.mapping_template is not None:  # compiled once per run or session
+         return self.mapping_template
+
+      last_mod_field_upd_key = self.conf.sql_upd_key
+
+      # index None is the indexname of the instance, it changes during a bulk load into a fresh index
+      targets = self.conf.targets
+      if len(targets) == 0:
+         targets = [{'index': None, 'mapping': self.conf.mapping}]
+
+      self.targets = []
+      for target in targets:
+         mapping = dict(target['mapping'])  # copy, the config is cached and shared by all instances
+
+         if not '_id' in mapping:
+            raise UserWarning('internal ES _id mapping is missing')
+
+         es_id_var_name = mapping['_id']
+         del mapping['_id']
+
+         if not '_type' in mapping:
+            raise UserWarning('internal ES _type mapping is missing')
+
+         es_type = mapping['_type']
+         del mapping['_type']
+
+         if '_comment' in mapping:
+            del mapping['_comment']
+
+         self.targets.append({'index': target['index'], 'template': es_mapping_template(mapping, self.serializer),
+                              'es_id': es_id_var_name, 'es_type': es_type})
+
+      self.es_id_var_name = self.targets[0]['es_id']
+      self.es_type = self.targets[0]['es_type']
+
+      if last_mod_field_upd_key.find('=') == -1:
+         raise UserWarning('last-modified-timestamp-upd-key, missing variable allocation like: id=$id_doc')
+
+      last_mod_field_upd_key = last_mod_field_upd_key.split('=')
+      self.upd_key_name = last_mod_field_upd_key[0]
+      self.upd_key_var = last_mod_field_upd_key[1]
+
+      self.mapping_template = self.targets[0]['template']
+
+      return self.mapping_template
+
+   ###########################################################
+
+   def _fieldValue(self, value, policy=None, is_json=False):
+      """
+      converts a database value to its UTF-8 encoded JSON text, policy of the column from es_sanitizer.policy,
+      is_json for columns declared as JSON via sql.json-fields or sql.json-prefix
+      """
+
+      ftype = type(value)
+
+      # dynamic field mapping for ES, https://www.elastic.co/guide/en/elasticsearch/reference/6.5/dynamic-field-mapping.html
+      if ftype == int:
+         return str(value).encode('utf-8')
+      elif ftype == float:
+         return self._convFloat(value)
+      elif ftype == datetime.datetime:
+         return ('"' + str(value).replace('-', '/') + '"').encode('utf-8')
+      elif ftype == bool:
+         return str(value).lower().encode('utf-8')
+      elif value is None:
+         return b'null'
+      elif ftype == decimal.Decimal:
+         return self._convNumber(value)
+      elif ftype == datetime.date:
+         return self._convDate(value)
+
+      return self._convString(value, policy, is_json)
+
+   ###########################################################
+
+   def _convString(self, value, policy=None, is_json=False):
+      if value is None:
+         return b'null'
+
+      if policy is None:
+         policy = self.sanitizer.default
+
+      if type(value) in (bytes, bytearray):
+         val = value.decode('utf-8', 'replace')
+      else:
+         val = str(value)
+
+      if is_json:
+         if not self.json_validate:
+            return self.sanitizer.json(val, policy).encode('utf-8')
+
+         json_val = self.sanitizer.json(val, policy).encode('utf-8')
+         try:
+            self.serializer.loads(json_val)
+            return json_val
+         except ValueError:  # invalid JSON is indexed as string
+            return self.sanitizer.string(val, policy).encode('utf-8')
+
+      if self.json_detect:  # legacy, every string is parsed
+         try:
+            self.serializer.loads(val)
+            # 'Infinity' and 'NaN' string is a special case for JSON, check also for digit because json.loads == True for numbers
+            clean = self.sanitizer.clean(val)
+            if clean != 'Infinity' and clean != 'NaN' and not clean.replace('.','',1).isdigit():
+               return self.sanitizer.json(val, policy).encode('utf-8')
+         except ValueError:
+            pass
+
+      return self.sanitizer.string(val, policy).encode('utf-8')
+
+   ###########################################################
+
+   def _convNumber(self, value):
+      if value is None:
+         return b'null'
+      if value.is_finite():  # DECIMAL as JSON number, ES maps it to float
+         return str(value).encode('utf-8')
+      return b'null'
+
+   ###########################################################
+
+   def _convInt(self, value):
+      if value is None:
+         return b'null'
+      return str(value).encode('utf-8')
+
+   ###########################################################
+
+   def _convFloat(self, value):
+      if value is None or value != value or value in (float('inf'), float('-inf')):  # NaN and Infinity are not valid JSON
+         return b'null'
+      return str(value).encode('utf-8')
+
+   ###########################################################
+
+   def _convBool(self, value):
+      if value is None:
+         return b'null'
+      return b'true' if value else b'false'
+
+   ###########################################################
+
+   def _convBit(self, value):
+      if value is None:
+         return b'null'
+      return str(int.from_bytes(value, 'big')).encode('utf-8')
+
+   ###########################################################
+
+   def _convDatetime(self, value, policy=None):
+      if type(value) == datetime.datetime:
+         return ('"' + str(value).replace('-', '/') + '"').encode('utf-8')
+      return self._convString(value, policy)  # zero dates are returned as string
+
+   ###########################################################
+
+   def _convDate(self, value, policy=None):
+      if type(value) == datetime.date:
+         return ('"' + value.isoformat() + '"').encode('utf-8')  # strict_date_optional_time, detected as ES date
+      return self._convString(value, policy)
+
+   ###########################################################
+
+   def _convTime(self, value):
+      if value is None:
+         return b'null'
+      return ('"' + str(value) + '"').encode('utf-8')
+
+   ###########################################################
+
+   def _converters(self, description, fields, positions):
+      """
+      derives one converter per mapped column from the column types of cursor.description, once per result set,
+      columns of unknown type fall back to _fieldValue
+      """
+
+      from pymysql.constants import FIELD_TYPE
+
+      converters = []
+
+      for field in fields:
+         column = description[positions[field]]
+         type_code = column[1]
+         policy = self.sanitizer.policy(field)
+         is_json = self._isJsonField(field)
+
+         if type_code == FIELD_TYPE.TINY and column[3] == 1 and self.tinyint_bool:  # TINYINT(1)
+            converter = self._convBool
+         elif type_code in (FIELD_TYPE.TINY, FIELD_TYPE.SHORT, FIELD_TYPE.LONG, FIELD_TYPE.LONGLONG,
+                            FIELD_TYPE.INT24, FIELD_TYPE.YEAR):
+            converter = self._convInt
+         elif type_code in (FIELD_TYPE.DECIMAL, FIELD_TYPE.NEWDECIMAL):
+            converter = self._convNumber
+         elif type_code in (FIELD_TYPE.FLOAT, FIELD_TYPE.DOUBLE):
+            converter = self._convFloat
+         elif type_code in (FIELD_TYPE.DATETIME, FIELD_TYPE.TIMESTAMP):
+            converter = functools.partial(self._convDatetime, policy=policy)
+         elif type_code in (FIELD_TYPE.DATE, FIELD_TYPE.NEWDATE):
+            converter = functools.partial(self._convDate, policy=policy)
+         elif type_code == FIELD_TYPE.TIME:
+            converter = self._convTime
+         elif type_code == FIELD_TYPE.BIT:
+            converter = self._convBit
+         elif type_code == FIELD_TYPE.JSON:
+            converter = functools.partial(self._convString, policy=policy, is_json=True)
+         elif type_code in (FIELD_TYPE.VARCHAR, FIELD_TYPE.VAR_STRING, FIELD_TYPE.STRING, FIELD_TYPE.ENUM,
+                            FIELD_TYPE.SET, FIELD_TYPE.TINY_BLOB, FIELD_TYPE.MEDIUM_BLOB, FIELD_TYPE.LONG_BLOB,
+                            FIELD_TYPE.BLOB):
+            converter = functools.partial(self._convString, policy=policy, is_json=is_json)
+         else:
+            converter = functools.partial(self._fieldValue, policy=policy, is_json=is_json)
+
+         converters.append(converter)
+
+      return converters
+
+   ###########################################################
+
+   def _isJsonField(self, field):
+      if field in self.json_fields:
+         return True
+
+      return len(self.json_prefix) > 0 and field.startswith(self.json_prefix)
+
+   ###########################################################
+
+   def _documents(self, rows):
+      """
+      yields per row the documents of all targets as (index, _id, action, document) in bytes, the update key and the
+      keyset key, the row is converted once and rendered once per target
+      """
+
+      self._compileMapping()
+
+      fields = None
+      targets = []
+      upd_key_pos = None
+      checkpoint_pos = None
+      keyset_pos = None
+
+      profiler = self.metrics.profiler('mapping')
+
+      for row in rows:
+         tick = time.time()
+
+         if profiler is not None:
+            profiler.enable()
+
+         if fields is None:
+            # later duplicates win, like the dict rows of pymysql.cursors.DictCursor
+            positions = {column[0]: pos for pos, column in enumerate(self.description)}
+
+            # only columns used by a mapping are converted
+            used = collections.OrderedDict.fromkeys([field for target in self.targets
+                                                     for field in target['template'].fields])
+            fields = [field for field in used if field in positions]
+            columns = [(field, positions[field], converter) for field, converter in
+                       zip(fields, self._converters(self.description, fields, positions))]
+
+            dumps = self.serializer.dumps
+
+            targets = []
+            for target in self.targets:
+               es_id_pos = None
+               if target['es_id'].find('$') != -1:
+                  es_id_field = target['es_id'][1:]
+                  if es_id_field not in positions:
+                     raise UserWarning('no database field for internal ES _id mapping found')
+                  es_id_pos = positions[es_id_field]
+
+               index = target['index'] if target['index'] is not None else self.indexname
+               action_pre = b'{"index":{"_index":' + dumps(index) + b', "_type":' + dumps(target['es_type']) + b', "_id":'
+               targets.append((index, target['template'], target['es_id'], es_id_pos, action_pre))
+
+            upd_key_field = self.upd_key_var[1:]
+            if self.checkpoint_fields[0] in positions:  # the update key is the high-water mark (ts, key) of the row
+               checkpoint_pos = (positions[self.checkpoint_fields[0]], positions[self.checkpoint_fields[1]])
+            elif self.last_modified_timestamp_upd and upd_key_field not in positions:
+               raise UserWarning('no database field for last-modified-timestamp-upd-key found')
+            upd_key_pos = positions.get(upd_key_field)
+            keyset_pos = positions.get(self.keyset_field)
+
+         values = {}
+         for field, pos, converter in columns:
+            values[field] = converter(row[pos])
+
+         docs = []
+         for index, template, es_id, es_id_pos, action_pre in targets:
+            if es_id_pos is not None:
+               es_id = str(row[es_id_pos])
+
+            docs.append((index, es_id, action_pre + dumps(es_id) + b'}}\n', template.render(values)))
+
+         upd_key = None
+         if checkpoint_pos is not None:
+            upd_key = (row[checkpoint_pos[0]], row[checkpoint_pos[1]])
+         elif upd_key_pos is not None:
+            upd_key = row[upd_key_pos]
+
+         last_key = None
+         if keyset_pos is not None:
+            last_key = row[keyset_pos]
+
+         if profiler is not None:
+            profiler.disable()
+
+         self._addTiming('mapping', time.time() - tick)
+
+         yield docs, upd_key, last_key
+
+   ###########################################################
+
+   def _bulks(self, documents):
+      """
+      yields the bulk request body, its update keys, documents and their meta, a new bulk is started if
+      es.bulk_max_docs documents or es.bulk_max_bytes encoded bytes are reached, the documents of a row (one per
+      target) are in the same bulk, all documents are sent except the unchanged ones of the hash cache
+      """
+
+      builder = es_bulk_builder(self.bulk_max_bytes, self.bulk_max_docs)
+      if self.controller is not None:
+         builder.max_docs = self.controller.docs
+
+      # full indexing sends all documents, their hashes are stored for the incremental runs
+      cache = self.hash_cache
+      skip = cache is not None and self.offset is None
+
+      for docs, upd_key, last_key in documents:
+         row = []
+         size = 0
+         for index, es_id, action, document in docs:
+            doc = action + document + b'\n'
+
+            meta = (index, es_id, None)
+            if cache is not None:
+               meta = (index, es_id, cache.digest(doc))
+               if skip and cache.get(index, es_id) == meta[2]:
+                  doc = None
+
+            row.append((doc, meta))
+            if doc is not None:
+               size += len(doc)
+
+         sent = len([doc for doc, meta in row if doc is not None])
+
+         if sent > 0 and not builder.fits(size, sent):
+            self.measure['bytes'] += builder.size
+            yield builder.flush()
+
+            if self.controller is not None:  # next bulk with the adapted size
+               builder.max_docs = self.controller.docs
+
+         for doc, meta in row:
+            if doc is None:
+               builder.skip(upd_key, meta)
+               self.measure['skipped'] += 1
+            else:
+               builder.add(doc, upd_key, meta)
+
+         if last_key is not None:  # next offset in keyset mode
+            self.measure['last_key'] = last_key
+
+      if builder.docs > 0 or builder.skipped > 0:
+         self.measure['bytes'] += builder.size
+         yield builder.flush()
+
+   ###########################################################
+
+   def _es_bulk(self, json_byte, upd_keys, chunks, meta=None):
+      """
+      sends the bulk, retries rejected documents (HTTP 429, es_rejected_execution_exception) with exponential
+      backoff and jitter and resets the last-modified field of acknowledged documents only, failed documents
+      stay pending for the next run, invalid documents (4xx except 429, e.g. mapper_parsing_exception) would fail
+      again and are reset unless es.item_hold_invalid is set, documents skipped by the hash cache (chunk None) count as acknowledged,
+      with es.fanout per-target one request per target index is sent, a row is reset after all its documents
+      (one per target) are acknowledged
+      """
+
+      if self.debug:
+         print("\r\nDebug " + inspect.currentframe().f_code.co_name + ";\r\n", "Payload: " + str(json_byte, 'utf-8'),
+               "\r\n\r\n", "#" * 50, "\r\n")
+
+      item_retry = self.conf.es_item_retry
+      item_retry_wait_sec = self.conf.es_item_retry_wait_sec
+      item_retry_max_wait_sec = self.conf.es_item_retry_max_wait_sec
+      hold_invalid = self.conf.es_item_hold_invalid
+
+      if self.controller is not None and self.controller.delay > 0 and len(json_byte) > 0:
+         self._addTiming('es_bulk_delay', self.controller.delay)
+         time.sleep(self.controller.delay)
+
+      tick = time.time()
+
+      # positions of the documents in the bulk, same order as the items
+      pending = [pos for pos in range(0, len(chunks)) if chunks[pos] is not None]
+      sent = len(pending)
+      body = json_byte
+      acknowledged = [pos for pos in range(0, len(chunks)) if chunks[pos] is None]
+      failed = set()
+      invalid = []
+      last_detected_errors = ''
+
+      attempts = item_retry + 1
+      if sent == 0:  # all documents are unchanged
+         attempts = 0
+
+      with self.metrics.profile('es_bulk'):
+         for attempt in range(0, attempts):
+            rejected = []
+            throttled = 0
+            for group in self._bulkGroups(pending, meta):
+               if len(group) != len(pending):  # per-target request
+                  body = b''.join([chunks[pos] for pos in group])
+
+               res = self._es_bulkRequest(body)
+
+               if res.status_code == 429:  # the whole bulk is rejected
+                  rejected += group
+                  throttled += len(group)
+                  continue
+
+               if res.status_code != 200:
+                  raise UserWarning('HTTP Error ' + str(res.status_code) + self._bulkErrorMsg(body, res))
+
+               resJSON = self.serializer.loads(res.content)
+
+               try:
+                  if len(resJSON['items']) != len(group):  # items can not be matched to the documents
+                     failed.update(group)
+                     items_count = len(resJSON['items'])
+                     last_detected_errors += str(len(group)) + ' Doc(s) failed, ' + str(items_count) + ' items in the response' + "\r\n\r\n"
+                  elif resJSON['errors'] == False:
+                     acknowledged += group
+                  else:
+                     for pos, items in zip(group, resJSON['items']):
+                        item = list(items.values())[0]
+
+                        if item['status'] == 429:
+                           throttled += 1
+
+                        if item['status'] >= 200 and item['status'] < 300:
+                           acknowledged.append(pos)
+                        elif item['status'] == 429 and attempt < item_retry:
+                           rejected.append(pos)
+                        else:
+                           if item['status'] == 429 or item['status'] >= 500 or hold_invalid:
+                              failed.add(pos)
+                           else:  # not retryable, the document is logged and reset
+                              invalid.append(pos)
+                           last_detected_errors += 'Doc Id - ' + str(item.get('_id')) + "\r\n" + json.dumps(
+                              item.get('error')) + "\r\n\r\n"
+
+               except KeyError as err:
+                  raise UserWarning('JSON response format error, missing key: ' + str(err) + "\r\n\r\n" +
+                                    self._bulkErrorMsg(body, res))
+
+            latency = time.time() - tick
+
+            if attempt == 0 and self.controller is not None:
+               self.controller.observe(sent, len(json_byte), latency, throttled)
+
+            if len(rejected) == 0:
+               break
+
+            if attempt == item_retry:
+               failed.update(rejected)
+               last_detected_errors += str(len(rejected)) + ' Doc(s) rejected, retried ' + str(item_retry) + ' times' + "\r\n\r\n"
+               break
+
+            # only the rejected documents are sent again, full jitter backoff
+            wait = random.uniform(0, min(item_retry_max_wait_sec, item_retry_wait_sec * (2 ** attempt)))
+
+            if self.debug:
+               print("\r\nDebug " + inspect.currentframe().f_code.co_name + ";\r\n", str(len(rejected)),
+                     "Doc(s) rejected, retry in ", str(round(wait, 3)), "sec. ...", "\r\n\r\n", "#" * 50, "\r\n")
+
+            self._addMeasure('retried', len(rejected))
+            time.sleep(wait)
+
+            pending = sorted(rejected)
+            body = b''.join([chunks[pos] for pos in pending])
+
+      self.metrics.count('docs_sent', sent)
+      self.metrics.count('docs_acknowledged', len(acknowledged) - (len(chunks) - sent))
+      self.metrics.count('docs_skipped', len(chunks) - sent)
+
+      if meta is not None and self.hash_cache is not None:
+         self.hash_cache.put([meta[pos] for pos in acknowledged if meta[pos] is not None and meta[pos][2] is not None])
+
+      if len(invalid) > 0:
+         self._addMeasure('invalid', len(invalid))
+         self.metrics.count('docs_invalid', len(invalid))
+
+      if len(failed) > 0:
+         self._addMeasure('failed', len(failed))
+
+      if len(failed) + len(invalid) > 0:
+         # do not raise an error, print only the last_detected_errors instead
+         print('Bulk Error add/update index, ' + str(len(failed) + len(invalid)) + ' Doc(s) not indexed, ' +
+               str(len(failed)) + ' stay pending, ' + str(len(invalid)) + ' invalid are reset' +
+               "\r\n\r\n" + "Last detected errors:\r\n" + last_detected_errors + "\r\n\r\n")
+
+      elapsed_time = time.time() - tick
+      self._addTiming('es_bulk', elapsed_time)
+
+      if self.checkpoint is not None:  # no reset, also not for a full indexing
+         if self.offset is None:
+            self._checkpointBulk(upd_keys, failed)
+      elif self.last_modified_timestamp_upd and not self.conf.binlog_enabled:  # resets would land in the binlog
+         # a key with several documents (rows, targets) is reset only if none of them failed
+         failed_keys = set([upd_keys[pos] for pos in failed])
+         acknowledged_keys = [upd_keys[pos] for pos in acknowledged + invalid if upd_keys[pos] not in failed_keys]
+
+         with self.upd_lock:  # one DB connection for the resets of all bulk requests in flight
+            with self.metrics.profile('sql_update'):
+               self._sqlUpd(acknowledged_keys)
+
+   ###########################################################
+
+   @staticmethod
+   def _bulkErrorMsg(body, res):
+      # request and response of a failed bulk, built only on errors
+      msg = ''
+      msg += "\r\n\r\nRequest:\r\n"
+      msg += str(body, 'utf-8')
+      msg += "\r\n\r\nResponse:\r\n"
+      msg += res.text
+
+      return msg
+
+   ###########################################################
+
+   def _bulkGroups(self, pending, meta):
+      # positions of the documents per bulk request, one request or one per target index (es.fanout per-target)
+      if self.conf.es_fanout != 'per-target' or meta is None or len(self.targets) < 2:
+         return [pending]
+
+      groups = collections.OrderedDict()
+      for pos in pending:
+         groups.setdefault(meta[pos][0], []).append(pos)
+
+      return list(groups.values())
+
+   ###########################################################
+
+   def _es_bulkRequest(self, json_byte):
+      import requests
+
+      endpoint = self.conf.es_endpoint
+      timeout = self.conf.es_timeout
+      retry = self.conf.es_retry
+      retry_wait_sec = self.conf.es_retry_wait_sec
+      compression = self.conf.es_compression
+      compression_level = self.conf.es_compression_level
+
+      http = self._httpSession()
+
+      body = json_byte
+      headers = None
+      if compression:  # the NDJSON of a bulk is very repetitive, sample: 5 MB to a few hundred KB
+         tick = time.time()
+         import gzip
+         with self.metrics.profile('compress'):
+            body = gzip.compress(json_byte, compresslevel=compression_level)
+         headers = {"Content-Encoding": "gzip"}
+         self._addTiming('compress', time.time() - tick)
+
+      self._addMeasure('bytes_sent', len(body))
+
+      res = None
+      x = 0
+      for x in range(0, retry):
+         try:
+            self._ensureIndices(http, endpoint, timeout)
+
+            res = http.put(url=endpoint + '/_bulk', data=body, headers=headers, timeout=timeout)
+
+            index_keys = [endpoint + '/' + index for index, replicas, shards in self._indices()]
+            if any(index_key in ES_INDEXER_INDEX_EXISTS for index_key in index_keys) and (
+                    res.status_code == 404 or res.content.find(b'index_not_found_exception') != -1):
+               # an index was deleted after its existence was cached, create it and send the bulk again
+               ES_INDEXER_INDEX_EXISTS.difference_update(index_keys)
+               self._ensureIndices(http, endpoint, timeout)
+               res = http.put(url=endpoint + '/_bulk', data=body, headers=headers, timeout=timeout)
+
+            break
+         except requests.exceptions.ConnectionError as err:
+            raise UserWarning('Connect Error: ' + str(err))
+         except requests.exceptions.ReadTimeout as err:
+            if x < retry-1:
+               if self.debug:
+                  print("\r\nDebug " + inspect.currentframe().f_code.co_name + ";\r\n", "Read Timeout, retry in ", str(retry_wait_sec), "sec. ...", "\r\n\r\n",
+                        "#" * 50, "\r\n")
+               time.sleep(retry_wait_sec)
+               continue
+            else:
+               raise UserWarning('HTTP Read Error:, current timeout ' + str(
+                  timeout) + ', you can increase it via key timeout in the *.json file - ' + str(err))
+         except UserWarning as err:
+            raise err
+         except Exception as err:
+            print('Unexpected error: ' + str(err))
+            raise
+
+      return res
+
+   ###########################################################
+
+   def _indices(self):
+      # (index, replicas, shards) of the instance or of all targets
+      if len(self.conf.targets) == 0:
+         return [(self.indexname, self.conf.settings_replicas, self.conf.settings_shards)]
+
+      return [(target['index'], target['replicas'], target['shards']) for target in self.conf.targets]
+
+   ###########################################################
+
+   def _ensureIndices(self, http, endpoint, timeout):
+      for index, replicas, shards in self._indices():
+         self._ensureIndex(http, endpoint, timeout, replicas, shards, index)
+
+   ###########################################################
+
+   def _ensureIndex(self, http, endpoint, timeout, replicas, shards, index=None):
+      # create index with settings if not exists, the check is done once per process
+      if replicas is None or shards is None:
+         return
+
+      if index is None:
+         index = self.indexname
+
+      index_key = endpoint + '/' + index
+      if index_key in ES_INDEXER_INDEX_EXISTS:
+         return
+
+      res = http.head(url=endpoint + '/' + index, timeout=timeout)
+
+      if res.status_code == 404:
+         index_settings = {"number_of_shards": shards, "number_of_replicas": replicas}
+
+         setting_json_byte = self.serializer.dumps({"settings": {"index": index_settings}})
+
+         res = http.put(url=endpoint + '/' + index, data=setting_json_byte, timeout=timeout)
+
+         if res.status_code != 200:
+            raise UserWarning('Error create index: ' + str(res.content))
+
+      ES_INDEXER_INDEX_EXISTS.add(index_key)
+
+   ###########################################################
+
+   def _sqlUpd(self, upd_keys):
+      import pymysql
+
+      db = self._rdsUpdConnect()
+
+      retry = self.conf.rds_retry
+      retry_wait_sec = self.conf.rds_retry_wait_sec
+      strategy = self.conf.rds_reset_strategy
+      chunk_size = self.conf.rds_reset_chunk_size
+
+      last_mod_field = self.conf.sql_last_mod_field.split('.')  # <schema>.<table>.<field>, see es_config
+
+      table = last_mod_field[0] + '.' + last_mod_field[1]
+
+      keys = [key for key in upd_keys if key is not None]
+      try:
+         keys = sorted(set(keys))  # in key order to lock the rows always in the same order
+      except TypeError:
+         keys = list(collections.OrderedDict.fromkeys(keys))
+
+      if len(keys) == 0:
+         return
+
+      sql = self._sqlUpdStatements(db, strategy, chunk_size, table, last_mod_field[2], keys)
+
+      if self.debug:
+         print("\r\nDebug " + inspect.currentframe().f_code.co_name + ";\r\n", [item[0] for item in sql], "\r\n\r\n",
+               "Key(s) to Update; " + str(len(keys)), "Strategy; " + strategy, "\r\n", "#" * 50, "\r\n")
+
+      tick = time.time()
+
+      try:
+         lock_messages_error = ['Deadlock found', 'Lock wait timeout exceeded']
+         MAXIMUM_RETRY_ON_DEADLOCK = retry
+         rcount = 0
+         while rcount <= MAXIMUM_RETRY_ON_DEADLOCK:
+            try:
+               cursor = db.cursor()
+               db.begin()
+
+               for (query, args, many) in sql:
+                  if many:
+                     cursor.executemany(query, args)
+                  else:
+                     cursor.execute(query, args)
+
+               db.commit()
+
+               if strategy == 'temp-table':  # created on this connection, see _sqlUpdStatements
+                  db.es_indexer_reset_tables.add(self._resetTable(keys)[0])
+
+            except pymysql.err.OperationalError as err:
+               (code, message) = err.args
+               if any(msg in message for msg in lock_messages_error):
+                  db.rollback()
+                  if  rcount < MAXIMUM_RETRY_ON_DEADLOCK:
+                     rcount += 1
+                     time.sleep(retry_wait_sec)
+                     sql = self._sqlUpdStatements(db, strategy, chunk_size, table, last_mod_field[2], keys)
+                     continue
+                  else:
+                     raise UserWarning('DB Lock Error, retried ' + str(rcount) + ' times with ' + str(retry_wait_sec) + ' sec. per retry', err, sql)
+               else:
+                  raise err
+
+            break
+
+      except pymysql.Warning as err:
+         raise UserWarning('SQL warning', err, sql)
+      except pymysql.err.ProgrammingError as err:
+         raise UserWarning('SQL error', err, sql)
+
+
+      elapsed_time = time.time() - tick
+      self._addTiming('sql_update', elapsed_time)
+
+
+   ###########################################################
+
+   def _sqlUpdStatements(self, db, strategy, chunk_size, table, field, keys):
+      """
+      returns the parameterized statements (query, args, executemany) to reset the last-modified field,
+      strategies via rds.reset_strategy:
+         single: one UPDATE per key in one transaction, short row locks (default)
+         in: one UPDATE ... WHERE key IN (...) per rds.reset_chunk_size keys
+         temp-table: keys are inserted as multi-row INSERT into a temporary table, one UPDATE via JOIN
+      """
+
+      base_sql = 'UPDATE ' + table + ' SET ' + field + ' = "1970-01-01 00:00:00" WHERE ' + self.upd_key_name
+
+      if strategy == 'single':
+         return [(base_sql + ' = %s', (key,), False) for key in keys]
+
+      if strategy == 'in':
+         sql = []
+         for i in range(0, len(keys), chunk_size):
+            chunk = keys[i:i + chunk_size]
+            sql.append((base_sql + ' IN (' + ', '.join(['%s'] * len(chunk)) + ')', chunk, False))
+         return sql
+
+      if strategy == 'temp-table':
+         (reset_table, key_type) = self._resetTable(keys)
+
+         key_name = self.upd_key_name
+         if key_name.find('.') == -1:
+            key_name = table + '.' + key_name
+
+         # temporary tables exist per connection, which may come from the pool of an earlier invocation
+         reset_tables = getattr(db, 'es_indexer_reset_tables', None)
+         if reset_tables is None:
+            reset_tables = set()
+            db.es_indexer_reset_tables = reset_tables
+
+         # the table is added to reset_tables after the reset is committed, see _sqlUpd
+         sql = []
+         if reset_table not in reset_tables:
+            sql.append(('CREATE TEMPORARY TABLE IF NOT EXISTS ' + reset_table + ' (k ' + key_type +
+                        ' NOT NULL PRIMARY KEY)', None, False))
+
+         sql.append(('DELETE FROM ' + reset_table, None, False))
+         for i in range(0, len(keys), chunk_size):
+            sql.append(('INSERT IGNORE INTO ' + reset_table + ' (k) VALUES (%s)', [(key,) for key in keys[i:i + chunk_size]],
+                        True))
+         sql.append(('UPDATE ' + table + ' JOIN ' + reset_table + ' ON ' + key_name + ' = ' + reset_table + '.k SET ' +
+                     table + '.' + field + ' = "1970-01-01 00:00:00"', None, False))
+         return sql
+
+      raise UserWarning('rds.reset_strategy unknown: ' + str(strategy) + ', use single, in or temp-table')
+
+   ###########################################################
+
+   @staticmethod
+   def _resetTable(keys):
+      # temporary table of the temp-table reset and its key type
+      key_type = 'VARCHAR(255)'
+      if all(isinstance(key, int) for key in keys):
+         key_type = 'BIGINT'
+
+      return 'es_indexer_reset_' + key_type[0:3].lower(), key_type
+
+   ###########################################################
+
+   def _do(self):
+      self.measure['bulks'] = 0
+      self.measure['bytes'] = 0
+      self.measure['bytes_sent'] = 0
+      self.measure['retried'] = 0
+      self.measure['failed'] = 0
+      self.measure['invalid'] = 0
+      self.measure['skipped'] = 0
+
+      if self.hash_cache is not None:
+         self.hash_cache.begin()
+
+      if self.binlog is not None and self.offset is None:
+         self._doBinlog()
+      elif self.checkpoint is not None and self.offset is None:
+         self._doCheckpoint()
+      elif self.pipeline > 0:
+         self._doPipeline()
+      else:
+         self._doSerial()
+
+      if self.controller is not None:
+         self.measure['adaptive'] = {'docs': self.controller.docs, 'delay': self.controller.delay}
+
+      if self.measure['bulks'] == 0 and self.debug:
+         print('Info: no data found for update index - indexed:', self.measure['indexed'])
+
+   ###########################################################
+
+   def _doSerial(self):
+      rows = self._execSelect()
+
+      for json_byte, upd_keys, chunks, meta in self._bulks(self._documents(rows)):
+         self.upd_keys = upd_keys
+         self._es_bulk(json_byte, upd_keys, chunks, meta)
+         if len(json_byte) > 0:
+            self.measure['bulks'] += 1
+
+   ###########################################################
+
+   def _doBinlog(self):
+      """
+      change capture instead of the last-modified field, the rows of the keys changed since the saved binlog
+      position are selected through the joins of sql.data and mapped, the position is saved only if all documents
+      are acknowledged, failed documents are selected again by the next run, there is no last-modified reset
+      """
+
+      tick = time.time()
+      with self.metrics.profile('binlog'):
+         changes = self.binlog.read(None if self.stream else self.bulklimit)
+      self._addTiming('binlog', time.time() - tick)
+
+      keys = sum([len(table_keys) for table_keys in changes['keys'].values()])
+      self.measure['binlog'] = {'events': changes['events'], 'keys': keys, 'position': changes['position'],
+                                'more': changes['more']}
+      self.metrics.count('binlog_events', changes['events'])
+
+      if keys == 0:
+         self.measure['indexed'] = 0
+      else:
+         self.binlog_keys = changes['keys']
+         try:
+            if self.pipeline > 0:
+               self._doPipeline()
+            else:
+               self._doSerial()
+         finally:
+            self.binlog_keys = None
+
+      if self.measure['failed'] == 0 and changes['position'] is not None:
+         self.binlog.store.save(changes['position'])
+
+   ###########################################################
+
+   def _doCheckpoint(self):
+      """
+      incremental indexing via high-water mark instead of the last-modified reset, the rows after the checkpoint
+      (last-modified field, checkpoint.key) are selected in this order, the checkpoint is advanced to the highest
+      (ts, key) below the first failed document once all bulks are answered, nothing is written to the source tables
+      """
+
+      if self.checkpoint_value is None:
+         self.checkpoint_value = self.checkpoint.load()
+
+      self.checkpoint_bulks = []
+
+      if self.pipeline > 0:
+         self._doPipeline()
+      else:
+         self._doSerial()
+
+      # with pipeline the bulks are answered in any order, the rows of a key can be split over two bulks
+      failed = [first_failed for (keys, first_failed) in self.checkpoint_bulks if first_failed is not None]
+      first_failed = min(failed) if len(failed) > 0 else None
+
+      value = None
+      for (keys, bulk_failed) in self.checkpoint_bulks:
+         for key in keys:
+            if (first_failed is None or key < first_failed) and (value is None or key > value):
+               value = key
+
+      if value is not None:
+         self.checkpoint_value = {'ts': value[0], 'key': value[1]}
+         self.checkpoint.save(self.checkpoint_value)
+
+      self.measure['checkpoint'] = self.checkpoint_value
+
+   ###########################################################
+
+   def _checkpointBulk(self, upd_keys, failed):
+      # (ts, key) of the bulk before its first failed document, rows are in checkpoint order
+      first_failed = None
+      end = len(upd_keys)
+      if len(failed) > 0:
+         end = min(failed)
+         first_failed = upd_keys[end]
+
+      keys = [upd_keys[pos] for pos in range(0, end) if pos == 0 or upd_keys[pos] != upd_keys[pos - 1]]
+
+      with self.upd_lock:
+         self.checkpoint_bulks.append((keys, first_failed))
+
+   ###########################################################
+
+   def _doPipeline(self):
+      """
+      records are read and mapped in this thread while up to es.pipeline bulk requests (incl. their
+      last-modified reset) are in flight in worker threads
+      """
+
+      import concurrent.futures
+
+      # one page of bulklimit records per run like the serial mode, es_indexer_session.drain reads the next pages
+      rows = self._execSelect()
+
+      with concurrent.futures.ThreadPoolExecutor(max_workers=self.pipeline) as executor:
+         in_flight = set()
+
+         for json_byte, upd_keys, chunks, meta in self._bulks(self._documents(rows)):
+            if len(in_flight) >= self.pipeline:
+               done, in_flight = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+               for future in done:
+                  future.result()  # raise errors of the bulk request
+
+            self.upd_keys = upd_keys
+            in_flight.add(executor.submit(self._es_bulk, json_byte, upd_keys, chunks, meta))
+            if len(json_byte) > 0:
+               self.measure['bulks'] += 1
+
+         for future in concurrent.futures.as_completed(in_flight):
+            future.result()
+
+   ###########################################################
+
+   def enable_debug():
+      global ES_INDEXER_DEBUG
+      ES_INDEXER_DEBUG = True
 
-      except KeyError as err:
-         raise UserWarning('JSON file ' + self.config_file + ' format error, missing key: ' + str(err))
+   ###########################################################
 
-      return query
+   def disable_debug():
+      global ES_INDEXER_DEBUG
+      ES_INDEXER_DEBUG = False
 
    ###########################################################
 
-   def _execSelect(self):
-      db = self._rdsConnect()
+   def measure():
+      return ES_INDEXER_MEASURE
 
-      if 'query-pre' in self.config['sql']:
-         try:
-            query_pre = self.config['sql']['query-pre']
+###########################################################
+###########################################################
+###########################################################
 
-            if len(query_pre) > 0:
-               cursor = db.cursor()
-               cursor.execute(query_pre)
-               db.commit()
 
-               if self.debug:
-                  print("\r\nDebug " + inspect.currentframe().f_code.co_name + ";\r\n", "Query-Pre: " + query_pre,
-                        "\r\n\r\n", "#" * 50, "\r\n")
 
-         except pymysql.Warning as err:
-            raise UserWarning('SQL warning', err, query_pre)
-         except pymysql.err.ProgrammingError as err:
-            raise UserWarning('SQL error', err, query_pre)
+class es_indexer_session(es_indexer):
+   batches = 0
 
+   bulk_load_state = None
 
-      cursor = db.cursor(pymysql.cursors.DictCursor)
-      cursor._defer_warnings = True
-      query = self._sqlSelect()
+   ###########################################################
 
-      if self.debug:
-         print("\r\nDebug " + inspect.currentframe().f_code.co_name + ";\r\n", "Query: " + query, "\r\n\r\n", "#" * 50,
-               "\r\n")
+   def __init__(self, s3bucket_filetype: str, s3prefix_folder: str, indexname: str, bulklimit: int,
+                configfile: str = '', last_modified_timestamp_upd: bool = True, stream: bool = False):
+      """
+      long-lived indexer, the config is loaded once and the DB connection (incl. query-pre) and the HTTP
+      keep-alive session are reused by all batches
 
-      tick = time.time()
+      Parameters
+      ----------
+      s3bucket_filetype : str
+         s3://my-bucket or file://
+      s3prefix_folder : str
+         S3 prefix or local folder name where the config file is located
+      indexname : str
+         name of index in Elasticsearch
+      bulklimit : int
+         number of records per batch
+      configfile : str, optional
+         name of config file
+      last_modified_timestamp_upd : bool, optional
+         useful if you initial indexing an test env from same source as productive
+      stream : bool, optional
+         read all records of a batch via unbuffered cursor, bulklimit is then the number of records per bulk request
 
-      try:
-         cursor.execute(query)
+      Samples
+      ----------
+      # sample 1, cron drain of all changed records
+      with es_indexer_session('file://', 'config', 'index1', 1000, 'index1.json') as session:
+         print(session.drain())
+      # sample 2, full indexing
+      session = es_indexer_session('s3://my-bucket', 'config', 'test', 1000)
+      session.drain(0)
+      session.close()
+      """
 
-      except pymysql.Warning as err:
-         raise UserWarning('SQL warning', err, query)
-      except pymysql.err.ProgrammingError as err:
-         raise UserWarning('SQL error', err, query)
+      self._init(s3bucket_filetype, s3prefix_folder, indexname, bulklimit, configfile, None,
+                 last_modified_timestamp_upd, stream)
+      self.batches = 0
 
-      rows = cursor.fetchall();
+   ###########################################################
 
-      elapsed_time = time.time() - tick
-      self.measure['timings'].update({'sql_select': elapsed_time})
+   def __enter__(self):
+      return self
 
-      self.measure['indexed'] = len(rows)
+   ###########################################################
 
-      return rows
+   def __exit__(self, exc_type, exc_val, exc_tb):
+      self.close()
 
    ###########################################################
 
-   @property
-   def _mapping(self):
+   def run_batch(self, offset: int = None):
+      """
+      index one batch of max. bulklimit records, returns the measure of the batch
 
-      json_str = ''
-      mapping = None
-      last_mod_field_upd_key = None
+      Parameters
+      ----------
+      offset : int, optional
+         used for initial indexing, None for changed records only
+      """
 
-      rows = self._execSelect()
+      if self.batches > 0:  # config timing belongs to the first batch only
+         self.measure = {'timings': {}}
 
-      try:
-         mapping = self.config["mapping"]
-         last_mod_field_upd_key = self.config['sql']['last-modified-timestamp-upd-key']
-      except KeyError as err:
-         raise UserWarning('JSON file ' + self.config_file + ' format error, missing key: ' + str(err))
+      self.offset = offset
+      self._run()
+      self.batches += 1
 
-      if not '_id' in mapping:
-         raise UserWarning('internal ES _id mapping is missing')
+      return self.measure
 
-      es_id_var_name = mapping['_id']
-      del mapping['_id']
+   ###########################################################
 
-      if not '_type' in mapping:
-         raise UserWarning('internal ES _type mapping is missing')
+   def drain(self, offset: int = None, max_batches: int = None):
+      """
+      run batches until no more records are found, returns the summed measure of all batches
 
-      es_type = mapping['_type']
-      del mapping['_type']
+      Parameters
+      ----------
+      offset : int, optional
+         start offset for initial indexing, None for changed records only,
+         with sql.full-indexing-keyset the start value of the last indexed key (exclusive)
+      max_batches : int, optional
+         stop after this number of batches
+      """
 
-      if last_mod_field_upd_key.find('=') == -1:
-         raise UserWarning('last-modified-timestamp-upd-key, missing variable allocation like: id=$id_doc')
+      total = {'batches': 0, 'indexed': 0, 'bulks': 0, 'bytes': 0, 'bytes_sent': 0, 'retried': 0, 'failed': 0,
+               'invalid': 0, 'skipped': 0, 'timings': {}, 'handshakes': {}}
+
+      if offset is not None and self.keyset:
+         total['last_key'] = offset
+
+      while True:
+         measure = self.run_batch(offset)
+
+         total['batches'] += 1
+         total['indexed'] += measure.get('indexed', 0)
+         total['bulks'] += measure.get('bulks', 0)
+         total['bytes'] += measure.get('bytes', 0)
+         total['bytes_sent'] += measure.get('bytes_sent', 0)
+         total['retried'] += measure.get('retried', 0)
+         total['failed'] += measure.get('failed', 0)
+         total['invalid'] += measure.get('invalid', 0)
+         total['skipped'] += measure.get('skipped', 0)
+         if 'last_key' in measure:
+            total['last_key'] = measure['last_key']
+         if 'checkpoint' in measure:
+            total['checkpoint'] = measure['checkpoint']
+         for key in measure['timings']:
+            total['timings'][key] = total['timings'].get(key, 0) + measure['timings'][key]
+         for key in measure.get('handshakes', {}):
+            total['handshakes'][key] = total['handshakes'].get(key, 0) + measure['handshakes'][key]
+
+         if 'binlog' in measure:
+            total['binlog'] = measure['binlog']
+            # change capture, the position is only advanced if all documents are acknowledged
+            if not measure['binlog']['more'] or measure.get('failed', 0) > 0:
+               break
+            if max_batches is not None and total['batches'] >= max_batches:
+               break
+            continue
 
-      last_mod_field_upd_key = last_mod_field_upd_key.split('=')
-      upd_key_name = last_mod_field_upd_key[0]
-      upd_key_var = last_mod_field_upd_key[1]
+         if measure.get('indexed', 0) == 0:  # stop if no more records to index
+            break
 
-      tick = time.time()
+         if self.stream and offset is not None:  # the unbuffered batch has read all records
+            break
 
-      if len(rows) > 0:
-         fieldnames = rows[0].keys()
+         if offset is None and self.checkpoint is not None:
+            # a failed document holds the checkpoint, the next batch would select the same records
+            if measure['indexed'] < self.bulklimit or measure.get('failed', 0) > 0:
+               break
+         elif offset is None:
+            # changed records are only removed from the result by the last-modified reset
+            if not self.last_modified_timestamp_upd or measure['indexed'] < self.bulklimit:
+               break
+            if measure.get('failed', 0) >= measure['indexed']:  # failed records stay pending, avoid an endless loop
+               break
+         elif self.keyset:
+            if measure['indexed'] < self.bulklimit:  # last page, all selected records are indexed
+               break
+            offset = measure['last_key']
+         else:
+            offset += self.bulklimit
 
-         for row in rows:
-            mapping = self.config["mapping"]
-            es_id = es_id_var_name
+         if max_batches is not None and total['batches'] >= max_batches:
+            break
 
-            if '_comment' in mapping:
-               del mapping['_comment']
+      return total
 
-            mapping_str = json.dumps(mapping)
-            upd_key_str = ''
+   ###########################################################
 
-            for field in fieldnames:
-               var = '$' + field
-               ftype = type(row[field])
-               val = str(row[field])
+   @contextlib.contextmanager
+   def bulk_load(self, fresh_index: bool = False):
+      """
+      for full indexing, sets refresh_interval -1 and number_of_replicas 0 and restores the configured
+      (or previous) settings afterwards, with fresh_index the indexname must be an alias, the records are
+      indexed into a new index <indexname>_<timestamp> and the alias is switched to it on success
+      (the old index is kept), not available with targets
 
-               # remove non printable chars, linefeeds etc.
-               val = re.sub(r'[\x00-\x1f\x7f-\x9f]', ' ', val).strip()
+      Samples
+      ----------
+      with es_indexer_session('file://', 'config', 'index1', 1000, 'index1.json') as session:
+         with session.bulk_load(fresh_index=True):
+            session.drain(0)
+      """
 
+      if len(self.conf.targets) > 0:
+         raise UserWarning('Error bulk load, not available with targets, the indices are named in the config')
 
-               # dynamic field mapping for ES, https://www.elastic.co/guide/en/elasticsearch/reference/6.5/dynamic-field-mapping.html
-               if ftype == int or ftype == float:
-                  mapping_str = mapping_str.replace('"' + var + '"', val)
-               elif ftype == datetime.datetime:
-                  val = val.replace('-', '/')
-                  mapping_str = mapping_str.replace('"' + var + '"', '"' + val + '"')
-               elif ftype == bool:
-                  val = val.lower()
-                  mapping_str = mapping_str.replace('"' + var + '"', val)
-               elif row[field] is None:
-                  mapping_str = mapping_str.replace('"' + var + '"', 'null')
-               else:
-                  is_json = True
-                  try:
-                     json.loads(row[field])
-                  except ValueError as e:
-                     is_json = False
+      self._bulkLoadStart(fresh_index)
 
-                  # 'Infinity' and 'NaN' string is a special case for JSON, check also for digit because json.loads == True for numbers
-                  if is_json and val != 'Infinity' and val != 'NaN' and not val.replace('.','',1).isdigit():
+      try:
+         yield self
+      except BaseException:
+         try:
+            self._bulkLoadEnd(False)
+         except Exception as err:  # the original error is raised, e.g. ES is not reachable at all
+            print('Error restore settings after failed bulk load: ' + str(err))
+         raise
 
-                     json_val = row[field]
+      self._bulkLoadEnd(True)
 
-                     # remove all &#x, because "html.unescape" not do it for some correctly
-                     json_val = re.sub(r'&#x', ' ', json_val)
-                     # remove HTML special chars
-                     json_val = html.unescape(json_val)
-                     # remove non ascii
-                     json_val = json_val.encode("ascii", "ignore")
-                     json_val = json_val.decode()
-                     # remove linefeeds
-                     json_val = json_val.replace("\r", " ")
-                     json_val = json_val.replace("\n", " ")
+   ###########################################################
 
+   def _esRequest(self, method, path, payload=None):
+      import requests
 
-                     mapping_str = mapping_str.replace('"' + var + '"', json_val)
+      endpoint = self.conf.es_endpoint
+      timeout = self.conf.es_timeout
 
-                  else: # strings
-                     # remove all &#x, because "html.unescape" not do it for some correctly
-                     val = re.sub(r'&#x', ' ', val)
-                     # remove HTML special chars
-                     val = html.unescape(val)
-                     # remove non ascii
-                     val = val.encode("ascii", "ignore")
-                     val = val.decode()
-                     # remove linefeeds
-                     val = val.replace("\r", " ")
-                     val = val.replace("\n", " ")
+      data = None
+      if payload is not None:
+         data = self.serializer.dumps(payload)
 
-                     # escape characters
-                     val = re.sub(pattern=r'([\"\\])', repl=r'\\\1', string=val)
+      try:
+         return self._httpSession().request(method, url=endpoint + path, data=data, timeout=timeout)
+      except requests.exceptions.RequestException as err:
+         raise UserWarning('Connect Error: ' + str(err))
 
-                     mapping_str = mapping_str.replace('"' + var + '"', '"' + val + '"')
+   ###########################################################
 
-               if es_id == var:
-                  es_id = str(row[field])
+   def _bulkLoadStart(self, fresh_index):
+      replicas = self.conf.settings_replicas
+      shards = self.conf.settings_shards
+      refresh_interval = self.conf.settings_refresh_interval
 
-               if upd_key_var == var:
-                  upd_key_str = upd_key_name + '=' + str(row[field])
+      alias = self.indexname
+      old_indices = []
+      bulk_settings = {"refresh_interval": "-1", "number_of_replicas": 0}
 
-            if es_id.find('$') != -1:
-               raise UserWarning('no database field for internal ES _id mapping found')
+      if fresh_index:
+         res = self._esRequest('GET', '/_alias/' + alias)
+         if res.status_code == 200:
+            old_indices = list(self.serializer.loads(res.content).keys())
+         elif self._esRequest('HEAD', '/' + alias).status_code == 200:
+            raise UserWarning('Error bulk load, index "' + alias + '" exists and is not an alias')
 
-            action = '{"index":{"_index":"' + self.indexname + '", "_type":"' + es_type + '", "_id":"' + es_id + '"}}' + "\n"
+         self.indexname = alias + '_' + time.strftime('%Y%m%d%H%M%S')
 
-            if (sys.getsizeof(json_str) + sys.getsizeof(action) + sys.getsizeof(
-                    mapping_str)) > 1024 * 1024 * 5:  # max. MB size for bulk
-               break
+      res = self._esRequest('GET', '/' + self.indexname + '/_settings')
 
-            json_str += action
-            json_str += mapping_str + "\n"
+      if res.status_code == 404:
+         index_settings = dict(bulk_settings)
+         if shards is not None:
+            index_settings["number_of_shards"] = shards
 
-            self.upd_keys.append(upd_key_str)
+         res = self._esRequest('PUT', '/' + self.indexname, {"settings": {"index": index_settings}})
+      else:
+         for index in self.serializer.loads(res.content).values():  # restore the previous settings if not configured
+            if replicas is None:
+               replicas = index['settings']['index'].get('number_of_replicas')
+            if refresh_interval is None:
+               refresh_interval = index['settings']['index'].get('refresh_interval')
+            break
 
-      elapsed_time = time.time() - tick
-      self.measure['timings'].update({'mapping': elapsed_time})
+         res = self._esRequest('PUT', '/' + self.indexname + '/_settings', {"index": bulk_settings})
 
-      json_byte = json_str.encode('utf-8')
-      # for debug
-      # print(json_byte)
-      # return False
+      if res.status_code != 200:
+         raise UserWarning('Error bulk load settings: ' + str(res.content))
 
-      return json_byte
+      endpoint = self.conf.es_endpoint
+      ES_INDEXER_INDEX_EXISTS.add(endpoint + '/' + self.indexname)
 
-   ###########################################################
+      if replicas is None:
+         replicas = 1
 
-   def _es_bulk(self, json_byte):
+      self.bulk_load_state = {'alias': alias, 'fresh_index': fresh_index, 'old_indices': old_indices,
+                              'settings': {"refresh_interval": refresh_interval, "number_of_replicas": replicas}}
 
       if self.debug:
-         print("\r\nDebug " + inspect.currentframe().f_code.co_name + ";\r\n", "Payload: " + str(json_byte, 'utf-8'),
-               "\r\n\r\n", "#" * 50, "\r\n")
+         print("\r\nDebug " + inspect.currentframe().f_code.co_name + ";\r\n", "Bulk load: " + self.indexname,
+               json.dumps(self.bulk_load_state), "\r\n\r\n", "#" * 50, "\r\n")
 
-      headers = {"Content-Type": "application/json; charset=utf-8"}
+   ###########################################################
 
-      endpoint = ''
-      try:
-         endpoint = self.config['es']['endpoint']
-      except KeyError as err:
-         raise UserWarning('JSON file ' + self.config_file + ' format error, missing key: ' + str(err))
+   def _bulkLoadEnd(self, success):
+      state = self.bulk_load_state
+      self.bulk_load_state = None
 
-      timeout = None
-      try:
-         timeout = int(self.config['es']['timeout'])
-      except KeyError as err:
-         timeout = 3
-         pass
+      if state is None:
+         return
 
-      retry = None
       try:
-         retry = int(self.config['es']['retry'])
-
-         if retry < 1:
-            retry = 1
-
-      except KeyError as err:
-         retry = 1
-         pass
+         # refresh_interval null resets to the ES default
+         res = self._esRequest('PUT', '/' + self.indexname + '/_settings', {"index": state['settings']})
+         if res.status_code != 200:
+            raise UserWarning('Error restore settings after bulk load: ' + str(res.content))
 
-      retry_wait_sec = None
-      try:
-         retry_wait_sec = int(self.config['es']['retry_wait_sec'])
-      except KeyError as err:
-         retry_wait_sec = 1
-         pass
+         if not success:
+            return
 
-      user = None
-      try:
-         user = self.config['es']['user']
-      except KeyError as err:
-         user = None
-         pass
+         self._esRequest('POST', '/' + self.indexname + '/_refresh')
 
-      pw = None
-      try:
-         pw = self.config['es']['password']
-      except KeyError as err:
-         pw = None
-         pass
+         if state['fresh_index']:
+            actions = []
+            for index in state['old_indices']:
+               actions.append({"remove": {"index": index, "alias": state['alias']}})
+            actions.append({"add": {"index": self.indexname, "alias": state['alias']}})
 
-      ###
+            res = self._esRequest('POST', '/_aliases', {"actions": actions})
+            if res.status_code != 200:
+               raise UserWarning('Error switch alias after bulk load: ' + str(res.content))
 
-      replicas = None
-      try:
-         replicas = self.config['settings']['replicas']
-      except KeyError as err:
-         replicas = None
-         pass
+      finally:
+         self.indexname = state['alias']
 
-      shards = None
-      try:
-         shards = self.config['settings']['shards']
-      except KeyError as err:
-         shards = None
-         pass
+###########################################################
+###########################################################
 
 
-      urllib3.disable_warnings(
-         urllib3.exceptions.InsecureRequestWarning)  # to support local ES endpoints via SSH tunnel, sample: https://127.0.0.1:9200
 
-      tick = time.time()
+class es_indexer_parallel:
+   args = ()
 
+   workers = 1
 
-      res = None
-      x = 0
-      for x in range(0, retry):
-         try:
-            ##################
-            # create index with settings if not exists
-            if replicas is not None and shards is not None:
-               if user is not None and pw is not None:
-                  res = requests.head(url=endpoint + '/' + self.indexname, verify=False, headers=headers, timeout=timeout, auth=HTTPBasicAuth(user, pw))
-               else:
-                  res = requests.head(url=endpoint + '/' + self.indexname, verify=False, headers=headers, timeout=timeout)
+   partitions = 1
 
+   quantiles = False
 
-               if res.status_code == 404:
-                  setting_json_str = '{   "settings": {   "index": {   "number_of_shards" : '+str(shards)+', "number_of_replicas" : '+str(replicas)+'   }   }   }'
-                  setting_json_byte = setting_json_str.encode('utf-8')
+   bulk_load = False
 
-                  if user is not None and pw is not None:
-                     res = requests.put(url=endpoint + '/' + self.indexname, verify=False, data=setting_json_byte, headers=headers, timeout=timeout, auth=HTTPBasicAuth(user, pw))
-                  else:
-                     res = requests.put(url=endpoint + '/' + self.indexname, verify=False, data=setting_json_byte, headers=headers, timeout=timeout)
+   fresh_index = False
 
-                  if res.status_code != 200:
-                     raise UserWarning('Error create index: ' + str(res.content))
+   measure = {}
 
+   ###########################################################
 
-            ##################
+   def __init__(self, s3bucket_filetype: str, s3prefix_folder: str, indexname: str, bulklimit: int,
+                configfile: str = '', workers: int = None, partitions: int = None,
+                last_modified_timestamp_upd: bool = True, stream: bool = False, quantiles: bool = False,
+                bulk_load: bool = False, fresh_index: bool = False):
+      """
+      full indexing split into key ranges of additional-primary-key-for-full-indexing (must be numeric),
+      every range is indexed via keyset pagination by an es_indexer_session in its own process with
+      its own DB connection and HTTP session (not available on AWS Lambda, no multiprocessing support)
 
+      Parameters
+      ----------
+      s3bucket_filetype : str
+         s3://my-bucket or file://
+      s3prefix_folder : str
+         S3 prefix or local folder name where the config file is located
+      indexname : str
+         name of index in Elasticsearch
+      bulklimit : int
+         number of records per batch
+      configfile : str, optional
+         name of config file
+      workers : int, optional
+         number of processes, default number of CPUs
+      partitions : int, optional
+         number of key ranges, default 4 per worker to balance uneven ranges
+      last_modified_timestamp_upd : bool, optional
+         useful if you initial indexing an test env from same source as productive
+      stream : bool, optional
+         read every key range via unbuffered cursor
+      quantiles : bool, optional
+         split by sampled key quantiles instead of MIN/MAX, better for uneven key distribution
+      bulk_load : bool, optional
+         index with refresh_interval -1 and 0 replicas, see es_indexer_session.bulk_load
+      fresh_index : bool, optional
+         bulk load into a new index and switch the alias indexname to it at the end
 
-            if user is not None and pw is not None:
-               res = requests.put(url=endpoint + '/_bulk', verify=False, data=json_byte, headers=headers, timeout=timeout, auth=HTTPBasicAuth(user, pw))
-            else:
-               res = requests.put(url=endpoint + '/_bulk', verify=False, data=json_byte, headers=headers, timeout=timeout)
+      Samples
+      ----------
+      measure = es_indexer_parallel('file://', 'config', 'index1', 1000, 'index1.json', workers=8).run()
+      """
 
-            break
-         except requests.exceptions.ConnectionError as err:
-            raise UserWarning('Connect Error: ' + str(err))
-         except requests.exceptions.ReadTimeout as err:
-            if x < retry-1:
-               if self.debug:
-                  print("\r\nDebug " + inspect.currentframe().f_code.co_name + ";\r\n", "Read Timeout, retry in ", str(retry_wait_sec), "sec. ...", "\r\n\r\n",
-                        "#" * 50, "\r\n")
-               time.sleep(retry_wait_sec)
-               continue
-            else:
-               raise UserWarning('HTTP Read Error:, current timeout ' + str(
-                  timeout) + ', you can increase it via key timeout in the *.json file - ' + str(err))
-         except UserWarning as err:
-            raise err
-         except Exception as err:
-            print('Unexpected error: ' + str(err))
-            raise
+      if workers is None:
+         workers = os.cpu_count() or 1
 
-      resJSON = json.loads(res.text)
+      if workers < 1:
+         workers = 1
 
+      if partitions is None:
+         partitions = workers * 4
 
-      last_detected_errors = ''
-      try:
-         msg = ''
-         msg += "\r\n\r\nRequest:\r\n"
-         msg += str(json_byte, 'utf-8')
-         msg += "\r\n\r\nResponse:\r\n"
-         msg += res.text
+      if partitions < 1:
+         partitions = 1
 
-         if res.status_code != 200:
-            raise UserWarning('HTTP Error ' + str(res.status_code) + msg)
+      self.args = (s3bucket_filetype, s3prefix_folder, indexname, bulklimit, configfile, last_modified_timestamp_upd,
+                   stream)
+      self.workers = workers
+      self.partitions = partitions
+      self.quantiles = quantiles
+      self.bulk_load = bulk_load or fresh_index
+      self.fresh_index = fresh_index
+      self.measure = {}
 
-         if resJSON['errors'] != False:
-            for items in resJSON['items']:
-               try:
-                  if items['index']['status'] != 200:
-                     last_detected_errors += 'Doc Id - ' + items['index']['_id'] + "\r\n" + json.dumps(items['index']['error']) + "\r\n\r\n"
-               except KeyError as err:
-                  pass
+   ###########################################################
 
-            # do not raise an error, print only the last_detected_errors instead
-            print('Bulk Error add/update index ' + msg + "\r\n\r\n" + "Last detected errors:\r\n" + last_detected_errors + "\r\n\r\n")
+   def _ranges(self, session):
+      """
+      returns a list of (last key before range, last key of range)
+      """
 
-      except KeyError as err:
-         raise UserWarning('JSON response format error, missing key: ' + str(err) + "\r\n\r\n" + msg)
+      import pymysql
 
-      elapsed_time = time.time() - tick
-      self.measure['timings'].update({'es_bulk': elapsed_time})
+      pk = session.conf.sql_pk
+      if len(pk) == 0:
+         raise UserWarning('JSON file ' + session.config_file +
+                           ' format error, missing key: additional-primary-key-for-full-indexing')
 
-      if self.last_modified_timestamp_upd:
-         self._sqlUpd()
+      if pk.count('.') != 2:
+         raise UserWarning('additional-primary-key-for-full-indexing format error, <schema>.<table>.<field>')
 
-   ###########################################################
+      table = pk[0:pk.rfind('.')]
 
-   def _sqlUpd(self):
-      db = self._rdsConnect()
+      db = session._rdsConnect()
+      cursor = db.cursor()
 
-      retry = None
       try:
-         retry = int(self.config['rds']['retry'])
+         cursor.execute('SELECT MIN(' + pk + '), MAX(' + pk + '), COUNT(*) FROM ' + table)
+         (key_min, key_max, count) = cursor.fetchone()
 
-         if retry < 1:
-            retry = 1
+         if key_min is None:
+            return []
 
-      except KeyError as err:
-         retry = 1
-         pass
+         key_min = int(key_min)
+         key_max = int(key_max)
 
-      retry_wait_sec = None
-      try:
-         retry_wait_sec = int(self.config['rds']['retry_wait_sec'])
-      except KeyError as err:
-         retry_wait_sec = 1
-         pass
+         bounds = []
+         if self.quantiles and count > self.partitions:
+            # one index scan for a sample of ~10000 keys
+            rate = min(1.0, 10000.0 / count)
+            cursor.execute('SELECT ' + pk + ' FROM ' + table + ' WHERE RAND() < ' + str(rate) + ' ORDER BY ' + pk)
+            sample = [int(row[0]) for row in cursor.fetchall()]
 
-      last_mod_field = self.config['sql']['last-modified-timestamp-field']
-      last_mod_field = last_mod_field.split('.')
+            if len(sample) > 0:
+               for i in range(1, self.partitions):
+                  bounds.append(sample[len(sample) * i // self.partitions])
 
+         else:
+            span = key_max - key_min + 1
+            for i in range(1, self.partitions):
+               bounds.append(key_min - 1 + span * i // self.partitions)
 
+      except pymysql.Warning as err:
+         raise UserWarning('SQL warning', err, pk)
+      except pymysql.err.ProgrammingError as err:
+         raise UserWarning('SQL error', err, pk)
 
-      if len(last_mod_field) != 3:
-         raise UserWarning('format error, <schema>.<table>.<field>')
+      bounds = [key_min - 1] + sorted(set(bounds)) + [key_max]
 
-      ###########################################################################
-      # optimized UPDATE I/O workload for better lock handling via single updates in transaction instead of IN()
+      ranges = []
+      for i in range(0, len(bounds) - 1):
+         if bounds[i] < bounds[i + 1]:
+            ranges.append((bounds[i], bounds[i + 1]))
 
-      # sql = 'UPDATE ' + last_mod_field[0] + '.' + last_mod_field[1] + ' SET ' + last_mod_field[
-      #    2] + ' = "1970-01-01 00:00:00" WHERE '
-      #
-      # i = 0
-      # for item in self.upd_keys:
-      #    last_mod_field_upd_key = item.split('=')
-      #    upd_key_name = last_mod_field_upd_key[0]
-      #    upd_key_val = last_mod_field_upd_key[1]
-      #
-      #    if i == 0:
-      #       sql += upd_key_name + ' IN(' + upd_key_val + ','
-      #    else:
-      #       sql += upd_key_val + ','
-      #
-      #    i += 1
-      #
-      # sql = sql[0:-1]
-      # sql += ');'
+      return ranges
 
-      base_sql = 'UPDATE ' + last_mod_field[0] + '.' + last_mod_field[1] + ' SET ' + last_mod_field[2] + ' = "1970-01-01 00:00:00" WHERE '
-      sql = []
+   ###########################################################
 
+   @staticmethod
+   def _partition(args, key_range):
+      with es_indexer_session(*args) as session:
+         session.keyset = True
+         session.key_to = key_range[1]
+         # own metrics per range, a reused worker process would return the cumulative ones of the process,
+         # the metrics of all ranges are exported once by the driver
+         session.metrics = es_metrics(session.conf.metrics, {'index': session.indexname})
+         session.metrics.exporters = []
 
-      for item in self.upd_keys:
-         last_mod_field_upd_key = item.split('=')
-         upd_key_name = last_mod_field_upd_key[0]
-         upd_key_val = last_mod_field_upd_key[1]
+         measure = session.drain(key_range[0])
+         measure['range'] = key_range
+         measure['metrics'] = session.metrics.snapshot()
 
-         sql.append(base_sql + upd_key_name + ' = ' + upd_key_val + ';')
+         return measure
 
-      ###########################################################################
+   ###########################################################
 
-      if self.debug:
-         print("\r\nDebug " + inspect.currentframe().f_code.co_name + ";\r\n", sql, "\r\n\r\n",
-               "Key(s) to Update; " + str(len(self.upd_keys)), "\r\n", "#" * 50, "\r\n")
+   def run(self):
+      """
+      runs all key ranges in the process pool, returns the summed measure of all ranges
+      """
 
       tick = time.time()
 
-      try:
-         lock_messages_error = ['Deadlock found', 'Lock wait timeout exceeded']
-         MAXIMUM_RETRY_ON_DEADLOCK = retry
-         rcount = 0
-         while rcount <= MAXIMUM_RETRY_ON_DEADLOCK:
-            try:
-               cursor = db.cursor()
-               db.begin()
-
-               for upd in sql:
-                  cursor.execute(upd)
+      with es_indexer_session(*self.args) as session:
+         if self.bulk_load:
+            with session.bulk_load(self.fresh_index):
+               # a fresh index has a new name, the config is still the one of the alias
+               configfile = self.args[4] or self.args[2] + '.json'
+               args = self.args[0:2] + (session.indexname, self.args[3], configfile) + self.args[5:]
+               self._run(session, args)
+         else:
+            self._run(session, self.args)
 
-               db.commit()
+      self.measure['wall'] = time.time() - tick
 
-            except pymysql.err.OperationalError as err:
-               (code, message) = err.args
-               if any(msg in message for msg in lock_messages_error):
-                  if  rcount < MAXIMUM_RETRY_ON_DEADLOCK:
-                     rcount += 1
-                     time.sleep(retry_wait_sec)
-                     continue
-                  else:
-                     raise UserWarning('DB Lock Error, retried ' + str(rcount) + ' times with ' + str(retry_wait_sec) + ' sec. per retry', err, sql)
-               else:
-                  raise err
+      if self.measure['wall'] > 0:
+         self.measure['rows_per_sec'] = round(self.measure['indexed'] / self.measure['wall'], 1)
 
-            break
+      session.metrics.gauge('rows_per_sec', self.measure.get('rows_per_sec', 0))
+      session.metrics.observe('run', self.measure['wall'])
+      session.metrics.export()
 
-      except pymysql.Warning as err:
-         raise UserWarning('SQL warning', err, sql)
-      except pymysql.err.ProgrammingError as err:
-         raise UserWarning('SQL error', err, sql)
+      global ES_INDEXER_MEASURE
+      ES_INDEXER_MEASURE = self.measure
 
+      return self.measure
 
-      elapsed_time = time.time() - tick
-      self.measure['timings'].update({'sql_update': elapsed_time})
+   ###########################################################
 
+   def _run(self, session, args):
+      import concurrent.futures
 
-   ###########################################################
+      ranges = self._ranges(session)
 
-   def _do(self):
-      json_byte = self._mapping
+      session.close()  # the workers are forked without open connections
 
-      if len(json_byte) > 0 and len(self.upd_keys) > 0:
-         self._es_bulk(json_byte)
-      elif self.debug:
-         print('Info: no data found for update index - JSON len:', len(json_byte), 'update key count:',
-               len(self.upd_keys))
+      self.measure = {'workers': self.workers, 'partitions': len(ranges), 'batches': 0, 'indexed': 0, 'bulks': 0,
+                      'bytes': 0, 'bytes_sent': 0, 'retried': 0, 'failed': 0, 'invalid': 0, 'skipped': 0,
+                      'timings': {}, 'handshakes': {}, 'ranges': []}
 
-   ###########################################################
+      with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers) as executor:
+         futures = [executor.submit(es_indexer_parallel._partition, args, key_range) for key_range in ranges]
 
-   def enable_debug():
-      global ES_INDEXER_DEBUG
-      ES_INDEXER_DEBUG = True
+         for future in concurrent.futures.as_completed(futures):
+            measure = future.result()
 
-   ###########################################################
+            self.measure['batches'] += measure['batches']
+            self.measure['indexed'] += measure['indexed']
+            self.measure['bulks'] += measure['bulks']
+            self.measure['bytes'] += measure['bytes']
+            self.measure['bytes_sent'] += measure['bytes_sent']
+            self.measure['retried'] += measure['retried']
+            self.measure['failed'] += measure['failed']
+            self.measure['invalid'] += measure['invalid']
+            self.measure['skipped'] += measure['skipped']
+            for key in measure['timings']:  # summed over all processes
+               self.measure['timings'][key] = self.measure['timings'].get(key, 0) + measure['timings'][key]
+            for key in measure['handshakes']:
+               self.measure['handshakes'][key] = self.measure['handshakes'].get(key, 0) + measure['handshakes'][key]
 
-   def disable_debug():
-      global ES_INDEXER_DEBUG
-      ES_INDEXER_DEBUG = False
+            self.measure['ranges'].append({'range': measure['range'], 'indexed': measure['indexed'],
+                                           'total': measure['timings'].get('total', 0)})
 
-   ###########################################################
+            session.metrics.merge(measure['metrics'])
 
-   def measure():
-      global ES_INDEXER_DEBUG
-      return ES_INDEXER_MEASURE
+      self.measure['ranges'].sort(key=lambda item: item['range'][0])
 
 ###########################################################
 ###########################################################
@@ -0,0 +1,370 @@
+"""
+fixtures of the es_indexer tests, MySQL is replaced by sqlite behind pymysql.connect and Elasticsearch by a local
+HTTP server with the endpoints used by es_indexer_lib (_bulk, index HEAD/PUT, _settings and _aliases)
+"""
+
+import os, sys, json, sqlite3, threading, random, gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import pymysql
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+import es_indexer_lib
+
+###########################################################
+###########################################################
+###########################################################
+
+
+
+class FakeCursor:
+   """
+   pymysql cursor on sqlite, %s placeholders are passed as ?
+   """
+
+   def __init__(self, conn):
+      self.conn = conn
+      self.cursor = conn.db.cursor()
+      self.description = None
+      self.rowcount = -1
+
+   ###########################################################
+
+   def execute(self, query, args=None):
+      self.conn.log.append(query)
+      self.cursor.execute(query.replace('%s', '?'), tuple(args or ()))
+      self.description = self.cursor.description
+      self.rowcount = self.cursor.rowcount
+      return self.rowcount
+
+   ###########################################################
+
+   def executemany(self, query, args):
+      self.conn.log.append(query)
+      self.cursor.executemany(query.replace('%s', '?'), [tuple(arg) for arg in args])
+
+   ###########################################################
+
+   def fetchone(self):
+      return self.cursor.fetchone()
+
+   ###########################################################
+
+   def fetchmany(self, size=1):
+      return self.cursor.fetchmany(size)
+
+   ###########################################################
+
+   def fetchall(self):
+      return self.cursor.fetchall()
+
+   ###########################################################
+
+   def close(self):
+      pass
+
+###########################################################
+###########################################################
+###########################################################
+
+
+
+class FakeConnection:
+   """
+   pymysql connection on the sqlite file of the test, the schema mydb is attached, log has all queries
+   """
+
+   def __init__(self, path):
+      self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+      self.db.execute("ATTACH DATABASE '" + path + "' AS mydb")
+      self.db.create_function('RAND', 0, random.random)
+      self.log = []
+      self.open = True
+
+   ###########################################################
+
+   def cursor(self, cursorclass=None):
+      return FakeCursor(self)
+
+   ###########################################################
+
+   def begin(self):
+      self.db.execute('BEGIN')
+
+   ###########################################################
+
+   def commit(self):
+      if self.db.in_transaction:
+         self.db.execute('COMMIT')
+
+   ###########################################################
+
+   def rollback(self):
+      if self.db.in_transaction:
+         self.db.execute('ROLLBACK')
+
+   ###########################################################
+
+   def ping(self, reconnect=True):
+      return True
+
+   ###########################################################
+
+   def close(self):
+      self.open = False
+
+###########################################################
+###########################################################
+###########################################################
+
+
+
+class FakeDatabase:
+   """
+   table mydb.mytable with rows id 1..n, all changed (date_changed after 1970-01-01)
+   """
+
+   def __init__(self, path):
+      self.path = path
+      self.connections = []
+
+   ###########################################################
+
+   def create(self, rows):
+      db = sqlite3.connect(self.path)
+      db.execute('PRAGMA journal_mode=WAL')
+      db.execute('CREATE TABLE mytable (id INTEGER PRIMARY KEY, firstname TEXT, surname TEXT, age INT, '
+                 'json_payload TEXT, date_changed TEXT)')
+      for pk in range(1, rows + 1):
+         db.execute('INSERT INTO mytable VALUES (?, ?, ?, ?, ?, ?)', (pk, 'fn' + str(pk) + ' "q"', 'sn' + str(pk),
+                    pk % 90, json.dumps({'a': pk, 'b': 'x'}), '2020-01-01 00:00:00'))
+      db.commit()
+      db.close()
+
+   ###########################################################
+
+   def connect(self, **kwargs):
+      conn = FakeConnection(self.path)
+      self.connections.append(conn)
+      return conn
+
+   ###########################################################
+
+   def execute(self, query, args=()):
+      db = sqlite3.connect(self.path)
+      rows = db.execute(query, args).fetchall()
+      db.commit()
+      db.close()
+      return rows
+
+   ###########################################################
+
+   def changed(self):
+      # ids of the rows not reset yet
+      return [row[0] for row in self.execute("SELECT id FROM mytable WHERE date_changed != '1970-01-01 00:00:00' "
+                                             "ORDER BY id")]
+
+   ###########################################################
+
+   def touch(self, where='1 = 1'):
+      self.execute("UPDATE mytable SET date_changed = '2021-01-01 00:00:00' WHERE " + where)
+
+   ###########################################################
+
+   def queries(self):
+      return [query for conn in self.connections for query in conn.log]
+
+###########################################################
+###########################################################
+###########################################################
+
+
+
+class FakeElasticsearch:
+   """
+   state of the ES stand-in, fail: id or (index, id) -> item status, reject: id -> number of 429 before success,
+   items_delta: items added to (> 0) or removed from (< 0) each bulk response
+   """
+
+   def __init__(self):
+      self.reset()
+
+   ###########################################################
+
+   def reset(self):
+      self.docs = {}
+      self.bulks = []
+      self.indices = set()
+      self.fail = {}
+      self.reject = {}
+      self.items_delta = 0
+
+   ###########################################################
+
+   def bulk(self, body):
+      lines = body.split(b'\n')
+      items = []
+      for pos in range(0, len(lines) - 1, 2):
+         action = json.loads(lines[pos])['index']
+         (index, doc_id) = (action['_index'], action['_id'])
+         self.bulks[-1].append((index, doc_id))
+
+         status = self.fail.get((index, doc_id), self.fail.get(doc_id))
+         if status is None and self.reject.get(doc_id, 0) > 0:
+            self.reject[doc_id] -= 1
+            status = 429
+
+         if status is None:
+            self.docs[(index, doc_id)] = json.loads(lines[pos + 1])
+            self.indices.add(index)
+            items.append({'index': {'_index': index, '_id': doc_id, 'status': 201}})
+         else:
+            items.append({'index': {'_index': index, '_id': doc_id, 'status': status,
+                                    'error': {'type': 'es_rejected_execution_exception'}}})
+
+      errors = any(item['index']['status'] >= 300 for item in items)
+      if self.items_delta < 0:
+         items = items[:self.items_delta]
+      elif self.items_delta > 0:
+         items += items[:self.items_delta]
+
+      return {'took': 1, 'errors': errors, 'items': items}
+
+
+ES = FakeElasticsearch()
+
+###########################################################
+###########################################################
+###########################################################
+
+
+
+class Handler(BaseHTTPRequestHandler):
+   protocol_version = 'HTTP/1.1'
+
+   def log_message(self, *args):
+      pass
+
+   ###########################################################
+
+   def _send(self, status, body=b'{"acknowledged":true}'):
+      self.send_response(status)
+      self.send_header('Content-Type', 'application/json')
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      if self.command != 'HEAD':
+         self.wfile.write(body)
+
+   ###########################################################
+
+   def _body(self):
+      body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+      if self.headers.get('Content-Encoding') == 'gzip':
+         body = gzip.decompress(body)
+      return body
+
+   ###########################################################
+
+   def do_HEAD(self):
+      self._send(200 if self.path.strip('/') in ES.indices else 404)
+
+   ###########################################################
+
+   def do_GET(self):
+      self._send(404, b'{}')
+
+   ###########################################################
+
+   def do_PUT(self):
+      body = self._body()
+      path = self.path.strip('/')
+
+      if path.endswith('_bulk'):
+         ES.bulks.append([])
+         return self._send(200, json.dumps(ES.bulk(body)).encode('utf-8'))
+
+      if '/' not in path:
+         ES.indices.add(path)
+      self._send(200)
+
+   ###########################################################
+
+   def do_POST(self):
+      self.do_PUT()
+
+###########################################################
+###########################################################
+###########################################################
+
+
+
+@pytest.fixture(scope='session')
+def es_endpoint():
+   server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+   threading.Thread(target=server.serve_forever, daemon=True).start()
+   yield 'http://127.0.0.1:' + str(server.server_address[1])
+   server.shutdown()
+
+###########################################################
+
+@pytest.fixture
+def es(es_endpoint):
+   ES.reset()
+   ES.endpoint = es_endpoint
+   return ES
+
+###########################################################
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+   database = FakeDatabase(str(tmp_path / 'mydb.sqlite'))
+   database.create(100)
+   monkeypatch.setattr(pymysql, 'connect', database.connect)
+   return database
+
+###########################################################
+
+@pytest.fixture(autouse=True)
+def lib_state(monkeypatch):
+   # module state shared by the invocations of a process
+   monkeypatch.setattr(es_indexer_lib.es_config, 'ttl', 0)
+   es_indexer_lib.ES_INDEXER_POOL.clear()
+   es_indexer_lib.ES_INDEXER_INDEX_EXISTS.clear()
+   es_indexer_lib.ES_INDEXER_CONFIG_CACHE.clear()
+   es_indexer_lib.ES_INDEXER_HASH_CACHES.clear()
+   yield
+   es_indexer_lib.ES_INDEXER_POOL.clear()
+
+###########################################################
+
+@pytest.fixture
+def config(tmp_path, es):
+   """
+   config of the index test in tmp_path, config.write() stores it, config.folder is the s3prefix_folder of the
+   file:// source (relative to the parent folder of es_indexer_lib.py)
+   """
+
+   class Config(dict):
+      folder = os.path.relpath(str(tmp_path), os.path.dirname(PACKAGE_DIR))
+
+      def write(self):
+         with open(str(tmp_path / 'test.json'), 'w') as hFile:
+            json.dump(self, hFile)
+
+   conf = Config({
+      'rds': {'endpoint': 'localhost:3306', 'user': 'u', 'password': 'p'},
+      'es': {'endpoint': es.endpoint, 'timeout': 5, 'item_retry_wait_sec': 0.01},
+      'sql': {'last-modified-timestamp-field': 'mydb.mytable.date_changed',
+              'last-modified-timestamp-upd-key': 'id=$id_user', 'sort': 'ASC',
+              'additional-primary-key-for-full-indexing': 'mydb.mytable.id',
+              'data': [{'schema': 'mydb', 'table': 'mytable',
+                        'fields': ['id AS id_user', 'firstname', 'surname', 'age', 'json_payload']}]},
+      'settings': {'replicas': 1, 'shards': 2},
+      'mapping': {'_id': '$id_user', '_type': '_doc', 'id_user': '$id_user',
+                  'name': {'first': '$firstname', 'last': '$surname'}, 'age': '$age', 'json_payload': '$json_payload'}
+   })
+   conf.write()
+   return conf
@@ -0,0 +1,81 @@
+"""
+per-document results of a bulk request: retry of rejected documents, pending and invalid documents and the reset
+of the acknowledged rows
+"""
+
+from es_indexer_lib import es_indexer
+
+
+def run(config, limit=1000):
+   es_indexer('file://', config.folder, 'test', limit)
+   return es_indexer.measure()
+
+###########################################################
+
+def test_acknowledged_rows_are_reset(db, es, config):
+   m = run(config)
+
+   assert m['failed'] == 0
+   assert len(es.docs) == 100
+   assert es.docs[('test', '7')]['name'] == {'first': 'fn7 "q"', 'last': 'sn7'}
+   assert db.changed() == []
+
+###########################################################
+
+def test_rejected_documents_are_retried_alone(db, es, config):
+   es.reject = {'10': 2, '11': 1}
+
+   m = run(config)
+
+   assert m['retried'] == 3
+   assert m['failed'] == 0
+   assert [len(bulk) for bulk in es.bulks] == [100, 2, 1]
+   assert es.bulks[1] == [('test', '10'), ('test', '11')]
+   assert db.changed() == []
+
+###########################################################
+
+def test_rejected_after_all_retries_stay_pending(db, es, config):
+   config['es']['item_retry'] = 2
+   config.write()
+   es.reject = {'12': 10}
+
+   m = run(config)
+
+   assert m['failed'] == 1
+   assert len(es.bulks) == 3
+   assert db.changed() == [12]
+
+###########################################################
+
+def test_invalid_documents_are_reset_unavailable_stay_pending(db, es, config):
+   es.fail = {'5': 400, '6': 503}
+
+   m = run(config)
+
+   assert (m['invalid'], m['failed']) == (1, 1)
+   assert len(es.bulks) == 1  # not retryable
+   assert db.changed() == [6]
+
+###########################################################
+
+def test_hold_invalid_keeps_invalid_documents_pending(db, es, config):
+   config['es']['item_hold_invalid'] = True
+   config.write()
+   es.fail = {'5': 400}
+
+   m = run(config)
+
+   assert m['failed'] == 1
+   assert db.changed() == [5]
+
+###########################################################
+
+def test_items_not_matching_the_documents_fail_the_request(db, es, config):
+   for delta in (-1, 1):
+      es.items_delta = delta
+
+      m = run(config)
+
+      assert m['failed'] == 100
+      assert len(db.changed()) == 100
@@ -0,0 +1,57 @@
+"""
+checkpoint mode, the high-water mark (timestamp, key) replaces the reset of the last-modified field
+"""
+
+import json
+
+from es_indexer_lib import es_indexer
+
+
+def run(config, limit=1000):
+   es_indexer('file://', config.folder, 'test', limit)
+   return es_indexer.measure()
+
+###########################################################
+
+def checkpoint(tmp_path):
+   with open(str(tmp_path / 'test.checkpoint.json')) as hFile:
+      return json.load(hFile)
+
+###########################################################
+
+def test_progress_without_reset(db, es, config, tmp_path):
+   config['checkpoint'] = {'enabled': True}
+   config.write()
+
+   m = run(config, 40)
+   assert m['indexed'] == 40
+   assert checkpoint(tmp_path) == {'ts': '2020-01-01 00:00:00', 'key': 40}
+
+   m = run(config)
+   assert m['indexed'] == 60
+   assert checkpoint(tmp_path) == {'ts': '2020-01-01 00:00:00', 'key': 100}
+
+   assert run(config)['indexed'] == 0
+   assert len(db.changed()) == 100  # no reset
+
+   db.touch('id IN (3, 5)')
+   m = run(config)
+   assert m['indexed'] == 2
+   assert checkpoint(tmp_path) == {'ts': '2021-01-01 00:00:00', 'key': 5}
+
+###########################################################
+
+def test_failure_keeps_the_progress_before_it(db, es, config, tmp_path):
+   config['checkpoint'] = {'enabled': True}
+   config['es']['bulk_max_docs'] = 10
+   config.write()
+   es.fail = {'25': 503}
+
+   m = run(config, 40)
+   assert m['failed'] == 1
+   assert checkpoint(tmp_path)['key'] == 24
+
+   es.fail = {}
+   run(config, 10)
+   assert sorted(int(doc_id) for index, doc_id in es.bulks[-1]) == list(range(25, 35))
+   assert checkpoint(tmp_path)['key'] == 34
@@ -0,0 +1,63 @@
+"""
+several target indices per row (targets), shared or per-target bulk requests via es.fanout
+"""
+
+import pytest
+
+from es_indexer_lib import es_indexer_session
+
+
+@pytest.fixture
+def targets(config):
+   config['targets'] = [{'index': 'people'},
+                        {'index': 'ages', 'mapping': {'_id': '$id_user', '_type': '_doc', 'age': '$age'}}]
+   config.write()
+   return config
+
+###########################################################
+
+def drain(config, limit=1000):
+   with es_indexer_session('file://', config.folder, 'test', limit) as session:
+      return session.drain()
+
+###########################################################
+
+def test_shared_request_per_bulk(db, es, targets):
+   total = drain(targets, 60)
+
+   assert total['indexed'] == 100  # rows
+   assert len(es.docs) == 200
+   assert [len(bulk) for bulk in es.bulks] == [60, 60, 60, 20]  # max. bulklimit documents
+   assert es.bulks[0][0:2] == [('people', '1'), ('ages', '1')]  # documents of a row in the same bulk
+   assert es.bulks[0][-1] == ('ages', '30')
+   assert es.docs[('ages', '7')] == {'age': 7}
+   assert es.docs[('people', '7')]['name']['last'] == 'sn7'
+   assert db.changed() == []
+
+###########################################################
+
+def test_per_target_request_per_index(db, es, targets):
+   targets['es']['fanout'] = 'per-target'
+   targets.write()
+
+   drain(targets)
+
+   assert [sorted(set(index for index, doc_id in bulk)) for bulk in es.bulks] == [['people'], ['ages']]
+   assert db.changed() == []
+
+###########################################################
+
+@pytest.mark.parametrize('fanout', ['shared', 'per-target'])
+def test_row_reset_after_all_targets(db, es, targets, fanout):
+   targets['es']['fanout'] = fanout
+   targets.write()
+   es.fail = {('ages', '3'): 503}
+
+   total = drain(targets)
+   assert total['failed'] == 1
+   assert ('people', '3') in es.docs
+   assert db.changed() == [3]
+
+   es.fail = {}
+   drain(targets)
+   assert db.changed() == []
@@ -0,0 +1,57 @@
+"""
+hash cache, incremental runs skip the documents unchanged since they were acknowledged
+"""
+
+from es_indexer_lib import es_indexer_session, es_hash_cache
+
+
+def drain(config, limit=1000):
+   with es_indexer_session('file://', config.folder, 'test', limit) as session:
+      return session.drain()
+
+###########################################################
+
+def test_unchanged_documents_are_skipped_and_reset(db, es, config, tmp_path):
+   config['hash_cache'] = {'enabled': True, 'path': str(tmp_path / 'hashes.sqlite')}
+   config.write()
+
+   total = drain(config)
+   assert (total['indexed'], total['skipped']) == (100, 0)
+
+   db.touch()
+   db.execute("UPDATE mytable SET age = 99 WHERE id = 5")
+   bulks = len(es.bulks)
+
+   total = drain(config)
+   assert total['skipped'] == 99
+   assert es.bulks[bulks:] == [[('test', '5')]]
+   assert es.docs[('test', '5')]['age'] == 99
+   assert db.changed() == []  # skipped documents count as acknowledged
+
+###########################################################
+
+def test_failed_documents_are_not_cached(db, es, config, tmp_path):
+   config['hash_cache'] = {'enabled': True, 'path': str(tmp_path / 'hashes.sqlite')}
+   config.write()
+   es.fail = {'5': 503}
+
+   drain(config)
+   es.fail = {}
+   db.touch()
+   bulks = len(es.bulks)
+
+   total = drain(config)
+   assert total['skipped'] == 99
+   assert es.bulks[bulks:] == [[('test', '5')]]
+
+###########################################################
+
+def test_evict_oldest_entries(tmp_path):
+   cache = es_hash_cache(str(tmp_path / 'hashes.sqlite'), 100)
+   cache.put([('i', str(n), b'x') for n in range(150)])
+
+   cache.evict()
+
+   assert cache.count <= 100
+   assert cache.get('i', '149') == b'x'
+   assert cache.get('i', '0') is None
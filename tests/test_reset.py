@@ -0,0 +1,93 @@
+"""
+parameterized reset statements of rds.reset_strategy
+"""
+
+import types
+
+import pytest
+
+from es_indexer_lib import es_indexer, es_config
+
+
+def indexer():
+   # only the state used by _sqlUpdStatements
+   idx = es_indexer.__new__(es_indexer)
+   idx.upd_key_name = 'id'
+   return idx
+
+###########################################################
+
+def test_single_one_update_per_key():
+   sql = indexer()._sqlUpdStatements(types.SimpleNamespace(), 'single', 500, 'mydb.mytable', 'date_changed', [1, 2])
+
+   assert sql == [('UPDATE mydb.mytable SET date_changed = "1970-01-01 00:00:00" WHERE id = %s', (1,), False),
+                  ('UPDATE mydb.mytable SET date_changed = "1970-01-01 00:00:00" WHERE id = %s', (2,), False)]
+
+###########################################################
+
+def test_in_one_update_per_chunk():
+   sql = indexer()._sqlUpdStatements(types.SimpleNamespace(), 'in', 2, 'mydb.mytable', 'date_changed', [1, 2, 3])
+
+   assert sql == [('UPDATE mydb.mytable SET date_changed = "1970-01-01 00:00:00" WHERE id IN (%s, %s)', [1, 2], False),
+                  ('UPDATE mydb.mytable SET date_changed = "1970-01-01 00:00:00" WHERE id IN (%s)', [3], False)]
+
+###########################################################
+
+def test_temp_table_created_until_marked():
+   db = types.SimpleNamespace()
+   idx = indexer()
+
+   sql = idx._sqlUpdStatements(db, 'temp-table', 2, 'mydb.mytable', 'date_changed', [1, 2, 3])
+   assert [query.split(' (')[0] for query, args, many in sql] == [
+      'CREATE TEMPORARY TABLE IF NOT EXISTS es_indexer_reset_big', 'DELETE FROM es_indexer_reset_big',
+      'INSERT IGNORE INTO es_indexer_reset_big', 'INSERT IGNORE INTO es_indexer_reset_big',
+      'UPDATE mydb.mytable JOIN es_indexer_reset_big ON mydb.mytable.id = es_indexer_reset_big.k SET '
+      'mydb.mytable.date_changed = "1970-01-01 00:00:00"']
+   assert sql[2][1:] == ([(1,), (2,)], True)
+   assert db.es_indexer_reset_tables == set()  # marked by _sqlUpd after the commit
+
+   db.es_indexer_reset_tables.add('es_indexer_reset_big')
+   sql = idx._sqlUpdStatements(db, 'temp-table', 2, 'mydb.mytable', 'date_changed', [1])
+   assert sql[0][0] == 'DELETE FROM es_indexer_reset_big'
+
+   sql = idx._sqlUpdStatements(db, 'temp-table', 2, 'mydb.mytable', 'date_changed', ['a'])
+   assert sql[0][0] == 'CREATE TEMPORARY TABLE IF NOT EXISTS es_indexer_reset_var (k VARCHAR(255) NOT NULL PRIMARY KEY)'
+
+###########################################################
+
+def test_unknown_strategy():
+   with pytest.raises(UserWarning):
+      indexer()._sqlUpdStatements(types.SimpleNamespace(), 'x', 2, 'mydb.mytable', 'date_changed', [1])
+
+###########################################################
+
+def test_executemany_runs_as_in(config):
+   config['rds']['reset_strategy'] = 'executemany'
+
+   assert es_config(config).rds_reset_strategy == 'in'
+
+###########################################################
+
+@pytest.mark.parametrize('strategy, updates', [('single', 100), ('in', 4)])
+def test_strategies_reset_all_rows(db, es, config, strategy, updates):
+   config['rds'].update({'reset_strategy': strategy, 'reset_chunk_size': 30})
+   config.write()
+
+   es_indexer('file://', config.folder, 'test', 1000)
+
+   assert db.changed() == []
+   assert len([query for query in db.queries() if query.startswith('UPDATE mydb.mytable')]) == updates
+
+###########################################################
+
+def test_failed_temp_table_reset_does_not_mark_the_table(db, es, config):
+   # sqlite has no INSERT IGNORE, the reset fails after the CREATE
+   config['rds']['reset_strategy'] = 'temp-table'
+   config.write()
+
+   with pytest.raises(Exception):
+      es_indexer('file://', config.folder, 'test', 1000)
+
+   assert any(query.startswith('CREATE TEMPORARY TABLE') for query in db.queries())
+   assert [conn.es_indexer_reset_tables for conn in db.connections if hasattr(conn, 'es_indexer_reset_tables')] == [set()]
+   assert len(db.changed()) == 100